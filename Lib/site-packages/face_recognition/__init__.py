@@ -4,4 +4,10 @@ __author__ = """Adam Geitgey"""
 __email__ = 'ageitgey@gmail.com'
 __version__ = '1.2.3'
 
-from .api import load_image_file, face_locations, batch_face_locations, face_landmarks, face_encodings, compare_faces, face_distance
+from .api import load_image_file, load_image_file_bounded, face_locations, cascade_face_locations, tiled_face_locations, batch_face_locations, face_landmarks, face_landmarks_array, face_encodings, compare_faces, face_distance
+from .pipeline import FacePipeline
+from .jitter import jittered_face_encodings
+from .matcher import FaceMatcher, calibrate_thresholds
+from .quantize import QuantizedGallery
+from .snapshot import GallerySnapshot
+from .shard import ShardedMatcher
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 
+import os
+import time
+import threading
 import PIL.Image
 import dlib
 import numpy as np
@@ -65,13 +68,17 @@ def face_distance(face_encodings, face_to_compare):
     Given a list of face encodings, compare them to a known face encoding and get a euclidean distance
     for each comparison face. The distance tells you how similar the faces are.
 
+    Distances are computed in float32, the precision the face encodings are produced in.
+
     :param faces: List of face encodings to compare
     :param face_to_compare: A face encoding to compare against
     :return: A numpy ndarray with the distance for each face in the same order as the 'faces' array
     """
     if len(face_encodings) == 0:
-        return np.empty((0))
+        return np.empty((0), dtype=np.float32)
 
+    face_encodings = np.asarray(face_encodings, dtype=np.float32)
+    face_to_compare = np.asarray(face_to_compare, dtype=np.float32)
     return np.linalg.norm(face_encodings - face_to_compare, axis=1)
 
 
@@ -89,6 +96,61 @@ def load_image_file(file, mode='RGB'):
     return np.array(im)
 
 
+_bomb_limit_lock = threading.Lock()
+
+
+def load_image_file_bounded(file, max_pixels, mode='RGB'):
+    """
+    Loads an image file into a numpy array of at most max_pixels pixels, shrinking larger images to fit. JPEGs are
+    decoded straight at a reduced scale (1/2, 1/4 or 1/8), so the full-size image is never held in memory; one
+    more than 64 times larger than max_pixels would still be over it at 1/8 scale, so it is rejected. Other
+    formats can only be decoded at full size, so one larger than max_pixels is rejected before it is decoded.
+
+    :param file: image file name or file object to load
+    :param max_pixels: The most pixels (width x height) the returned image may have
+    :param mode: format to convert the image to. Only 'RGB' (8-bit RGB, 3 channels) and 'L' (black and white) are supported.
+    :return: (image contents as numpy array, scale of the returned image relative to the file's size)
+    """
+    # Opening only reads the header, so Pillow's decompression bomb limit is lifted for this call alone: the
+    # size checks below decide what gets decoded. The lock keeps concurrent calls from restoring each other's
+    # lifted limit.
+    with _bomb_limit_lock:
+        bomb_limit = PIL.Image.MAX_IMAGE_PIXELS
+        PIL.Image.MAX_IMAGE_PIXELS = None
+        try:
+            im = PIL.Image.open(file)
+        finally:
+            PIL.Image.MAX_IMAGE_PIXELS = bomb_limit
+    width, height = im.size
+    if im.format == "JPEG":
+        # 1/8 scale in each dimension is the smallest JPEGs can be decoded at
+        limit = 64 * max_pixels
+        if width * height > limit:
+            im.close()
+            raise PIL.Image.DecompressionBombError("Image size ({} pixels) exceeds limit of {} pixels for JPEG "
+                                                   "images, which can be shrunk at most 8 times while decoding"
+                                                   .format(width * height, limit))
+    else:
+        limit = min(max_pixels, 2 * bomb_limit) if bomb_limit else max_pixels
+        if width * height > limit:
+            im.close()
+            raise PIL.Image.DecompressionBombError("Image size ({} pixels) exceeds limit of {} pixels for non-JPEG "
+                                                   "images, which can't be shrunk while decoding"
+                                                   .format(width * height, limit))
+    if width * height <= max_pixels:
+        return np.array(im.convert(mode) if mode else im), 1.0
+
+    scale = (max_pixels / float(width * height)) ** 0.5
+    size = (max(int(width * scale), 1), max(int(height * scale), 1))
+    # Only JPEG supports draft(); it picks the smallest DCT scale that is still at least size
+    im.draft(mode, size)
+    if mode:
+        im = im.convert(mode)
+    if im.size != size:
+        im = im.resize(size, PIL.Image.LANCZOS)
+    return np.array(im), size[0] / float(width)
+
+
 def _raw_face_locations(img, number_of_times_to_upsample=1, model="hog"):
     """
     Returns an array of bounding boxes of human faces in a image
@@ -96,15 +158,185 @@ def _raw_face_locations(img, number_of_times_to_upsample=1, model="hog"):
     :param img: An image (as a numpy array)
     :param number_of_times_to_upsample: How many times to upsample the image looking for faces. Higher numbers find smaller faces.
     :param model: Which face detection model to use. "hog" is less accurate but faster on CPUs. "cnn" is a more accurate
-                  deep-learning model which is GPU/CUDA accelerated (if available). The default is "hog".
+                  deep-learning model which is GPU/CUDA accelerated (if available). "haar+hog" and "haar+cnn" only run
+                  that model on regions proposed by an OpenCV Haar cascade (see cascade_face_locations()). The default is "hog".
     :return: A list of dlib 'rect' objects of found face locations
     """
     if model == "cnn":
         return cnn_face_detector(img, number_of_times_to_upsample)
+    elif model in ("haar+hog", "haar+cnn"):
+        return [_css_to_rect(css) for css in cascade_face_locations(img, number_of_times_to_upsample, model[5:])]
     else:
         return face_detector(img, number_of_times_to_upsample)
 
 
+_haar_cascades = {}
+
+
+def _haar_cascade(cascade_file=None):
+    # OpenCV is only needed for the cascade models, so it is imported on first use
+    import cv2
+
+    if cascade_file is None:
+        cascade_file = os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml")
+    if cascade_file not in _haar_cascades:
+        cascade = cv2.CascadeClassifier(cascade_file)
+        if cascade.empty():
+            raise ValueError("Could not load Haar cascade from {}".format(cascade_file))
+        _haar_cascades[cascade_file] = cascade
+    return _haar_cascades[cascade_file]
+
+
+def _box_overlap(a, b):
+    """
+    Intersection over union of two boxes in css (top, right, bottom, left) order
+    """
+    height = min(a[2], b[2]) - max(a[0], b[0])
+    width = min(a[1], b[1]) - max(a[3], b[3])
+    if height <= 0 or width <= 0:
+        return 0.0
+    intersection = height * width
+    union = (a[2] - a[0]) * (a[1] - a[3]) + (b[2] - b[0]) * (b[1] - b[3]) - intersection
+    return intersection / float(union)
+
+
+def _suppress_duplicate_locations(face_locations, overlap_threshold=0.3):
+    """
+    Non-maximum suppression for face boxes found by more than one detector pass (overlapping crops or tiles).
+    Larger boxes are kept over smaller boxes that overlap them by more than overlap_threshold.
+
+    :param face_locations: A list of tuples of face locations in css (top, right, bottom, left) order
+    :return: The face locations with duplicates removed
+    """
+    by_area = sorted(face_locations, key=lambda css: (css[2] - css[0]) * (css[1] - css[3]), reverse=True)
+    kept = []
+    for css in by_area:
+        if all(_box_overlap(css, other) <= overlap_threshold for other in kept):
+            kept.append(css)
+    return kept
+
+
+def _merge_regions(regions):
+    """
+    Merges overlapping regions (in css order) into their bounding boxes, so no pixel is verified twice.
+    """
+    regions = list(regions)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(regions)):
+            for j in range(i + 1, len(regions)):
+                a, b = regions[i], regions[j]
+                if a[0] < b[2] and b[0] < a[2] and a[3] < b[1] and b[3] < a[1]:
+                    regions[i] = (min(a[0], b[0]), max(a[1], b[1]), max(a[2], b[2]), min(a[3], b[3]))
+                    del regions[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return regions
+
+
+def cascade_face_locations(img, number_of_times_to_upsample=1, model="hog", cascade_scale=0.5, padding=0.5,
+                           min_face_size=40, cascade_file=None, timings=None):
+    """
+    Two-stage face detection: a fast OpenCV Haar cascade on a downscaled greyscale copy of the image proposes
+    candidate regions, and the dlib detector ("hog" or "cnn") only runs on those regions to confirm them. On large
+    frames with few faces this is much cheaper than running HOG over the whole image. Faces the cascade misses
+    entirely (e.g. strongly turned heads) are not found.
+
+    :param img: An image (as a numpy array)
+    :param number_of_times_to_upsample: How many times the dlib detector upsamples each region.
+    :param model: Which dlib model verifies the proposals, "hog" (default) or "cnn".
+    :param cascade_scale: The image is resized by this factor before the cascade runs.
+    :param padding: How much to grow each proposal, as a fraction of its size, before verifying it.
+    :param min_face_size: Smallest face (in pixels of the full image) the cascade looks for.
+    :param cascade_file: Optional - a Haar cascade .xml file. The default is OpenCV's haarcascade_frontalface_default.xml.
+    :param timings: Optional - a dict. The seconds spent in the "cascade" and "verify" stages and the number of
+                    "proposals" are added to it.
+    :return: A list of tuples of found face locations in css (top, right, bottom, left) order
+    """
+    import cv2
+
+    started = time.perf_counter()
+    height, width = img.shape[:2]
+    small = cv2.resize(img, (0, 0), fx=cascade_scale, fy=cascade_scale, interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY) if small.ndim == 3 else small
+    min_size = max(int(min_face_size * cascade_scale), 12)
+    detections = _haar_cascade(cascade_file).detectMultiScale(gray, scaleFactor=1.1, minNeighbors=3,
+                                                              minSize=(min_size, min_size))
+
+    regions = []
+    for (x, y, w, h) in detections:
+        pad_x, pad_y = w * padding, h * padding
+        top = max(int((y - pad_y) / cascade_scale), 0)
+        left = max(int((x - pad_x) / cascade_scale), 0)
+        bottom = min(int((y + h + pad_y) / cascade_scale), height)
+        right = min(int((x + w + pad_x) / cascade_scale), width)
+        regions.append((top, right, bottom, left))
+    regions = _merge_regions(regions)
+    proposed = time.perf_counter()
+
+    found = []
+    for top, right, bottom, left in regions:
+        crop = np.ascontiguousarray(img[top:bottom, left:right])
+        for css in face_locations(crop, number_of_times_to_upsample, model):
+            found.append((css[0] + top, css[1] + left, css[2] + top, css[3] + left))
+    found = _suppress_duplicate_locations(found)
+
+    if timings is not None:
+        timings["cascade"] = timings.get("cascade", 0.0) + proposed - started
+        timings["verify"] = timings.get("verify", 0.0) + time.perf_counter() - proposed
+        timings["proposals"] = timings.get("proposals", 0) + len(regions)
+    return found
+
+
+def _tile_starts(length, tile_size, step):
+    if length <= tile_size:
+        return [0]
+    return list(range(0, length - tile_size, step)) + [length - tile_size]
+
+
+def tiled_face_locations(img, number_of_times_to_upsample=1, model="hog", tile_size=1024, tile_overlap=256):
+    """
+    Finds faces in a large image one tile at a time, so the detector's working memory (its image pyramid and HOG
+    features or CNN activations) depends on tile_size rather than on the size of the image.
+
+    Tiles overlap by tile_overlap pixels, so a face no larger than that which is cut by the edge of one tile lies
+    wholly inside its neighbour. Boxes that touch an inner tile edge are joined with the pieces of the same face
+    from other tiles and only kept when no box from inside a tile overlaps them. The rest are de-duplicated with
+    non-maximum suppression.
+
+    :param img: An image (as a numpy array)
+    :param number_of_times_to_upsample: How many times to upsample each tile looking for faces.
+    :param model: Which face detection model to use, as for face_locations()
+    :param tile_size: Width and height of each tile in pixels
+    :param tile_overlap: How many pixels neighbouring tiles share. Should be at least the largest face size.
+    :return: A list of tuples of found face locations in css (top, right, bottom, left) order
+    """
+    if not 0 <= tile_overlap < tile_size:
+        raise ValueError("tile_overlap must be at least 0 and smaller than tile_size")
+
+    height, width = img.shape[:2]
+    step = tile_size - tile_overlap
+    inside = []
+    on_edge = []
+    for top in _tile_starts(height, tile_size, step):
+        for left in _tile_starts(width, tile_size, step):
+            bottom, right = min(top + tile_size, height), min(left + tile_size, width)
+            tile = np.ascontiguousarray(img[top:bottom, left:right])
+            for css in face_locations(tile, number_of_times_to_upsample, model):
+                box = (css[0] + top, css[1] + left, css[2] + top, css[3] + left)
+                cut = ((box[0] <= top and top > 0) or (box[1] >= right and right < width)
+                       or (box[2] >= bottom and bottom < height) or (box[3] <= left and left > 0))
+                (on_edge if cut else inside).append(box)
+
+    # Pieces of a face larger than the overlap, cut by the edges of several tiles, are joined back together
+    on_edge = _merge_regions(on_edge)
+    found = inside + [box for box in on_edge if all(_box_overlap(box, other) == 0.0 for other in inside)]
+    return _suppress_duplicate_locations(found)
+
+
 def face_locations(img, number_of_times_to_upsample=1, model="hog"):
     """
     Returns an array of bounding boxes of human faces in a image
@@ -165,6 +397,44 @@ def _raw_face_landmarks(face_image, face_locations=None, model="large"):
     return [pose_predictor(face_image, face_location) for face_location in face_locations]
 
 
+def _iter_landmark_coordinates(raw_landmarks):
+    for landmark in raw_landmarks:
+        for point in landmark.parts():
+            yield point.x
+            yield point.y
+
+
+def _raw_landmarks_to_array(raw_landmarks, num_parts):
+    """
+    Pack a list of dlib 'full_object_detection' objects into a single numpy array
+
+    :param raw_landmarks: A list of dlib 'full_object_detection' objects
+    :param num_parts: How many points each landmark set has (68 for the "large" model, 5 for the "small" model)
+    :return: A numpy array of shape (number of faces, num_parts, 2) holding (x, y) coordinates
+    """
+    count = len(raw_landmarks) * num_parts * 2
+    points = np.fromiter(_iter_landmark_coordinates(raw_landmarks), dtype=np.int32, count=count)
+    return points.reshape((len(raw_landmarks), num_parts, 2))
+
+
+def face_landmarks_array(face_image, face_locations=None, model="large"):
+    """
+    Given an image, returns the face feature locations for each face in the image packed into one numpy array.
+    This returns the same points as face_landmarks() without building a dict of lists of tuples for every face.
+
+    :param face_image: image to search
+    :param face_locations: Optionally provide a list of face locations to check.
+    :param model: Optional - which model to use. "large" (default) or "small" which only returns 5 points but is faster.
+    :return: A numpy array of shape (faces, 68, 2) for the "large" model or (faces, 5, 2) for the "small" model
+             holding (x, y) coordinates
+    """
+    if model not in ("small", "large"):
+        raise ValueError("Invalid landmarks model type. Supported models are ['small', 'large'].")
+
+    landmarks = _raw_face_landmarks(face_image, face_locations, model)
+    return _raw_landmarks_to_array(landmarks, 5 if model == "small" else 68)
+
+
 def face_landmarks(face_image, face_locations=None, model="large"):
     """
     Given an image, returns a dict of face feature locations (eyes, nose, etc) for each face in the image
@@ -175,6 +445,10 @@ def face_landmarks(face_image, face_locations=None, model="large"):
     :return: A list of dicts of face feature locations (eyes, nose, etc)
     """
     landmarks = _raw_face_landmarks(face_image, face_locations, model)
+    return _landmarks_to_dicts(landmarks, model)
+
+
+def _landmarks_to_dicts(landmarks, model):
     landmarks_as_tuples = [[(p.x, p.y) for p in landmark.parts()] for landmark in landmarks]
 
     # For a definition of each point index, see https://cdn-images-1.medium.com/max/1600/1*AbEg31EgkbXSQehuNJBlWg.png
@@ -208,10 +482,10 @@ def face_encodings(face_image, known_face_locations=None, num_jitters=1, model="
     :param known_face_locations: Optional - the bounding boxes of each face if you already know them.
     :param num_jitters: How many times to re-sample the face when calculating encoding. Higher is more accurate, but slower (i.e. 100 is 100x slower)
     :param model: Optional - which model to use. "large" (default) or "small" which only returns 5 points but is faster.
-    :return: A list of 128-dimensional face encodings (one for each face in the image)
+    :return: A list of 128-dimensional float32 face encodings (one for each face in the image)
     """
     raw_landmarks = _raw_face_landmarks(face_image, known_face_locations, model)
-    return [np.array(face_encoder.compute_face_descriptor(face_image, raw_landmark_set, num_jitters)) for raw_landmark_set in raw_landmarks]
+    return [np.array(face_encoder.compute_face_descriptor(face_image, raw_landmark_set, num_jitters), dtype=np.float32) for raw_landmark_set in raw_landmarks]
 
 
 def compare_faces(known_face_encodings, face_encoding_to_check, tolerance=0.6):
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import click
+import io
+import json
+import os
+import platform
+import re
+import sys
+import time
+import numpy as np
+import PIL.Image
+import face_recognition.api as face_recognition
+from face_recognition.pipeline import FacePipeline
+from face_recognition.jitter import jittered_face_encodings
+from face_recognition.matcher import FaceMatcher
+from face_recognition.quantize import QuantizedGallery
+from face_recognition.shard import ShardedMatcher
+
+
+def peak_rss_bytes():
+    """
+    Returns the peak resident set size of this process in bytes, or None if it can't be determined.
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS reports bytes
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    except (AttributeError, OSError):
+        pass
+    return None
+
+
+def measure(func, min_repeat=3, min_time=1.0, max_repeat=1000):
+    """
+    Calls func() until it has run at least min_repeat times and for at least min_time seconds (or max_repeat
+    times), and returns throughput and latency percentiles.
+
+    :return: A dict with iterations, throughput (calls per second), p50/p90/p99/max latency in milliseconds and
+             the process's peak RSS so far
+    """
+    latencies = []
+    started = time.perf_counter()
+    while len(latencies) < max_repeat:
+        call_start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - call_start)
+        if len(latencies) >= min_repeat and time.perf_counter() - started >= min_time:
+            break
+
+    latencies = np.array(latencies) * 1000.0
+    return {
+        "iterations": len(latencies),
+        "throughput": round(len(latencies) / (latencies.sum() / 1000.0), 3) if latencies.sum() > 0 else None,
+        "latency_ms": {
+            "p50": round(float(np.percentile(latencies, 50)), 3),
+            "p90": round(float(np.percentile(latencies, 90)), 3),
+            "p99": round(float(np.percentile(latencies, 99)), 3),
+            "max": round(float(latencies.max()), 3),
+        },
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+def synthetic_fixtures(seed=0):
+    """
+    Builds in-memory images that need no files or network access: smooth noise at common camera resolutions.
+
+    :return: A list of (name, encoded png bytes) tuples
+    """
+    rng = np.random.RandomState(seed)
+    fixtures = []
+    for width, height in ((640, 480), (1280, 720)):
+        small = rng.randint(0, 256, size=(height // 16, width // 16, 3)).astype(np.uint8)
+        image = PIL.Image.fromarray(small).resize((width, height), PIL.Image.BILINEAR)
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        fixtures.append(("synthetic_{}x{}".format(width, height), buffer.getvalue()))
+    return fixtures
+
+
+def recorded_fixtures(folder):
+    """
+    Loads recorded frames (.jpg/.png files) from a folder into memory so disk speed doesn't skew the results.
+
+    :return: A list of (name, encoded image bytes) tuples
+    """
+    fixtures = []
+    for file in sorted(os.listdir(folder)):
+        if re.match(r'.*\.(jpg|jpeg|png)', file, flags=re.I):
+            with open(os.path.join(folder, file), "rb") as f:
+                fixtures.append((file, f.read()))
+    return fixtures
+
+
+def _fallback_location(image):
+    # Landmarking and encoding run on any box, so frames without a detectable face still exercise those stages
+    height, width = image.shape[:2]
+    size = min(height, width) // 3
+    top, left = (height - size) // 2, (width - size) // 2
+    return top, left + size, top + size, left
+
+
+def benchmark_image_stages(name, data, options):
+    """
+    Runs every per-image stage on one fixture.
+
+    :return: A list of result dicts, one per stage configuration
+    """
+    results = []
+
+    def record(stage, params, func):
+        result = {"fixture": name, "stage": stage, "params": params}
+        result.update(measure(func, options["min_repeat"], options["min_time"]))
+        results.append(result)
+
+    record("load_image_file", {}, lambda: face_recognition.load_image_file(io.BytesIO(data)))
+    image = face_recognition.load_image_file(io.BytesIO(data))
+
+    for model in options["detectors"]:
+        for upsample in options["upsamples"]:
+            if model.startswith("haar+"):
+                # Report the cascade and verification stages separately, as average ms per call
+                timings = {}
+                record("face_locations", {"model": model, "upsample": upsample},
+                       lambda: face_recognition.cascade_face_locations(image, upsample, model[5:], timings=timings))
+                calls = results[-1]["iterations"]
+                results[-1]["stage_ms"] = {stage: round(timings[stage] * 1000.0 / calls, 3) for stage in ("cascade", "verify")}
+                results[-1]["proposals"] = round(timings["proposals"] / float(calls), 2)
+            else:
+                record("face_locations", {"model": model, "upsample": upsample},
+                       lambda: face_recognition.face_locations(image, upsample, model))
+
+    locations = face_recognition.face_locations(image) or [_fallback_location(image)]
+    for model in ("small", "large"):
+        record("face_landmarks", {"model": model, "faces": len(locations)},
+               lambda: face_recognition.face_landmarks(image, locations, model))
+
+    for num_jitters in options["jitters"]:
+        record("face_encodings", {"num_jitters": num_jitters, "faces": len(locations)},
+               lambda: face_recognition.face_encodings(image, locations, num_jitters))
+
+    face_chips = FacePipeline(image, locations).face_chips()
+    threads = os.cpu_count() or 1
+    for num_jitters in options["jitters"]:
+        if num_jitters > 1:
+            record("jittered_face_encodings", {"num_jitters": num_jitters, "threads": threads, "faces": len(locations)},
+                   lambda: jittered_face_encodings(face_chips, num_jitters, threads=threads))
+    return results
+
+
+def _benchmark_float32_gallery(gallery, probe, options):
+    results = []
+    result = {"fixture": "random_gallery", "stage": "face_distance",
+              "params": {"gallery_size": len(gallery), "dtype": "float32", "gallery_bytes": gallery.nbytes}}
+    result.update(measure(lambda: face_recognition.face_distance(gallery, probe),
+                          options["min_repeat"], options["min_time"]))
+    results.append(result)
+
+    for metric in ("euclidean", "cosine"):
+        matcher = FaceMatcher(gallery, metric=metric)
+        result = {"fixture": "random_gallery", "stage": "face_matcher_top_k",
+                  "params": {"gallery_size": len(gallery), "metric": metric, "k": 5}}
+        result.update(measure(lambda: matcher.top_k(probe, 5), options["min_repeat"], options["min_time"]))
+        results.append(result)
+    return results
+
+
+def _benchmark_quantized_gallery(quantized, probe, options):
+    result = {"fixture": "random_gallery", "stage": "face_distance",
+              "params": {"gallery_size": len(quantized), "dtype": "int8", "gallery_bytes": quantized.nbytes}}
+    result.update(measure(lambda: quantized.face_distance(probe), options["min_repeat"], options["min_time"]))
+    return result
+
+
+def benchmark_face_distance(gallery_sizes, options, seed=0):
+    """
+    Times face_distance() of one probe against random float32 and int8-quantized galleries of each size, and
+    FaceMatcher top-k lookups on the same galleries.
+
+    :return: A list of result dicts, one per gallery size and representation
+    """
+    rng = np.random.RandomState(seed)
+    probe = rng.normal(0, 0.1, 128).astype(np.float32)
+    results = []
+    for size in gallery_sizes:
+        gallery = rng.normal(0, 0.1, (size, 128)).astype(np.float32)
+        results.extend(_benchmark_float32_gallery(gallery, probe, options))
+        # Only one representation of the largest galleries is held at a time
+        quantized = QuantizedGallery.from_encodings(gallery)
+        del gallery
+        results.append(_benchmark_quantized_gallery(quantized, probe, options))
+        del quantized
+    return results
+
+
+def benchmark_sharded_matching(gallery_size, shard_counts, options, probes_per_query=16, seed=0):
+    """
+    Times ShardedMatcher top-k lookups of a batch of probes against a random gallery of gallery_size encodings,
+    split over each number of local shard processes. The gallery is generated in chunks and sent straight to the
+    shards, so this process never holds all of it.
+
+    :return: A list of result dicts, one per shard count, with the speedup over the first shard count
+    """
+    results = []
+    for shards in shard_counts:
+        rng = np.random.RandomState(seed)
+        probes = rng.normal(0, 0.1, (probes_per_query, 128)).astype(np.float32)
+        with ShardedMatcher(shards=shards) as matcher:
+            for start in range(0, gallery_size, 262144):
+                matcher.add(rng.normal(0, 0.1, (min(262144, gallery_size - start), 128)).astype(np.float32))
+            result = {"fixture": "random_gallery", "stage": "sharded_top_k",
+                      "params": {"gallery_size": gallery_size, "shards": shards, "probes": probes_per_query, "k": 5}}
+            result.update(measure(lambda: matcher.top_k(probes, 5), options["min_repeat"], options["min_time"]))
+        if result["throughput"]:
+            result["probes_per_second"] = round(result["throughput"] * probes_per_query, 1)
+            if results and results[0]["throughput"]:
+                result["speedup"] = round(result["throughput"] / results[0]["throughput"], 2)
+        results.append(result)
+    return results
+
+
+def run_benchmarks(fixture_folder=None, detectors=("hog", "cnn", "haar+hog"), upsamples=(0, 1, 2), jitters=(1, 10),
+                   gallery_sizes=(100, 1000, 10000, 100000, 1000000), shard_gallery_size=1000000,
+                   shard_counts=(1, 2, 4), min_repeat=3, min_time=1.0):
+    """
+    Runs the full benchmark suite.
+
+    :return: A JSON-serialisable dict with environment details and one result per stage configuration
+    """
+    options = {"detectors": detectors, "upsamples": upsamples, "jitters": jitters,
+               "min_repeat": min_repeat, "min_time": min_time}
+
+    fixtures = synthetic_fixtures()
+    if fixture_folder:
+        fixtures += recorded_fixtures(fixture_folder)
+
+    started = time.time()
+    results = []
+    for name, data in fixtures:
+        results += benchmark_image_stages(name, data, options)
+    results += benchmark_face_distance(gallery_sizes, options)
+    if shard_gallery_size:
+        results += benchmark_sharded_matching(shard_gallery_size, shard_counts, options)
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+        "duration_s": round(time.time() - started, 3),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "dlib": getattr(face_recognition.dlib, "__version__", None),
+            "dlib_cuda": bool(getattr(face_recognition.dlib, "DLIB_USE_CUDA", False)),
+        },
+        "peak_rss_bytes": peak_rss_bytes(),
+        "results": results,
+    }
+
+
+def _int_list(ctx, param, value):
+    try:
+        return tuple(int(float(v)) for v in value.split(",") if v.strip())
+    except ValueError:
+        raise click.BadParameter("expected a comma separated list of numbers")
+
+
+def _int_number(ctx, param, value):
+    try:
+        return int(float(value))
+    except ValueError:
+        raise click.BadParameter("expected a number")
+
+
+@click.command()
+@click.option('--fixtures', default=None, type=click.Path(exists=True, file_okay=False), help='Folder of recorded frames (.jpg/.png) to benchmark in addition to the synthetic ones.')
+@click.option('--output', default=None, help='Write the JSON report to this file instead of stdout.')
+@click.option('--detectors', default="hog,cnn,haar+hog", help='Comma separated face detection models to benchmark.')
+@click.option('--upsamples', default="0,1,2", callback=_int_list, help='Comma separated upsample counts for face_locations.')
+@click.option('--jitters', default="1,10", callback=_int_list, help='Comma separated num_jitters values for face_encodings.')
+@click.option('--gallery-sizes', default="1e2,1e3,1e4,1e5,1e6", callback=_int_list, help='Comma separated gallery sizes for face_distance.')
+@click.option('--shard-gallery-size', default="1e6", callback=_int_number, help='Gallery size for the sharded matching benchmark (1e6 needs about 600 MB), 0 to skip it.')
+@click.option('--shard-counts', default="1,2,4", callback=_int_list, help='Comma separated shard process counts for the sharded matching benchmark.')
+@click.option('--min-repeat', default=3, help='Minimum number of timed calls per stage.')
+@click.option('--min-time', default=1.0, help='Minimum number of seconds to spend timing each stage.')
+def main(fixtures, output, detectors, upsamples, jitters, gallery_sizes, shard_gallery_size, shard_counts, min_repeat,
+         min_time):
+    """Times each face pipeline stage on this machine and writes a JSON report."""
+    report = run_benchmarks(fixtures, tuple(d.strip() for d in detectors.split(",") if d.strip()), upsamples,
+                            jitters, gallery_sizes, shard_gallery_size, shard_counts, min_repeat, min_time)
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,8 @@ import click
 import os
 import re
 import face_recognition.api as face_recognition
-import multiprocessing
+from face_recognition.runner import TaskRunner
 import sys
-import itertools
 
 
 def print_result(filename, location):
@@ -14,11 +13,25 @@ def print_result(filename, location):
     print("{},{},{},{},{}".format(filename, top, right, bottom, left))
 
 
-def test_image(image_to_check, model):
-    unknown_image = face_recognition.load_image_file(image_to_check)
-    face_locations = face_recognition.face_locations(unknown_image, number_of_times_to_upsample=0, model=model)
+def detect_faces(image_to_check, model, tiling=None):
+    """
+    :param tiling: Optional - (tile_size, tile_overlap, max_pixels) to decode the image at up to max_pixels and
+                   detect faces tile by tile. Locations are still returned in the original image's coordinates.
+    :return: A list of (top, right, bottom, left) face locations
+    """
+    if tiling:
+        tile_size, tile_overlap, max_pixels = tiling
+        unknown_image, scale = face_recognition.load_image_file_bounded(image_to_check, max_pixels)
+        face_locations = face_recognition.tiled_face_locations(unknown_image, 0, model, tile_size, tile_overlap)
+        face_locations = [tuple(int(round(v / scale)) for v in location) for location in face_locations]
+    else:
+        unknown_image = face_recognition.load_image_file(image_to_check)
+        face_locations = face_recognition.face_locations(unknown_image, number_of_times_to_upsample=0, model=model)
+    return face_locations
+
 
-    for face_location in face_locations:
+def test_image(image_to_check, model, tiling=None):
+    for face_location in detect_faces(image_to_check, model, tiling):
         print_result(image_to_check, face_location)
 
 
@@ -26,44 +39,52 @@ def image_files_in_folder(folder):
     return [os.path.join(folder, f) for f in os.listdir(folder) if re.match(r'.*\.(jpg|jpeg|png)', f, flags=re.I)]
 
 
-def process_images_in_process_pool(images_to_check, number_of_cpus, model):
+def process_images_in_process_pool(images_to_check, number_of_cpus, model, tiling=None, retries=1, ordered=True, show_progress=True):
+    """
+    Detects faces in every image with number_of_cpus worker processes (1 runs them in this process), printing the
+    results in the order of images_to_check. An image that can't be processed is reported in the summary at the
+    end instead of stopping the run.
+
+    :return: The images that failed, as (filename, error) tuples
+    """
     if number_of_cpus == -1:
         processes = None
     else:
         processes = number_of_cpus
 
-    # macOS will crash due to a bug in libdispatch if you don't use 'forkserver'
-    context = multiprocessing
-    if "forkserver" in multiprocessing.get_all_start_methods():
-        context = multiprocessing.get_context("forkserver")
-
-    pool = context.Pool(processes=processes)
-
-    function_parameters = zip(
-        images_to_check,
-        itertools.repeat(model),
-    )
-
-    pool.starmap(test_image, function_parameters)
+    runner = TaskRunner(detect_faces, processes=processes, ordered=ordered, retries=retries,
+                        show_progress=show_progress, label="Detecting faces")
+    for result in runner.run([(image, model, tiling) for image in images_to_check]):
+        for face_location in result.value or ():
+            print_result(result.task[0], face_location)
+    click.echo(runner.summary(), err=True)
+    return [(result.task[0], result.error) for result in runner.failed]
 
 
 @click.command()
 @click.argument('image_to_check')
 @click.option('--cpus', default=1, help='number of CPU cores to use in parallel. -1 means "use all in system"')
 @click.option('--model', default="hog", help='Which face detection model to use. Options are "hog" or "cnn".')
-def main(image_to_check, cpus, model):
+@click.option('--tile-size', default=0, help='Detect faces in tiles of this many pixels, for very large images. 0 (the default) detects on the whole image.')
+@click.option('--tile-overlap', default=256, help='Pixels shared by neighbouring tiles. Should be at least the size of the largest face.')
+@click.option('--max-megapixels', default=50.0, help='With --tile-size, larger JPEGs are shrunk to this size while decoding, which bounds the memory each worker uses. JPEGs more than 64 times larger, and larger images in other formats, are skipped.')
+@click.option('--retries', default=1, help='How many times to retry an image that failed with a transient error (e.g. out of memory, a locked file).')
+@click.option('--ordered/--unordered', default=True, help='Print results in file order (the default) or as soon as each image is done.')
+@click.option('--progress/--no-progress', default=True, help='Show a progress bar on stderr while processing a folder.')
+def main(image_to_check, cpus, model, tile_size, tile_overlap, max_megapixels, retries, ordered, progress):
+    tiling = (tile_size, tile_overlap, int(max_megapixels * 1000000)) if tile_size else None
     # Multi-core processing only supported on Python 3.4 or greater
     if (sys.version_info < (3, 4)) and cpus != 1:
         click.echo("WARNING: Multi-processing support requires Python 3.4 or greater. Falling back to single-threaded processing!")
         cpus = 1
 
     if os.path.isdir(image_to_check):
-        if cpus == 1:
-            [test_image(image_file, model) for image_file in image_files_in_folder(image_to_check)]
-        else:
-            process_images_in_process_pool(image_files_in_folder(image_to_check), cpus, model)
+        failed = process_images_in_process_pool(sorted(image_files_in_folder(image_to_check)), cpus, model, tiling,
+                                                retries, ordered, progress)
+        if failed:
+            sys.exit(1)
     else:
-        test_image(image_to_check, model)
+        test_image(image_to_check, model, tiling)
 
 
 if __name__ == "__main__":
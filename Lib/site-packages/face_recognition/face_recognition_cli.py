@@ -4,32 +4,81 @@ import click
 import os
 import re
 import face_recognition.api as face_recognition
-import multiprocessing
-import itertools
+from face_recognition.snapshot import GallerySnapshot
+from face_recognition.runner import TaskRunner
 import sys
+import time
 import PIL.Image
 import numpy as np
 
 
+def encode_known_person(file):
+    basename = os.path.splitext(os.path.basename(file))[0]
+    img = face_recognition.load_image_file(file)
+    encodings = face_recognition.face_encodings(img)
+
+    if len(encodings) > 1:
+        click.echo("WARNING: More than one face found in {}. Only considering the first face.".format(file))
+
+    if len(encodings) == 0:
+        click.echo("WARNING: No faces found in {}. Ignoring file.".format(file))
+        return None
+    return basename, encodings[0]
+
+
 def scan_known_people(known_people_folder):
     known_names = []
     known_face_encodings = []
 
     for file in image_files_in_folder(known_people_folder):
-        basename = os.path.splitext(os.path.basename(file))[0]
-        img = face_recognition.load_image_file(file)
-        encodings = face_recognition.face_encodings(img)
+        result = encode_known_person(file)
+        if result is not None:
+            known_names.append(result[0])
+            known_face_encodings.append(result[1])
 
-        if len(encodings) > 1:
-            click.echo("WARNING: More than one face found in {}. Only considering the first face.".format(file))
+    return known_names, known_face_encodings
 
-        if len(encodings) == 0:
-            click.echo("WARNING: No faces found in {}. Ignoring file.".format(file))
-        else:
-            known_names.append(basename)
-            known_face_encodings.append(encodings[0])
 
-    return known_names, known_face_encodings
+def update_known_people_snapshot(known_people_folder, snapshot_path):
+    """
+    Like scan_known_people(), but keeps the encodings in a snapshot file and only encodes images that were added or
+    changed since the snapshot was last saved.
+    """
+    previous = GallerySnapshot.load(snapshot_path)
+    snapshot, num_encoded = GallerySnapshot.build(sorted(image_files_in_folder(known_people_folder)),
+                                                  encode_known_person, previous)
+    if num_encoded or previous is None or len(previous.files) != len(snapshot.files):
+        snapshot.save(snapshot_path)
+    return snapshot
+
+
+def _load_snapshot_in_worker(snapshot_path):
+    # Every worker maps the same read-only file, so the known encodings are neither pickled nor copied
+    global _worker_known_names, _worker_known_encodings, _worker_error
+    for attempt in range(3):
+        snapshot = GallerySnapshot.load(snapshot_path, mmap_mode="r")
+        if snapshot is not None:
+            _worker_known_names, _worker_known_encodings = snapshot.names, snapshot.encodings
+            _worker_error = None
+            return
+        # Another run may be saving the snapshot, which replaces its two files one after the other
+        time.sleep(0.2)
+    # Raising here would break the whole pool, so fail each image with the reason instead
+    _worker_known_names = _worker_known_encodings = None
+    _worker_error = "The snapshot {} was removed or replaced by another run, so this worker couldn't load the " \
+                    "known people. Run again.".format(snapshot_path)
+
+
+def _set_known_people_in_worker(known_names, known_face_encodings):
+    # Sent once per worker rather than once per image
+    global _worker_known_names, _worker_known_encodings
+    _worker_known_names, _worker_known_encodings = known_names, known_face_encodings
+
+
+def _recognise_image_in_worker(image_to_check, tolerance, tiling=None):
+    if _worker_known_encodings is None:
+        raise RuntimeError(_worker_error)
+    return recognise_image(image_to_check, _worker_known_names, _worker_known_encodings, tolerance, tiling)
 
 
 def print_result(filename, name, distance, show_distance=False):
@@ -39,57 +88,80 @@ def print_result(filename, name, distance, show_distance=False):
         print("{},{}".format(filename, name))
 
 
-def test_image(image_to_check, known_names, known_face_encodings, tolerance=0.6, show_distance=False):
-    unknown_image = face_recognition.load_image_file(image_to_check)
+def recognise_image(image_to_check, known_names, known_face_encodings, tolerance=0.6, tiling=None):
+    """
+    :param tiling: Optional - (tile_size, tile_overlap, max_pixels) to decode the image at up to max_pixels and
+                   detect faces tile by tile, instead of shrinking it to 1600 pixels
+    :return: A list of (name, distance) results: every known person matching each face, "unknown_person" (with
+             distance None) for a face matching nobody, or just "no_persons_found" if there are no faces
+    """
+    if tiling:
+        tile_size, tile_overlap, max_pixels = tiling
+        unknown_image, _ = face_recognition.load_image_file_bounded(image_to_check, max_pixels)
+        face_locations = face_recognition.tiled_face_locations(unknown_image, tile_size=tile_size,
+                                                               tile_overlap=tile_overlap)
+        unknown_encodings = face_recognition.face_encodings(unknown_image, face_locations)
+    else:
+        unknown_image = face_recognition.load_image_file(image_to_check)
 
-    # Scale down image if it's giant so things run a little faster
-    if max(unknown_image.shape) > 1600:
-        pil_img = PIL.Image.fromarray(unknown_image)
-        pil_img.thumbnail((1600, 1600), PIL.Image.LANCZOS)
-        unknown_image = np.array(pil_img)
+        # Scale down image if it's giant so things run a little faster
+        if max(unknown_image.shape) > 1600:
+            pil_img = PIL.Image.fromarray(unknown_image)
+            pil_img.thumbnail((1600, 1600), PIL.Image.LANCZOS)
+            unknown_image = np.array(pil_img)
 
-    unknown_encodings = face_recognition.face_encodings(unknown_image)
+        unknown_encodings = face_recognition.face_encodings(unknown_image)
 
+    results = []
     for unknown_encoding in unknown_encodings:
         distances = face_recognition.face_distance(known_face_encodings, unknown_encoding)
         result = list(distances <= tolerance)
 
         if True in result:
-            [print_result(image_to_check, name, distance, show_distance) for is_match, name, distance in zip(result, known_names, distances) if is_match]
+            results.extend((name, distance) for is_match, name, distance in zip(result, known_names, distances) if is_match)
         else:
-            print_result(image_to_check, "unknown_person", None, show_distance)
+            results.append(("unknown_person", None))
 
     if not unknown_encodings:
-        # print out fact that no faces were found in image
-        print_result(image_to_check, "no_persons_found", None, show_distance)
+        # report the fact that no faces were found in image
+        results.append(("no_persons_found", None))
+    return results
+
+
+def test_image(image_to_check, known_names, known_face_encodings, tolerance=0.6, show_distance=False, tiling=None):
+    for name, distance in recognise_image(image_to_check, known_names, known_face_encodings, tolerance, tiling):
+        print_result(image_to_check, name, distance, show_distance)
 
 
 def image_files_in_folder(folder):
     return [os.path.join(folder, f) for f in os.listdir(folder) if re.match(r'.*\.(jpg|jpeg|png)', f, flags=re.I)]
 
 
-def process_images_in_process_pool(images_to_check, known_names, known_face_encodings, number_of_cpus, tolerance, show_distance):
+def process_images_in_process_pool(images_to_check, known_names, known_face_encodings, number_of_cpus, tolerance, show_distance, snapshot_path=None, tiling=None, retries=1, ordered=True, show_progress=True):
+    """
+    Checks every image with number_of_cpus worker processes (1 runs them in this process), printing the results
+    in the order of images_to_check. An image that can't be processed is reported in the summary at the end
+    instead of stopping the run.
+
+    :return: The images that failed, as (filename, error) tuples
+    """
     if number_of_cpus == -1:
         processes = None
     else:
         processes = number_of_cpus
 
-    # macOS will crash due to a bug in libdispatch if you don't use 'forkserver'
-    context = multiprocessing
-    if "forkserver" in multiprocessing.get_all_start_methods():
-        context = multiprocessing.get_context("forkserver")
-
-    pool = context.Pool(processes=processes)
-
-    function_parameters = zip(
-        images_to_check,
-        itertools.repeat(known_names),
-        itertools.repeat(known_face_encodings),
-        itertools.repeat(tolerance),
-        itertools.repeat(show_distance)
-    )
+    if snapshot_path and processes != 1:
+        initializer, initargs = _load_snapshot_in_worker, (snapshot_path,)
+    else:
+        initializer, initargs = _set_known_people_in_worker, (known_names, known_face_encodings)
 
-    pool.starmap(test_image, function_parameters)
+    runner = TaskRunner(_recognise_image_in_worker, processes=processes, initializer=initializer, initargs=initargs,
+                        ordered=ordered, retries=retries, show_progress=show_progress, label="Recognising faces")
+    for result in runner.run([(image, tolerance, tiling) for image in images_to_check]):
+        for name, distance in result.value or ():
+            print_result(result.task[0], name, distance, show_distance)
+    click.echo(runner.summary(), err=True)
+    return [(result.task[0], result.error) for result in runner.failed]
 
 
 @click.command()
@@ -98,8 +170,20 @@ def process_images_in_process_pool(images_to_check, known_names, known_face_enco
 @click.option('--cpus', default=1, help='number of CPU cores to use in parallel (can speed up processing lots of images). -1 means "use all in system"')
 @click.option('--tolerance', default=0.6, help='Tolerance for face comparisons. Default is 0.6. Lower this if you get multiple matches for the same person.')
 @click.option('--show-distance', default=False, type=bool, help='Output face distance. Useful for tweaking tolerance setting.')
-def main(known_people_folder, image_to_check, cpus, tolerance, show_distance):
-    known_names, known_face_encodings = scan_known_people(known_people_folder)
+@click.option('--snapshot', default=None, help='Keep the known people\'s encodings in this snapshot file (.npz/.npy pair) and only re-encode images that changed since the last run.')
+@click.option('--tile-size', default=0, help='Detect faces in tiles of this many pixels, for very large images. 0 (the default) shrinks every image to 1600 pixels instead.')
+@click.option('--tile-overlap', default=256, help='Pixels shared by neighbouring tiles. Should be at least the size of the largest face.')
+@click.option('--max-megapixels', default=50.0, help='With --tile-size, larger JPEGs are shrunk to this size while decoding, which bounds the memory each worker uses. JPEGs more than 64 times larger, and larger images in other formats, are skipped.')
+@click.option('--retries', default=1, help='How many times to retry an image that failed with a transient error (e.g. out of memory, a locked file).')
+@click.option('--ordered/--unordered', default=True, help='Print results in file order (the default) or as soon as each image is done.')
+@click.option('--progress/--no-progress', default=True, help='Show a progress bar on stderr while processing a folder.')
+def main(known_people_folder, image_to_check, cpus, tolerance, show_distance, snapshot, tile_size, tile_overlap, max_megapixels, retries, ordered, progress):
+    tiling = (tile_size, tile_overlap, int(max_megapixels * 1000000)) if tile_size else None
+    if snapshot:
+        known_snapshot = update_known_people_snapshot(known_people_folder, snapshot)
+        known_names, known_face_encodings = known_snapshot.names, known_snapshot.encodings
+    else:
+        known_names, known_face_encodings = scan_known_people(known_people_folder)
 
     # Multi-core processing only supported on Python 3.4 or greater
     if (sys.version_info < (3, 4)) and cpus != 1:
@@ -107,12 +191,13 @@ def main(known_people_folder, image_to_check, cpus, tolerance, show_distance):
         cpus = 1
 
     if os.path.isdir(image_to_check):
-        if cpus == 1:
-            [test_image(image_file, known_names, known_face_encodings, tolerance, show_distance) for image_file in image_files_in_folder(image_to_check)]
-        else:
-            process_images_in_process_pool(image_files_in_folder(image_to_check), known_names, known_face_encodings, cpus, tolerance, show_distance)
+        failed = process_images_in_process_pool(sorted(image_files_in_folder(image_to_check)), known_names,
+                                                known_face_encodings, cpus, tolerance, show_distance, snapshot,
+                                                tiling, retries, ordered, progress)
+        if failed:
+            sys.exit(1)
     else:
-        test_image(image_to_check, known_names, known_face_encodings, tolerance, show_distance)
+        test_image(image_to_check, known_names, known_face_encodings, tolerance, show_distance, tiling)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import queue
+import concurrent.futures
+import dlib
+import numpy as np
+
+from . import api
+
+# Encoders for the worker threads, kept between calls
+_spare_encoders = queue.LifoQueue()
+
+
+def _encode_part(chips):
+    """
+    Encodes chips on a worker thread with an encoder of its own, as one dlib network must not be run by two
+    threads at once. Each extra encoder is a copy of the model (about 22 MB), loaded the first time it is needed.
+    """
+    try:
+        encoder = _spare_encoders.get_nowait()
+    except queue.Empty:
+        encoder = dlib.face_recognition_model_v1(api.face_recognition_model)
+    try:
+        return encoder.compute_face_descriptor(chips, 1)
+    finally:
+        _spare_encoders.put(encoder)
+
+
+def _encode_chips(chips, executor=None, threads=1):
+    """
+    Encodes a list of 150x150 face chips without jitter, split across threads when an executor is given.
+    """
+    if not chips:
+        return np.empty((0, 128), dtype=np.float32)
+    if executor is None or threads < 2 or len(chips) < 2:
+        return np.array(api.face_encoder.compute_face_descriptor(chips, 1), dtype=np.float32)
+
+    part_size = -(-len(chips) // threads)
+    parts = [chips[start:start + part_size] for start in range(0, len(chips), part_size)]
+    futures = [executor.submit(_encode_part, part) for part in parts]
+    return np.concatenate([np.array(future.result(), dtype=np.float32) for future in futures])
+
+
+def jittered_face_encodings(face_chips, num_jitters=20, chunk_size=None, convergence=None, threads=1,
+                            disturb_colors=False):
+    """
+    Encodes aligned face chips (e.g. from FacePipeline.face_chips()) averaged over num_jitters randomly jittered
+    copies, like face_encodings(..., num_jitters=N), but with the jittered copies of every face encoded together.
+
+    The jittered copies are generated once with dlib.jitter_image() and encoded in rounds of chunk_size per face.
+    Each round is a single encoder call for all faces, or one call per thread when threads > 1. With convergence
+    set, a face stops being sampled once a round moves its running mean by less than convergence, so faces that
+    are already stable don't pay for all num_jitters samples.
+
+    :param face_chips: A list of 150x150 face chip images (each as a numpy array)
+    :param num_jitters: The most jittered copies to average per face
+    :param chunk_size: Jittered copies per face per round. Defaults to num_jitters (one round, no early stop).
+    :param convergence: Optional - stop sampling a face when its mean encoding moves less than this in a round
+    :param threads: How many threads to spread each round's encoding over, each with its own copy of the encoder.
+                    Measure before raising it: with a shared encoder, 4 threads were no faster than 1.
+    :param disturb_colors: Also randomly disturb the colours of the jittered copies
+    :return: (list of 128-dimensional float32 encodings, list with the number of jitters used for each face)
+    """
+    num_faces = len(face_chips)
+    if num_faces == 0:
+        return [], []
+    if num_jitters <= 1:
+        return list(_encode_chips(list(face_chips))), [1] * num_faces
+
+    chunk_size = chunk_size or num_jitters
+    jittered = [dlib.jitter_image(np.ascontiguousarray(chip), num_jitters, disturb_colors) for chip in face_chips]
+    sums = np.zeros((num_faces, 128), dtype=np.float64)
+    counts = np.zeros(num_faces, dtype=np.int64)
+    previous_means = [None] * num_faces
+    active = list(range(num_faces))
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+    try:
+        for start in range(0, num_jitters, chunk_size):
+            owners = []
+            chips = []
+            for face in active:
+                round_chips = jittered[face][start:start + chunk_size]
+                owners.extend([face] * len(round_chips))
+                chips.extend(round_chips)
+
+            descriptors = _encode_chips(chips, executor, threads)
+            np.add.at(sums, owners, descriptors)
+            counts += np.bincount(owners, minlength=num_faces)
+
+            still_active = []
+            for face in active:
+                mean = sums[face] / counts[face]
+                if (convergence is None or previous_means[face] is None or
+                        np.linalg.norm(mean - previous_means[face]) >= convergence):
+                    still_active.append(face)
+                previous_means[face] = mean
+            active = still_active
+            if not active:
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    encodings = [(sums[face] / counts[face]).astype(np.float32) for face in range(num_faces)]
+    return encodings, counts.tolist()
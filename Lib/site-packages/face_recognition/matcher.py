@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+
+import warnings
+
+import numpy as np
+
+from .quantize import QuantizedGallery
+
+
+class FaceMatcher(object):
+    """
+    Matches face encodings against a fixed gallery of known encodings.
+
+    api.face_distance() builds an (N x 128) difference matrix for every probe. FaceMatcher prepares the gallery
+    once so each probe costs one matrix-vector product (or one matrix-matrix product for a batch of probes)
+    plus a top-k selection with np.argpartition.
+
+    Two metrics are available:
+
+    * "euclidean" (default) - exactly the distance api.face_distance() returns, computed from precomputed
+      squared norms as |x|^2 + |q|^2 - 2 x.q
+    * "cosine" - matching on L2-normalised encodings. Distances are reported as the euclidean distance between
+      the normalised encodings, scaled by the gallery's mean norm, so the usual 0.6 tolerance keeps working.
+
+    Usage:
+
+        matcher = FaceMatcher(known_face_encodings, known_face_names)
+        name, distance = matcher.best_match(face_encoding, tolerance=0.6)
+        candidates = matcher.top_k(face_encoding, k=3)
+
+    With per-person thresholds from calibrate_thresholds(), each match is accepted against its own person's
+    threshold and the tolerance argument is only used for people without one.
+
+    With quantize=True (or a QuantizedGallery as the known encodings), the gallery is kept as int8 codes in a
+    quarter of the memory. Distances then move by a few thousandths, so only decisions right at a threshold can
+    change; a QuantizedGallery calibrated for a tolerance is matched at its calibrated threshold instead.
+    """
+
+    def __init__(self, known_face_encodings, known_face_names=None, metric="euclidean", thresholds=None,
+                 quantize=False):
+        """
+        :param known_face_encodings: A list or (N, 128) array of known face encodings, or a QuantizedGallery
+        :param known_face_names: Optional - the name of each known encoding, in the same order
+        :param metric: "euclidean" (default) or "cosine"
+        :param thresholds: Optional - dict mapping a name to its own tolerance, e.g. from calibrate_thresholds()
+        :param quantize: Optional - keep the gallery as an int8 QuantizedGallery. Only for the "euclidean" metric.
+        """
+        if metric not in ("euclidean", "cosine"):
+            raise ValueError("Invalid metric. Supported metrics are ['euclidean', 'cosine'].")
+        if quantize and not isinstance(known_face_encodings, QuantizedGallery):
+            known_face_encodings = QuantizedGallery.from_encodings(
+                np.asarray(known_face_encodings, dtype=np.float32).reshape(-1, 128))
+
+        self.metric = metric
+        self.quantized = None
+        if isinstance(known_face_encodings, QuantizedGallery):
+            if metric != "euclidean":
+                raise ValueError("Quantized galleries only support the 'euclidean' metric.")
+            self.quantized = known_face_encodings
+            size = len(known_face_encodings)
+        else:
+            encodings = np.asarray(known_face_encodings, dtype=np.float32).reshape(-1, 128)
+            size = len(encodings)
+        self.names = list(known_face_names) if known_face_names is not None else list(range(size))
+        if len(self.names) != size:
+            raise ValueError("known_face_names must have one name per known face encoding")
+
+        if self.quantized is not None:
+            self.mean_norm = 1.0
+            self.encodings = None
+            self.squared_norms = self.quantized.squared_norms
+        else:
+            self._prepare_encodings(encodings)
+
+        self.thresholds = {}
+        for name, threshold in (thresholds or {}).items():
+            self.thresholds[name] = self._threshold(threshold["threshold"] if isinstance(threshold, dict) else threshold)
+        # NaN marks encodings of people without their own threshold
+        self._row_thresholds = np.array([self.thresholds.get(name, np.nan) for name in self.names], dtype=np.float32)
+
+    def _prepare_encodings(self, encodings):
+        norms = np.sqrt(np.einsum("ij,ij->i", encodings, encodings))
+        if self.metric == "cosine":
+            self.mean_norm = float(norms.mean()) if len(norms) else 1.0
+            norms[norms == 0] = 1.0
+            self.encodings = np.ascontiguousarray(encodings / norms[:, np.newaxis])
+            self.squared_norms = None
+        else:
+            self.mean_norm = 1.0
+            self.encodings = np.ascontiguousarray(encodings)
+            self.squared_norms = norms * norms
+
+    def _threshold(self, tolerance):
+        """The distance a match at tolerance is accepted at: tolerance, or its calibrated int8 threshold."""
+        return tolerance if self.quantized is None else self.quantized.threshold(tolerance)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _prepare_probes(self, face_encodings_to_check):
+        probes = np.asarray(face_encodings_to_check, dtype=np.float32)
+        single = probes.ndim == 1
+        probes = probes.reshape(-1, 128)
+        if self.metric == "cosine":
+            probe_norms = np.sqrt(np.einsum("ij,ij->i", probes, probes))
+            probe_norms[probe_norms == 0] = 1.0
+            probes = probes / probe_norms[:, np.newaxis]
+        return probes, single
+
+    def _scores(self, probes):
+        """
+        Returns a (probes, N) array where lower is closer: squared euclidean distance for "euclidean",
+        negative cosine similarity for "cosine".
+        """
+        if self.quantized is not None:
+            products = self.quantized.dot_products(probes)
+        else:
+            products = probes @ self.encodings.T
+        if self.metric == "cosine":
+            return np.negative(products, out=products)
+        products *= -2
+        products += self.squared_norms
+        products += np.einsum("ij,ij->i", probes, probes)[:, np.newaxis]
+        return products
+
+    def _scores_to_distances(self, scores):
+        if self.metric == "cosine":
+            # |a - b|^2 = 2 - 2 cos(a, b) for unit vectors
+            squared = 2 + 2 * scores
+            np.maximum(squared, 0, out=squared)
+            return np.sqrt(squared) * self.mean_norm
+        return np.sqrt(np.maximum(scores, 0))
+
+    def tolerance_to_similarity(self, tolerance):
+        """
+        Converts a euclidean tolerance (like the usual 0.6) to the equivalent cosine similarity threshold.
+        """
+        unit_tolerance = tolerance / self.mean_norm
+        return 1.0 - unit_tolerance * unit_tolerance / 2.0
+
+    def face_distance(self, face_encodings_to_check):
+        """
+        :param face_encodings_to_check: A single face encoding, or an (M, 128) array of them
+        :return: The distance to every known encoding, shape (N,) for one probe or (M, N) for several
+        """
+        probes, single = self._prepare_probes(face_encodings_to_check)
+        if len(self) == 0:
+            distances = np.empty((len(probes), 0), dtype=np.float32)
+        else:
+            distances = self._scores_to_distances(self._scores(probes))
+        return distances[0] if single else distances
+
+    def tolerance_for(self, name, tolerance=0.6):
+        """
+        :return: The threshold matches against name are accepted at
+        """
+        return self.thresholds.get(name, self._threshold(tolerance))
+
+    def compare_faces(self, face_encoding_to_check, tolerance=0.6):
+        """
+        Same as api.compare_faces(), against this gallery, using per-person thresholds where known.
+
+        :return: A numpy array of True/False values, one per known encoding
+        """
+        distances = self.face_distance(face_encoding_to_check)
+        tolerance = self._threshold(tolerance)
+        if not self.thresholds:
+            return distances <= tolerance
+        return distances <= np.where(np.isnan(self._row_thresholds), tolerance, self._row_thresholds)
+
+    def top_k(self, face_encodings_to_check, k=1):
+        """
+        Finds the k closest known encodings, e.g. to show runner-up candidates in a UI.
+
+        :param face_encodings_to_check: A single face encoding, or an (M, 128) array of them
+        :param k: How many candidates to return per probe
+        :return: For one probe, a list of (index, name, distance) tuples sorted closest first. For several probes,
+                 a list of such lists.
+        """
+        probes, single = self._prepare_probes(face_encodings_to_check)
+        results = [[] for _ in range(len(probes))]
+        k = min(k, len(self))
+        if k > 0:
+            scores = self._scores(probes)
+            if k < scores.shape[1]:
+                candidates = np.argpartition(scores, k - 1, axis=1)[:, :k]
+            else:
+                candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+            order = np.argsort(candidate_scores, axis=1)
+            candidates = np.take_along_axis(candidates, order, axis=1)
+            distances = self._scores_to_distances(np.take_along_axis(candidate_scores, order, axis=1))
+            for row, (indexes, row_distances) in enumerate(zip(candidates.tolist(), distances.tolist())):
+                results[row] = [(index, self.names[index], distance) for index, distance in zip(indexes, row_distances)]
+        return results[0] if single else results
+
+    def best_match(self, face_encoding_to_check, tolerance=0.6):
+        """
+        :return: (name, distance) of the closest known encoding, or (None, distance) if it isn't within tolerance.
+                 distance is None when the gallery is empty.
+        """
+        candidates = self.top_k(face_encoding_to_check, 1)
+        if not candidates:
+            return None, None
+        index, name, distance = candidates[0]
+        return (name if distance <= self.tolerance_for(name, tolerance) else None), distance
+
+
+def _pairwise_distances(encodings_a, encodings_b):
+    squared = (np.einsum("ij,ij->i", encodings_a, encodings_a)[:, np.newaxis]
+               + np.einsum("ij,ij->i", encodings_b, encodings_b) - 2 * (encodings_a @ encodings_b.T))
+    return np.sqrt(np.maximum(squared, 0, out=squared))
+
+
+def calibrate_thresholds(known_face_encodings, known_face_names, tolerance=0.6, min_tolerance=0.45,
+                         max_tolerance=0.7, margin=0.05, previous=None, changed_names=None):
+    """
+    Learns a match threshold for each identity in a gallery.
+
+    For each person, "intra" is the largest distance between two of their own encodings (how much their genuine
+    samples vary) and "impostor" is the distance from any of their encodings to the nearest encoding of anyone
+    else. A person whose intra distance is typical for the gallery (the median) gets tolerance; people with more
+    uniform encodings get a proportionally tighter threshold and people with more varied encodings a looser
+    one. Thresholds are kept within [min_tolerance, max_tolerance] and always at least margin below the nearest
+    impostor, so two people can never accept each other's faces. When that takes a threshold under min_tolerance
+    (two people look very alike, or one person is registered under two names) a warning names the person.
+    People with a single encoding start from tolerance.
+
+    Recalibrating after a registration only needs the changed people: pass the previous result as previous and
+    the registered names as changed_names. Their entries are recomputed, and everyone else only has their nearest
+    impostor checked against the new encodings, so the cost is proportional to the new encodings, not the
+    gallery squared.
+
+    :param known_face_encodings: A list or (N, 128) array of known face encodings
+    :param known_face_names: The name of each known encoding, in the same order
+    :param tolerance: Threshold to use when there isn't enough data to do better
+    :param previous: Optional - the dict returned by an earlier call on the same gallery minus the changes
+    :param changed_names: Optional - names whose encodings were added since previous
+    :return: A dict mapping each name to {"threshold", "intra", "impostor", "templates"}
+    """
+    encodings = np.asarray(known_face_encodings, dtype=np.float32).reshape(-1, 128)
+    unique_names, name_indexes = np.unique(np.asarray(known_face_names, dtype=object).astype(str), return_inverse=True)
+    unique_names = unique_names.tolist()
+    rows_by_name = [np.flatnonzero(name_indexes == i) for i in range(len(unique_names))]
+
+    if previous is None or changed_names is None:
+        to_compute = set(unique_names)
+        calibration = {}
+    else:
+        to_compute = set(str(name) for name in changed_names) | (set(unique_names) - set(previous))
+        calibration = {name: dict(previous[name]) for name in unique_names if name not in to_compute}
+
+    for name_index, name in enumerate(unique_names):
+        if name not in to_compute:
+            continue
+        own_rows = rows_by_name[name_index]
+        own_encodings = encodings[own_rows]
+        intra = None
+        if len(own_rows) > 1:
+            intra = float(_pairwise_distances(own_encodings, own_encodings).max())
+
+        # Distance from every gallery encoding to the nearest of this person's encodings
+        distances = np.concatenate([
+            _pairwise_distances(own_encodings, encodings[start:start + 65536]).min(axis=0)
+            for start in range(0, len(encodings), 65536)
+        ])
+        distances[own_rows] = np.inf
+
+        impostor = None
+        if len(own_rows) < len(encodings):
+            impostor = float(distances.min())
+
+            if len(to_compute) < len(unique_names):
+                # The new encodings may now be the nearest impostor of someone who wasn't recomputed
+                nearest_by_name = np.full(len(unique_names), np.inf)
+                np.minimum.at(nearest_by_name, name_indexes, distances)
+                for other_index, other_name in enumerate(unique_names):
+                    entry = calibration.get(other_name)
+                    if other_name in to_compute or entry is None:
+                        continue
+                    if entry["impostor"] is None or nearest_by_name[other_index] < entry["impostor"]:
+                        entry["impostor"] = float(nearest_by_name[other_index])
+
+        calibration[name] = {"intra": intra, "impostor": impostor, "templates": len(own_rows)}
+
+    intra_distances = [entry["intra"] for entry in calibration.values() if entry["intra"] is not None]
+    typical_intra = float(np.median(intra_distances)) if intra_distances else None
+    for name, entry in calibration.items():
+        entry["threshold"] = _threshold_for(entry["intra"], entry["impostor"], typical_intra, tolerance,
+                                            min_tolerance, max_tolerance, margin)
+        if entry["threshold"] < min_tolerance:
+            warnings.warn("Someone else's encoding is only {:.3f} from {}, so their threshold is {:.3f}, under "
+                          "min_tolerance {}.".format(entry["impostor"], name, entry["threshold"], min_tolerance))
+    return calibration
+
+
+def _threshold_for(intra, impostor, typical_intra, tolerance, min_tolerance, max_tolerance, margin):
+    threshold = tolerance
+    if intra is not None and typical_intra is not None:
+        threshold = tolerance + (intra - typical_intra)
+    threshold = min(max(threshold, min_tolerance), max_tolerance)
+    if impostor is not None:
+        # Applied after the floor: staying clear of the nearest impostor matters more than min_tolerance
+        threshold = min(threshold, impostor - margin)
+    return float(max(threshold, 0.0))
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import dlib
+import numpy as np
+
+from . import api
+
+
+class FacePipeline(object):
+    """
+    Runs the face pipeline over a single image in a fixed order: detection once, then 5-point landmarks,
+    then alignment into face chips, then encoding. Every stage is computed the first time it is needed and
+    reused afterwards, so asking for locations, encodings and landmarks of the same image never re-runs detection.
+
+    68-point landmarks are only computed when face_landmarks() or face_landmarks_array() is called with the
+    "large" model.
+
+    An OpenCV frame can be passed as is with channel_order="BGR": detection and landmarks don't depend on the
+    channel order, and only the 150x150 face chips are reordered for the encoder, so the whole frame is never
+    converted to RGB. HOG detection can also run on a greyscale copy of the frame (detection_image).
+
+    Usage:
+
+        pipeline = FacePipeline(rgb_frame)
+        for location, encoding in zip(pipeline.face_locations, pipeline.face_encodings()):
+            ...
+    """
+
+    def __init__(self, face_image, known_face_locations=None, number_of_times_to_upsample=1, model="hog",
+                 detection_image=None, channel_order="RGB"):
+        """
+        :param face_image: An image (as a numpy array)
+        :param known_face_locations: Optional - the bounding boxes of each face if you already know them.
+        :param number_of_times_to_upsample: How many times to upsample the image looking for faces. Higher numbers find smaller faces.
+        :param model: Which face detection model to use. "hog" is less accurate but faster on CPUs. "cnn" is a more accurate
+                      deep-learning model which is GPU/CUDA accelerated (if available). The default is "hog".
+        :param detection_image: Optional - the image to detect faces on instead of face_image, with the same size,
+                                e.g. a single greyscale channel for the "hog" model.
+        :param channel_order: "RGB" (default) or "BGR", the channel order of face_image.
+        """
+        if channel_order not in ("RGB", "BGR"):
+            raise ValueError("Invalid channel order. Supported orders are ['RGB', 'BGR'].")
+        self.face_image = face_image
+        self.detection_image = detection_image
+        self.channel_order = channel_order
+        self.number_of_times_to_upsample = number_of_times_to_upsample
+        self.model = model
+
+        self._rects = None
+        if known_face_locations is not None:
+            self._rects = [api._css_to_rect(face_location) for face_location in known_face_locations]
+
+        self._raw_landmarks = {}
+        self._face_chips = None
+        self._face_encodings = {}
+
+    @property
+    def face_rects(self):
+        """
+        :return: A list of dlib 'rect' objects of found face locations
+        """
+        if self._rects is None:
+            image = self.detection_image
+            if image is None:
+                image = self.face_image
+                if self.channel_order == "BGR" and "cnn" in self.model:
+                    # HOG takes the strongest gradient of any channel, but the CNN was trained on RGB
+                    image = np.ascontiguousarray(image[:, :, ::-1])
+            detections = api._raw_face_locations(image, self.number_of_times_to_upsample, self.model)
+            if self.model == "cnn":
+                self._rects = [detection.rect for detection in detections]
+            else:
+                self._rects = list(detections)
+        return self._rects
+
+    @property
+    def face_locations(self):
+        """
+        :return: A list of tuples of found face locations in css (top, right, bottom, left) order
+        """
+        return [api._trim_css_to_bounds(api._rect_to_css(rect), self.face_image.shape) for rect in self.face_rects]
+
+    def raw_face_landmarks(self, model="small"):
+        """
+        :param model: "small" (default) for the 5-point model used for alignment or "large" for 68 points.
+        :return: A list of dlib 'full_object_detection' objects, one for each face
+        """
+        if model not in ("small", "large"):
+            raise ValueError("Invalid landmarks model type. Supported models are ['small', 'large'].")
+
+        if model not in self._raw_landmarks:
+            pose_predictor = api.pose_predictor_5_point if model == "small" else api.pose_predictor_68_point
+            self._raw_landmarks[model] = [pose_predictor(self.face_image, rect) for rect in self.face_rects]
+        return self._raw_landmarks[model]
+
+    def face_chips(self):
+        """
+        Returns the aligned 150x150 face chips the encoder is run on, in the same order as face_locations.
+
+        :return: A list of face chip images (each as a numpy array)
+        """
+        if self._face_chips is None:
+            raw_landmarks = self.raw_face_landmarks("small")
+            if raw_landmarks:
+                self._face_chips = dlib.get_face_chips(self.face_image, raw_landmarks, size=150, padding=0.25)
+                if self.channel_order == "BGR":
+                    self._face_chips = [np.ascontiguousarray(chip[:, :, ::-1]) for chip in self._face_chips]
+            else:
+                self._face_chips = []
+        return self._face_chips
+
+    def face_encodings(self, num_jitters=1):
+        """
+        :param num_jitters: How many times to re-sample the face when calculating encoding. Higher is more accurate, but slower (i.e. 100 is 100x slower)
+        :return: A list of 128-dimensional float32 face encodings (one for each face in the image)
+        """
+        if num_jitters not in self._face_encodings:
+            face_chips = self.face_chips()
+            if face_chips:
+                descriptors = api.face_encoder.compute_face_descriptor(face_chips, num_jitters)
+                self._face_encodings[num_jitters] = [np.array(descriptor, dtype=np.float32) for descriptor in descriptors]
+            else:
+                self._face_encodings[num_jitters] = []
+        return self._face_encodings[num_jitters]
+
+    def face_landmarks(self, model="large"):
+        """
+        :param model: Optional - which model to use. "large" (default) or "small" which only returns 5 points.
+        :return: A list of dicts of face feature locations (eyes, nose, etc), the same as api.face_landmarks()
+        """
+        return api._landmarks_to_dicts(self.raw_face_landmarks(model), model)
+
+    def face_landmarks_array(self, model="large"):
+        """
+        :param model: Optional - which model to use. "large" (default) or "small" which only returns 5 points.
+        :return: A numpy array of shape (faces, 68, 2) for the "large" model or (faces, 5, 2) for the "small" model
+        """
+        return api._raw_landmarks_to_array(self.raw_face_landmarks(model), 5 if model == "small" else 68)
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+# Rows handled per matrix-vector product, so the int8 -> float32 upcast never needs a gallery-sized temporary
+_BLOCK_ROWS = 65536
+
+
+class QuantizedGallery(object):
+    """
+    A gallery of face encodings stored as int8 codes with one float32 scale per dimension. This takes a quarter
+    of the memory of float32 encodings (an eighth of float64) and computes distances with one int8 x float32
+    matrix-vector product per block of rows.
+
+    Quantization moves distances slightly, so calibrate() learns, for a given tolerance, the quantized-distance
+    threshold that gives the same match decisions as the exact distance on the gallery itself. Other tolerances
+    near it are moved by the same amount.
+
+    Usage:
+
+        gallery = QuantizedGallery.from_encodings(known_face_encodings)
+        gallery.calibrate(known_face_encodings, tolerance=0.6)
+        matches = gallery.compare_faces(face_encoding, tolerance=0.6)
+    """
+
+    def __init__(self, codes, scale, thresholds=None):
+        """
+        :param codes: (N, 128) int8 array of quantized encodings
+        :param scale: (128,) float32 array, the value of one quantization step in each dimension
+        :param thresholds: Optional - dict mapping a tolerance to its calibrated quantized-distance threshold
+        """
+        self.codes = np.ascontiguousarray(codes, dtype=np.int8)
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.thresholds = dict(thresholds or {})
+        dequantized_norms = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), _BLOCK_ROWS):
+            block = self.codes[start:start + _BLOCK_ROWS].astype(np.float32) * self.scale
+            dequantized_norms[start:start + _BLOCK_ROWS] = np.einsum("ij,ij->i", block, block)
+        self.squared_norms = dequantized_norms
+
+    @classmethod
+    def from_encodings(cls, face_encodings):
+        """
+        :param face_encodings: A list or (N, 128) array of face encodings
+        :return: A QuantizedGallery of those encodings
+        """
+        face_encodings = np.asarray(face_encodings, dtype=np.float32)
+        if len(face_encodings) == 0:
+            return cls(np.empty((0, 128), dtype=np.int8), np.ones(128, dtype=np.float32))
+
+        scale = np.abs(face_encodings).max(axis=0) / 127.0
+        scale[scale == 0] = 1.0
+        codes = np.clip(np.rint(face_encodings / scale), -127, 127).astype(np.int8)
+        return cls(codes, scale)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def extend(self, face_encodings):
+        """
+        :param face_encodings: A list or (n, 128) array of face encodings to add
+        :return: A new QuantizedGallery with face_encodings appended, quantized with this gallery's scales (values
+                 beyond them are clipped) and keeping its calibrated thresholds
+        """
+        face_encodings = np.asarray(face_encodings, dtype=np.float32).reshape(-1, 128)
+        codes = np.clip(np.rint(face_encodings / self.scale), -127, 127).astype(np.int8)
+        return QuantizedGallery(np.concatenate([self.codes, codes]), self.scale, self.thresholds)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scale.nbytes + self.squared_norms.nbytes
+
+    def dequantize(self):
+        """
+        :return: The approximate float32 encodings as an (N, 128) array
+        """
+        return self.codes.astype(np.float32) * self.scale
+
+    def dot_products(self, probes):
+        """
+        :param probes: An (M, 128) float32 array of face encodings
+        :return: An (M, N) float32 array of the dot products of each probe with each dequantized gallery encoding
+        """
+        weighted_probes = np.asarray(probes, dtype=np.float32) * self.scale
+        dots = np.empty((len(weighted_probes), len(self.codes)), dtype=np.float32)
+        for start in range(0, len(self.codes), _BLOCK_ROWS):
+            block = self.codes[start:start + _BLOCK_ROWS].astype(np.float32)
+            dots[:, start:start + _BLOCK_ROWS] = weighted_probes @ block.T
+        return dots
+
+    def face_distance(self, face_to_compare):
+        """
+        Same as api.face_distance(), against the quantized gallery.
+
+        :param face_to_compare: A face encoding to compare against
+        :return: A float32 numpy ndarray with the distance for each face in the gallery
+        """
+        probe = np.asarray(face_to_compare, dtype=np.float32)
+        squared = self.squared_norms - 2 * self.dot_products(probe[np.newaxis])[0] + np.dot(probe, probe)
+        np.maximum(squared, 0, out=squared)
+        return np.sqrt(squared, out=squared)
+
+    def threshold(self, tolerance):
+        """
+        :return: The calibrated quantized-distance threshold for tolerance. A tolerance that wasn't calibrated (e.g.
+                 a per-person threshold) is moved by as much as the nearest calibrated one, or returned as is if
+                 nothing was calibrated.
+        """
+        key = round(float(tolerance), 6)
+        if key in self.thresholds or not self.thresholds:
+            return self.thresholds.get(key, tolerance)
+        nearest = min(self.thresholds, key=lambda calibrated: abs(calibrated - key))
+        return tolerance + self.thresholds[nearest] - nearest
+
+    def compare_faces(self, face_encoding_to_check, tolerance=0.6):
+        """
+        Same as api.compare_faces(), against the quantized gallery, using the calibrated threshold for tolerance.
+
+        :return: A numpy array of True/False values, one per gallery face
+        """
+        return self.face_distance(face_encoding_to_check) <= self.threshold(tolerance)
+
+    def calibrate(self, face_encodings, tolerance=0.6, max_probes=256, window=0.05, max_samples=1 << 22, seed=0):
+        """
+        Learns the quantized-distance threshold that best reproduces exact match decisions at tolerance.
+
+        Up to max_probes of the original encodings are compared against the whole gallery. While the threshold
+        stays within window of tolerance, only pairs whose quantized distance is also within window can change
+        decision, so only those are compared exactly and kept, at most max_samples of them in all (sampled evenly
+        from each probe). The threshold within the window that minimises disagreements is kept. Memory use is
+        bounded by max_samples however large the gallery is.
+
+        :param face_encodings: The exact encodings this gallery was built from, in the same order
+        :param tolerance: The exact-distance tolerance to calibrate for
+        :return: The calibrated threshold
+        """
+        face_encodings = np.asarray(face_encodings, dtype=np.float32)
+        if len(face_encodings) == 0:
+            return tolerance
+
+        rng = np.random.RandomState(seed)
+        probes = face_encodings[rng.permutation(len(face_encodings))[:max_probes]]
+        samples_per_probe = max(1, max_samples // len(probes))
+
+        exact = []
+        approximate = []
+        for probe in probes:
+            distances = self.face_distance(probe)
+            near = np.flatnonzero(np.abs(distances - tolerance) <= window)
+            if len(near) > samples_per_probe:
+                near = np.sort(rng.choice(near, samples_per_probe, replace=False))
+            exact.append(np.linalg.norm(face_encodings[near] - probe, axis=1))
+            approximate.append(distances[near])
+        exact = np.concatenate(exact)
+        approximate = np.concatenate(approximate)
+
+        # Scan candidate thresholds in quantized-distance order; the error count changes by one at each step
+        order = np.argsort(approximate, kind="stable")
+        is_match = exact[order] <= tolerance
+        # errors(k) = exact non-matches accepted when the first k candidates are accepted + exact matches rejected
+        false_accepts = np.concatenate(([0], np.cumsum(~is_match)))
+        false_rejects = is_match.sum() - np.concatenate(([0], np.cumsum(is_match)))
+        errors = false_accepts + false_rejects
+
+        # Accepting the first k candidates means a threshold in [sorted[k - 1], sorted[k]), clipped to the window.
+        # Several k may tie for the fewest errors; keep the threshold nearest the requested tolerance.
+        sorted_distances = approximate[order].astype(np.float64)
+        lower = np.concatenate(([tolerance - window], sorted_distances))
+        upper = np.concatenate((np.nextafter(sorted_distances, -np.inf), [tolerance + window]))
+        best = np.flatnonzero(errors == errors.min())
+        candidates = np.clip(tolerance, lower[best], upper[best])
+        threshold = float(candidates[np.argmin(np.abs(candidates - tolerance))])
+
+        self.thresholds[round(float(tolerance), 6)] = threshold
+        return threshold
+
+    def save(self, file):
+        """
+        Saves the gallery (codes, scales and calibrated thresholds) to an .npz file.
+        """
+        tolerances = np.array(sorted(self.thresholds), dtype=np.float64)
+        np.savez(file, codes=self.codes, scale=self.scale, tolerances=tolerances,
+                 thresholds=np.array([self.thresholds[t] for t in tolerances], dtype=np.float64))
+
+    @classmethod
+    def load(cls, file):
+        """
+        Loads a gallery written by save().
+        """
+        with np.load(file) as data:
+            thresholds = dict(zip(data["tolerances"].tolist(), data["thresholds"].tolist()))
+            return cls(data["codes"], data["scale"], thresholds)
+
+
+def match_agreement(face_encodings, quantized_gallery, probes, tolerance=0.6, names=None):
+    """
+    Recall check for a quantized gallery: the fraction of probes whose best match, and whether it is a match at
+    all, is the same with the quantized gallery as with the exact encodings.
+
+    :param face_encodings: The exact encodings the gallery was built from
+    :param quantized_gallery: The QuantizedGallery to check
+    :param probes: Face encodings to look up
+    :param tolerance: The tolerance the decisions are made at
+    :param names: Optional - the identity of each gallery encoding. When given, two best matches agree if they are
+                  the same person rather than the same gallery entry.
+    :return: A float between 0 and 1, where 1 means every decision was unchanged
+    """
+    if names is None:
+        names = np.arange(len(face_encodings))
+    face_encodings = np.asarray(face_encodings, dtype=np.float32)
+    if len(probes) == 0:
+        return 1.0
+
+    threshold = quantized_gallery.threshold(tolerance)
+    agreed = 0
+    for probe in probes:
+        exact = np.linalg.norm(face_encodings - np.asarray(probe, dtype=np.float32), axis=1)
+        approximate = quantized_gallery.face_distance(probe)
+        exact_best = int(np.argmin(exact))
+        approximate_best = int(np.argmin(approximate))
+        exact_match = exact[exact_best] <= tolerance
+        approximate_match = approximate[approximate_best] <= threshold
+        if exact_match == approximate_match and (not exact_match or names[exact_best] == names[approximate_best]):
+            agreed += 1
+    return agreed / float(len(probes))
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import click
+import collections
+import contextlib
+import concurrent.futures
+import concurrent.futures.process
+import multiprocessing
+import os
+import sys
+import time
+
+TaskResult = collections.namedtuple("TaskResult", ["index", "task", "value", "error", "attempts", "seconds"])
+
+# Errors worth another try: a file still locked by whatever is writing it, a network share dropping out, a worker
+# briefly out of memory. Anything else (e.g. a corrupt image) fails the same way every time.
+TRANSIENT_ERRORS = (MemoryError, TimeoutError, ConnectionError, InterruptedError, BlockingIOError, PermissionError)
+
+
+def _describe(error):
+    return "{}: {}".format(type(error).__name__, error)
+
+
+def _run_task(function, args, retries, retry_on):
+    """
+    Runs function(*args), retrying errors in retry_on up to retries times.
+
+    :return: (value, error description or None, attempts, seconds)
+    """
+    started = time.time()
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            return function(*args), None, attempts, time.time() - started
+        except retry_on as e:
+            if attempts > retries:
+                return None, _describe(e), attempts, time.time() - started
+            time.sleep(min(0.5 * attempts, 5.0))
+        except Exception as e:
+            return None, _describe(e), attempts, time.time() - started
+
+
+class TaskRunner(object):
+    """
+    Runs a function over many tasks (e.g. one per image file) in a pool of worker processes, for long unattended
+    runs:
+
+    * Results come back to this process as they finish and, with ordered=True, are handed out in task order
+      through a reorder buffer. Tasks are only started a bounded distance ahead of the next result due, so the
+      buffer stays small even behind one slow task.
+    * A task that raises fails on its own; errors in retry_on are retried first. If a worker process dies (e.g.
+      a crash inside dlib), the tasks that were running are re-run one at a time, so only the task that crashes
+      again is failed.
+    * A progress bar with images/s and ETA is written to stderr, and summary() describes the whole run.
+
+    Usage:
+
+        runner = TaskRunner(detect_faces, processes=4)
+        for result in runner.run([(path,) for path in paths]):
+            if result.error is None:
+                print(result.value)
+        click.echo(runner.summary(), err=True)
+    """
+
+    def __init__(self, function, processes=1, initializer=None, initargs=(), ordered=True, retries=1,
+                 retry_on=TRANSIENT_ERRORS, crash_retries=1, show_progress=True, label="Processing", unit="images"):
+        """
+        :param function: A top-level (picklable) function, called as function(*task) in a worker
+        :param processes: How many worker processes to use. None means one per CPU, 1 runs in this process.
+        :param initializer: Optional - called as initializer(*initargs) once in each worker before any task
+        :param ordered: Hand results out in task order rather than completion order
+        :param retries: How many times to retry a task that failed with an error in retry_on
+        :param crash_retries: How many times to re-run a task whose worker process died
+        """
+        self.function = function
+        self.processes = processes
+        self.initializer = initializer
+        self.initargs = initargs
+        self.ordered = ordered
+        self.retries = retries
+        self.retry_on = retry_on
+        self.crash_retries = crash_retries
+        self.show_progress = show_progress
+        self.label = label
+        self.unit = unit
+
+        self.completed = 0
+        self.failed = []
+        self.retried = 0
+        self.worker_crashes = 0
+        self.elapsed = 0.0
+        self._next_index = 0
+
+    def run(self, tasks):
+        """
+        Runs every task.
+
+        :param tasks: A list of argument tuples
+        :return: A generator of TaskResult(index, task, value, error, attempts, seconds). error is None on success.
+        """
+        tasks = list(tasks)
+        started = time.time()
+        self._next_index = 0
+        buffered = {}
+        results = self._run_here(tasks) if self.processes == 1 else self._run_in_pool(tasks)
+
+        if self.show_progress:
+            bar = click.progressbar(length=len(tasks), label=self.label, file=sys.stderr, show_pos=True,
+                                    item_show_func=lambda rate: rate)
+        else:
+            bar = contextlib.nullcontext()
+        with bar:
+            for result in results:
+                self.completed += 1
+                if result.attempts > 1:
+                    self.retried += 1
+                if result.error is not None:
+                    self.failed.append(result)
+                self.elapsed = time.time() - started
+                if self.show_progress:
+                    bar.update(1, "{:.1f} {}/s".format(self.completed / max(self.elapsed, 1e-6), self.unit))
+
+                if not self.ordered:
+                    yield result
+                    continue
+                buffered[result.index] = result
+                while self._next_index in buffered:
+                    yield buffered.pop(self._next_index)
+                    self._next_index += 1
+        self.elapsed = time.time() - started
+
+    def _run_here(self, tasks):
+        if self.initializer is not None:
+            self.initializer(*self.initargs)
+        for index, task in enumerate(tasks):
+            value, error, attempts, seconds = _run_task(self.function, task, self.retries, self.retry_on)
+            yield TaskResult(index, task, value, error, attempts, seconds)
+
+    def _run_in_pool(self, tasks):
+        # macOS will crash due to a bug in libdispatch if you don't use 'forkserver'
+        context = None
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+        workers = self.processes or os.cpu_count() or 1
+        window = workers * 8
+
+        pending = collections.deque(range(len(tasks)))
+        # Tasks that were running when a worker died. They run one at a time, so a crash names its task.
+        suspects = collections.deque()
+        crashes = collections.Counter()
+        in_flight = {}
+        executor = None
+        try:
+            while pending or suspects or in_flight:
+                if executor is None:
+                    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                                                      initializer=self.initializer,
+                                                                      initargs=self.initargs)
+                isolated = bool(suspects)
+                if isolated:
+                    index = suspects.popleft()
+                    in_flight[executor.submit(_run_task, self.function, tasks[index], self.retries,
+                                              self.retry_on)] = index
+                else:
+                    while (pending and len(in_flight) < workers * 2
+                           and (not self.ordered or pending[0] < self._next_index + window)):
+                        index = pending.popleft()
+                        in_flight[executor.submit(_run_task, self.function, tasks[index], self.retries,
+                                                  self.retry_on)] = index
+
+                # A suspect runs alone, so wait for it to finish before submitting anything else
+                done, _ = concurrent.futures.wait(in_flight, return_when=(
+                    concurrent.futures.ALL_COMPLETED if isolated else concurrent.futures.FIRST_COMPLETED))
+                lost = []
+                for future in done:
+                    index = in_flight.pop(future)
+                    try:
+                        value, error, attempts, seconds = future.result()
+                    except concurrent.futures.process.BrokenProcessPool:
+                        lost.append(index)
+                        continue
+                    except Exception as e:
+                        # e.g. the result couldn't be pickled
+                        value, error, attempts, seconds = None, _describe(e), 1, 0.0
+                    yield TaskResult(index, tasks[index], value, error, attempts, seconds)
+
+                if lost:
+                    # Every task still running died with the worker
+                    self.worker_crashes += 1
+                    lost.extend(in_flight.values())
+                    in_flight.clear()
+                    executor.shutdown(wait=True)
+                    executor = None
+                    if isolated:
+                        index = lost[0]
+                        crashes[index] += 1
+                        if crashes[index] > self.crash_retries:
+                            yield TaskResult(index, tasks[index], None, "worker process crashed", crashes[index], 0.0)
+                        else:
+                            suspects.appendleft(index)
+                    else:
+                        suspects.extend(sorted(lost))
+        finally:
+            if executor is not None:
+                for future in in_flight:
+                    future.cancel()
+                executor.shutdown(wait=True)
+
+    def summary(self):
+        """A description of the run: throughput, failures and retries."""
+        rate = self.completed / self.elapsed if self.elapsed > 0 else 0.0
+        lines = ["Processed {} {} in {:.1f}s ({:.2f} {}/s): {} succeeded, {} failed, {} retried.".format(
+            self.completed, self.unit, self.elapsed, rate, self.unit, self.completed - len(self.failed),
+            len(self.failed), self.retried)]
+        if self.worker_crashes:
+            lines.append("{} worker process crash(es) were recovered from.".format(self.worker_crashes))
+        for result in self.failed:
+            lines.append("FAILED {}: {}".format(result.task[0], result.error))
+        return "\n".join(lines)
@@ -0,0 +1,452 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import click
+import secrets
+import multiprocessing
+import multiprocessing.connection
+import threading
+import numpy as np
+
+# Rows scored per matrix product, so a query never needs a shard-sized temporary
+_BLOCK_ROWS = 65536
+# Most rows moved between shards in one message while rebalancing
+_MOVE_ROWS = 262144
+
+
+class ShardStore(object):
+    """
+    The encodings held by one shard. Rows are appended in place (the arrays grow by doubling), so registering a
+    face doesn't copy the shard.
+    """
+
+    def __init__(self):
+        self.encodings = np.empty((0, 128), dtype=np.float32)
+        self.squared_norms = np.empty(0, dtype=np.float32)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.names = []
+        self.size = 0
+
+    def _reserve(self, rows):
+        if rows <= len(self.encodings):
+            return
+        capacity = max(rows, 2 * len(self.encodings), 1024)
+        for attribute, shape in (("encodings", (capacity, 128)), ("squared_norms", capacity), ("ids", capacity)):
+            old = getattr(self, attribute)
+            new = np.empty(shape, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, attribute, new)
+
+    def clear(self):
+        self.__init__()
+
+    def add(self, encodings, names, ids):
+        """
+        :param encodings: (n, 128) array of encodings to append
+        :param names: The name of each encoding, or None
+        :param ids: The gallery-wide id of each encoding
+        :return: The shard's new size
+        """
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+        end = self.size + len(encodings)
+        self._reserve(end)
+        self.encodings[self.size:end] = encodings
+        self.squared_norms[self.size:end] = np.einsum("ij,ij->i", encodings, encodings)
+        self.ids[self.size:end] = ids
+        self.names.extend(names if names is not None else [None] * len(encodings))
+        self.size = end
+        return self.size
+
+    def take(self, count):
+        """
+        Removes the last count rows, to move them to another shard.
+
+        :return: (encodings, names, ids) of the removed rows
+        """
+        start = max(self.size - count, 0)
+        taken = (self.encodings[start:self.size].copy(), self.names[start:], self.ids[start:self.size].copy())
+        del self.names[start:]
+        self.size = start
+        return taken
+
+    def top_k(self, probes, k):
+        """
+        :param probes: (M, 128) float32 array of encodings to look up
+        :param k: How many candidates to return per probe
+        :return: (ids, names, distances) of this shard's k closest rows to each probe, closest first. ids and
+                 distances are (M, k) arrays and names is a list of M lists.
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, 128)
+        k = min(k, self.size)
+        best_scores = np.empty((len(probes), 0), dtype=np.float32)
+        best_rows = np.empty((len(probes), 0), dtype=np.int64)
+        for start in range(0, self.size, _BLOCK_ROWS):
+            end = min(start + _BLOCK_ROWS, self.size)
+            # Squared distance minus |probe|^2, which is the same for every row
+            scores = probes @ self.encodings[start:end].T
+            scores *= -2
+            scores += self.squared_norms[start:end]
+            if k < scores.shape[1]:
+                rows = np.argpartition(scores, k - 1, axis=1)[:, :k]
+            else:
+                rows = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, rows, axis=1)], axis=1)
+            best_rows = np.concatenate([best_rows, rows + start], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+
+        order = np.argsort(best_scores, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        squared = np.take_along_axis(best_scores, order, axis=1) + np.einsum("ij,ij->i", probes, probes)[:, np.newaxis]
+        distances = np.sqrt(np.maximum(squared, 0))
+        ids = self.ids[best_rows]
+        names = [[self.names[row] for row in rows] for rows in best_rows.tolist()]
+        return ids, names, distances
+
+
+def _handle_request(store, request):
+    command, args = request[0], request[1:]
+    if command == "top_k":
+        return store.top_k(*args)
+    if command == "add":
+        return store.add(*args)
+    if command == "take":
+        return store.take(*args)
+    if command == "clear":
+        return store.clear()
+    if command == "size":
+        return store.size
+    raise ValueError("Unknown shard command {!r}".format(command))
+
+
+def _serve_connection(store, connection, lock):
+    """Answers requests from one coordinator until it disconnects or sends None."""
+    with connection:
+        while True:
+            try:
+                request = connection.recv()
+            except (EOFError, OSError):
+                break
+            if request is None:
+                break
+            try:
+                with lock:
+                    response = ("ok", _handle_request(store, request))
+            except Exception as e:
+                response = ("error", repr(e))
+            connection.send(response)
+
+
+def _shard_worker(connection):
+    _serve_connection(ShardStore(), connection, threading.Lock())
+
+
+def parse_shard_address(address):
+    """
+    :param address: "host:port"
+    :return: (host, port) as used by multiprocessing.connection
+    """
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def serve_shard(address, authkey):
+    """
+    Holds one shard for ShardedMatcher(addresses=[...]) and answers its requests until the process is stopped.
+    Requests are unpickled, which can run arbitrary code, so only coordinators that know authkey are answered.
+
+    :param address: (host, port) to listen on
+    :param authkey: bytes shared with the coordinator
+    """
+    if not authkey:
+        raise ValueError("An authkey is required to serve a shard")
+    store = ShardStore()
+    lock = threading.Lock()
+    with multiprocessing.connection.Listener(address, authkey=authkey) as listener:
+        while True:
+            try:
+                connection = listener.accept()
+            except multiprocessing.AuthenticationError:
+                continue
+            threading.Thread(target=_serve_connection, args=(store, connection, lock), daemon=True).start()
+
+
+def _fill_counts(sizes, count):
+    """
+    :return: How many of count new rows to give each shard so the shard sizes end up as even as possible
+    """
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    counts = [0] * len(sizes)
+    remaining = count
+    for filled in range(1, len(order) + 1):
+        level = sizes[order[0]] + counts[order[0]]
+        next_level = sizes[order[filled]] if filled < len(order) else None
+        # Raise the filled smallest shards to the next shard's size, or share out what's left between them
+        if next_level is None or (next_level - level) * filled >= remaining:
+            each, extra = divmod(remaining, filled)
+            for position in range(filled):
+                counts[order[position]] += each + (1 if position < extra else 0)
+            break
+        for position in range(filled):
+            counts[order[position]] += next_level - level
+        remaining -= (next_level - level) * filled
+    return counts
+
+
+class ShardedMatcher(object):
+    """
+    Matches face encodings against a gallery split across several shards, each holding its part of the gallery
+    in its own process: local worker processes, or shard servers on other hosts (see serve_shard()).
+
+    A lookup sends the probes to every shard at once, each shard finds its own k closest rows, and the per-shard
+    results are merged here, so a lookup costs about one shard's matrix products and the coordinator never holds
+    the encodings. New encodings go to the smallest shards, and add_shard() moves rows onto the new shard, so the
+    shards stay the same size as the gallery grows.
+
+    Distances are euclidean, exactly as FaceMatcher (and api.face_distance()) computes them. The index returned
+    by top_k() is the order in which the encoding was added.
+
+    Usage:
+
+        with ShardedMatcher(known_face_encodings, known_face_names, shards=4) as matcher:
+            name, distance = matcher.best_match(face_encoding, tolerance=0.6)
+            matcher.add([new_encoding], ["Alice"])
+    """
+
+    def __init__(self, known_face_encodings=None, known_face_names=None, shards=2, addresses=None, authkey=None,
+                 thresholds=None, rebalance_slack=0.05):
+        """
+        :param known_face_encodings: Optional - a list or (N, 128) array of known face encodings
+        :param known_face_names: Optional - the name of each known encoding, in the same order
+        :param shards: How many local worker processes to start when addresses isn't given (at least 1)
+        :param addresses: Optional - (host, port) of each running serve_shard(). Their contents are replaced.
+        :param authkey: Optional - bytes shared with the shard servers. Required to connect to any.
+        :param thresholds: Optional - dict mapping a name to its own tolerance, e.g. from calibrate_thresholds()
+        :param rebalance_slack: How much bigger than the average (as a fraction) a shard may get before rows are
+                                moved off it
+        """
+        if not addresses and shards < 1:
+            raise ValueError("shards must be at least 1")
+        self.authkey = authkey
+        self.rebalance_slack = rebalance_slack
+        self.set_thresholds(thresholds)
+        self._connections = []
+        self._processes = []
+        self._sizes = []
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        try:
+            if addresses:
+                for address in addresses:
+                    self._connect(address)
+            else:
+                for _ in range(shards):
+                    self._start_worker()
+            if known_face_encodings is not None:
+                self.add(known_face_encodings, known_face_names)
+        except Exception:
+            self.close()
+            raise
+
+    def _start_worker(self):
+        connection, worker_connection = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_shard_worker, args=(worker_connection,), daemon=True)
+        process.start()
+        worker_connection.close()
+        self._processes.append(process)
+        self._connections.append(connection)
+        self._sizes.append(0)
+
+    def _connect(self, address):
+        if not self.authkey:
+            raise ValueError("An authkey is required to connect to shard servers")
+        connection = multiprocessing.connection.Client(address, authkey=self.authkey)
+        self._connections.append(connection)
+        self._sizes.append(0)
+        self._call([(len(self._connections) - 1, ("clear",))])
+
+    def _call(self, requests):
+        """
+        Sends every (shard, request) pair before reading any reply, so the shards work on them at the same time.
+
+        :return: The replies, in the same order
+        """
+        for shard, request in requests:
+            self._connections[shard].send(request)
+        replies = [self._connections[shard].recv() for shard, request in requests]
+        for status, value in replies:
+            if status != "ok":
+                raise RuntimeError("Shard request failed: {}".format(value))
+        return [value for status, value in replies]
+
+    @property
+    def shard_sizes(self):
+        return list(self._sizes)
+
+    def __len__(self):
+        return sum(self._sizes)
+
+    def set_thresholds(self, thresholds):
+        self.thresholds = {}
+        for name, threshold in (thresholds or {}).items():
+            self.thresholds[name] = threshold["threshold"] if isinstance(threshold, dict) else threshold
+
+    def tolerance_for(self, name, tolerance=0.6):
+        """
+        :return: The threshold matches against name are accepted at
+        """
+        return self.thresholds.get(name, tolerance)
+
+    def add(self, face_encodings, face_names=None):
+        """
+        Adds encodings to the gallery, spread over the smallest shards.
+
+        :param face_encodings: A list or (n, 128) array of face encodings
+        :param face_names: Optional - the name of each encoding. Defaults to its index.
+        """
+        encodings = np.asarray(face_encodings, dtype=np.float32).reshape(-1, 128)
+        names = list(face_names) if face_names is not None else None
+        if names is not None and len(names) != len(encodings):
+            raise ValueError("face_names must have one name per face encoding")
+
+        with self._lock:
+            ids = np.arange(self._next_id, self._next_id + len(encodings), dtype=np.int64)
+            if names is None:
+                names = ids.tolist()
+            self._next_id += len(encodings)
+
+            requests = []
+            start = 0
+            for shard, count in enumerate(_fill_counts(self._sizes, len(encodings))):
+                if count:
+                    end = start + count
+                    requests.append((shard, ("add", encodings[start:end], names[start:end], ids[start:end])))
+                    start = end
+            for (shard, request), size in zip(requests, self._call(requests)):
+                self._sizes[shard] = size
+            self._rebalance()
+
+    def add_shard(self, address=None):
+        """
+        Adds a shard (a new local worker, or the serve_shard() at address) and moves rows onto it.
+        """
+        with self._lock:
+            if address is None:
+                self._start_worker()
+            else:
+                self._connect(address)
+            self._rebalance()
+
+    def rebalance(self):
+        """
+        Moves rows from the biggest shards to the smallest ones until no shard is more than rebalance_slack
+        bigger than the average.
+        """
+        with self._lock:
+            self._rebalance()
+
+    def _rebalance(self):
+        average = len(self) / float(len(self._sizes))
+        if max(self._sizes) <= average * (1 + self.rebalance_slack) + 1:
+            return
+
+        base, extra = divmod(len(self), len(self._sizes))
+        # The biggest shards keep the extra rows, so as few rows as possible move
+        by_size = sorted(range(len(self._sizes)), key=lambda i: -self._sizes[i])
+        targets = [0] * len(self._sizes)
+        for position, shard in enumerate(by_size):
+            targets[shard] = base + (1 if position < extra else 0)
+
+        receivers = [shard for shard in range(len(self._sizes)) if self._sizes[shard] < targets[shard]]
+        for donor in by_size:
+            while self._sizes[donor] > targets[donor]:
+                receiver = receivers[0]
+                count = min(self._sizes[donor] - targets[donor], targets[receiver] - self._sizes[receiver], _MOVE_ROWS)
+                encodings, names, ids = self._call([(donor, ("take", count))])[0]
+                self._sizes[donor] -= count
+                self._sizes[receiver] = self._call([(receiver, ("add", encodings, names, ids))])[0]
+                if self._sizes[receiver] >= targets[receiver]:
+                    receivers.pop(0)
+
+    def top_k(self, face_encodings_to_check, k=1):
+        """
+        Finds the k closest known encodings across all shards.
+
+        :param face_encodings_to_check: A single face encoding, or an (M, 128) array of them
+        :param k: How many candidates to return per probe
+        :return: For one probe, a list of (index, name, distance) tuples sorted closest first. For several probes,
+                 a list of such lists.
+        """
+        probes = np.asarray(face_encodings_to_check, dtype=np.float32)
+        single = probes.ndim == 1
+        probes = probes.reshape(-1, 128)
+
+        with self._lock:
+            shards = [shard for shard, size in enumerate(self._sizes) if size]
+            replies = self._call([(shard, ("top_k", probes, k)) for shard in shards])
+
+        results = [[] for _ in range(len(probes))]
+        if replies:
+            ids = np.concatenate([reply[0] for reply in replies], axis=1)
+            distances = np.concatenate([reply[2] for reply in replies], axis=1)
+            order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+            for row in range(len(probes)):
+                names = [name for reply in replies for name in reply[1][row]]
+                results[row] = [(int(ids[row, column]), names[column], float(distances[row, column]))
+                                for column in order[row]]
+        return results[0] if single else results
+
+    def best_match(self, face_encoding_to_check, tolerance=0.6):
+        """
+        :return: (name, distance) of the closest known encoding, or (None, distance) if it isn't within tolerance.
+                 distance is None when the gallery is empty.
+        """
+        candidates = self.top_k(face_encoding_to_check, 1)
+        if not candidates:
+            return None, None
+        index, name, distance = candidates[0]
+        return (name if distance <= self.tolerance_for(name, tolerance) else None), distance
+
+    def close(self):
+        """Disconnects from the shards and stops the local worker processes."""
+        for connection in self._connections:
+            try:
+                connection.send(None)
+                connection.close()
+            except OSError:
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._connections = []
+        self._processes = []
+        self._sizes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@click.command()
+@click.option('--address', default="127.0.0.1:9100", help='host:port to listen on.')
+@click.option('--authkey', envvar="FACE_RECOGNITION_SHARD_KEY", default=None, help='Key the coordinator must present (or set FACE_RECOGNITION_SHARD_KEY). A random one is generated and printed if not given.')
+def main(address, authkey):
+    """Holds one shard of a ShardedMatcher gallery for a coordinator on another host."""
+    host, port = parse_shard_address(address)
+    if not authkey:
+        authkey = secrets.token_hex(16)
+        print("Generated the shard key {} (pass it to the coordinator as --shard-authkey)".format(authkey))
+    print("Serving a gallery shard on {}:{}".format(host, port))
+    try:
+        serve_shard((host, port), authkey.encode("utf-8"))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import os
+import numpy as np
+
+SNAPSHOT_VERSION = 1
+
+
+def snapshot_paths(path):
+    """
+    A snapshot is a pair of files: <base>.npz with the names and source file stamps, and <base>.npy with the
+    encodings, kept as a plain .npy so it can be memory-mapped.
+
+    :param path: The snapshot's base path, with or without an .npz/.npy extension
+    :return: (index path, encodings path)
+    """
+    base, ext = os.path.splitext(path)
+    if ext.lower() not in (".npz", ".npy"):
+        base = path
+    return base + ".npz", base + ".npy"
+
+
+def file_stamp(path):
+    """
+    :return: (modification time in ns, size in bytes) of a file. A file whose stamp changed is re-encoded.
+    """
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+class GallerySnapshot(object):
+    """
+    Known face encodings together with the image files they came from, saved so that later runs only need to
+    encode files that were added or changed since.
+
+    Usage:
+
+        snapshot = GallerySnapshot.build(image_files, encode_file, previous=GallerySnapshot.load(path))
+        snapshot.save(path)
+
+        # In another process, without copying or unpickling the encodings:
+        snapshot = GallerySnapshot.load(path, mmap_mode="r")
+    """
+
+    def __init__(self, names, encodings, files, stamps, file_rows):
+        """
+        :param names: The name of each encoding
+        :param encodings: (N, 128) float32 array of encodings
+        :param files: The source image of every scanned file, including ones where no face was found
+        :param stamps: (len(files), 2) int64 array of file_stamp() values
+        :param file_rows: For each file, the row of its encoding in encodings, or -1 if it has none
+        """
+        self.names = list(names)
+        self.encodings = encodings
+        self.files = list(files)
+        self.stamps = np.asarray(stamps, dtype=np.int64).reshape(-1, 2)
+        self.file_rows = np.asarray(file_rows, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """
+        Loads a snapshot written by save().
+
+        :param path: The snapshot's base path
+        :param mmap_mode: "r" to memory-map the encodings read-only instead of reading them into memory
+        :return: A GallerySnapshot, or None if there is no usable snapshot at path
+        """
+        index_path, encodings_path = snapshot_paths(path)
+        if not (os.path.exists(index_path) and os.path.exists(encodings_path)):
+            return None
+
+        with np.load(index_path) as index:
+            if int(index["version"]) != SNAPSHOT_VERSION:
+                return None
+            names = index["names"].tolist()
+            files = index["files"].tolist()
+            stamps = index["stamps"]
+            file_rows = index["file_rows"]
+            encodings_stamp = tuple(index["encodings_stamp"].tolist())
+
+        # The two files are replaced one after the other; don't pair an index with another save's encodings
+        if encodings_stamp != file_stamp(encodings_path):
+            return None
+        # An empty array can't be memory-mapped
+        encodings = np.load(encodings_path, mmap_mode=mmap_mode if names else None)
+        if encodings.shape != (len(names), 128):
+            return None
+        return cls(names, encodings, files, stamps, file_rows)
+
+    def save(self, path):
+        """
+        Writes the snapshot to <base>.npz and <base>.npy. Each file is written under a temporary name and then
+        renamed over the old one, so a concurrent reader never sees a half-written file.
+        """
+        index_path, encodings_path = snapshot_paths(path)
+
+        temp_path = encodings_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(self.encodings, dtype=np.float32).reshape(-1, 128))
+        os.replace(temp_path, encodings_path)
+
+        temp_path = index_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(f, version=np.array(SNAPSHOT_VERSION),
+                     names=np.array(self.names, dtype=str), files=np.array(self.files, dtype=str),
+                     stamps=self.stamps, file_rows=self.file_rows,
+                     encodings_stamp=np.array(file_stamp(encodings_path), dtype=np.int64))
+        os.replace(temp_path, index_path)
+
+    @classmethod
+    def build(cls, image_files, encode_file, previous=None):
+        """
+        Builds a snapshot of image_files, reusing the encodings of every file whose stamp is unchanged since
+        previous.
+
+        :param image_files: The image files to include
+        :param encode_file: Called as encode_file(path) for new and changed files. Returns (name, encoding), or
+                            None if the file has no usable face.
+        :param previous: Optional - an earlier snapshot of (mostly) the same files
+        :return: (snapshot, number of files that had to be encoded)
+        """
+        previous_files = {}
+        if previous is not None:
+            previous_files = {file: i for i, file in enumerate(previous.files)}
+
+        names = []
+        encodings = []
+        stamps = []
+        file_rows = []
+        num_encoded = 0
+        for file in image_files:
+            stamp = file_stamp(file)
+            i = previous_files.get(file)
+            if i is not None and tuple(previous.stamps[i].tolist()) == stamp:
+                row = int(previous.file_rows[i])
+                result = (previous.names[row], previous.encodings[row]) if row >= 0 else None
+            else:
+                result = encode_file(file)
+                num_encoded += 1
+
+            stamps.append(stamp)
+            if result is None:
+                file_rows.append(-1)
+            else:
+                file_rows.append(len(names))
+                names.append(result[0])
+                encodings.append(np.asarray(result[1], dtype=np.float32))
+
+        encodings = np.array(encodings, dtype=np.float32).reshape(-1, 128)
+        return cls(names, encodings, image_files, stamps, file_rows), num_encoded
@@ -1,14 +1,15 @@
 import tkinter as tk
-from tkinter import messagebox, simpledialog
-import cv2
+from tkinter import messagebox, ttk
 import os
-import numpy as np
-import face_recognition
-import csv
+import sys
+import json
 from datetime import datetime, timedelta
 import threading
 import time
-from PIL import Image, ImageTk
+import contextlib
+from face_logger_store import open_default_store
+from face_logger_logd import open_default_log_writer
+from face_logger_events import open_default_publisher
 
 # Fix for embedded Python Tkinter
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -16,37 +17,129 @@ tcl_path = os.path.join(script_dir, "Lib", "site-packages", "tcl")
 os.environ['TCL_LIBRARY'] = os.path.join(tcl_path, 'tcl8.6')
 os.environ['TK_LIBRARY'] = os.path.join(tcl_path, 'tk8.6')
 
+# Set FACE_LOGGER_STARTUP_REPORT to a file to append each launch's startup timings to it as one JSON line
+STARTUP_REPORT = os.environ.get("FACE_LOGGER_STARTUP_REPORT")
+
+# The webcam both windows read from, also recorded with every logged event
+CAMERA_INDEX = 0
+
+# Imported by load_heavy_modules() on a background thread once the main window is showing. Loading
+# face_recognition alone loads every dlib model, which would otherwise delay the first paint by seconds.
+cv2 = np = face_recognition = ImageTk = None
+load_gallery = load_thresholds = calibrate_gallery = save_encoding = LatestFrameReader = Frame = None
+QUANTIZE_GALLERY = False
+
+
+class StartupTimer:
+    """Records how long each startup step took and when it finished, relative to when this module started."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.steps = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def step(self, name):
+        step_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, time.perf_counter() - step_start)
+
+    def mark(self, name):
+        self._record(name, 0.0)
+
+    def _record(self, name, seconds):
+        with self._lock:
+            self.steps.append((name, seconds, time.perf_counter() - self.started))
+
+    def report(self, path=None):
+        """Prints the timings and, if path is given, appends them to it as one JSON line."""
+        print("[INFO] Startup timings (took / finished at):")
+        for name, seconds, at in self.steps:
+            print(f"  {name:<34} {seconds * 1000:8.1f} ms {at * 1000:8.1f} ms")
+        if path:
+            record = {"timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "python": sys.version.split()[0],
+                      "steps": [{"name": name, "ms": round(seconds * 1000, 1), "at_ms": round(at * 1000, 1)}
+                                for name, seconds, at in self.steps]}
+            with open(path, 'a') as f:
+                f.write(json.dumps(record) + "\n")
+
+
+startup = StartupTimer()
+
+
+def load_heavy_modules(timer=startup):
+    global cv2, np, face_recognition, ImageTk
+    global load_gallery, load_thresholds, calibrate_gallery, save_encoding, LatestFrameReader, Frame, QUANTIZE_GALLERY
+    with timer.step("import numpy"):
+        import numpy as np
+    with timer.step("import cv2"):
+        import cv2
+    with timer.step("import PIL.ImageTk"):
+        from PIL import ImageTk
+    with timer.step("import face_recognition (models)"):
+        import face_recognition
+    with timer.step("import gallery and sources"):
+        from face_logger_gallery import load_gallery, load_thresholds, calibrate_gallery, save_encoding, QUANTIZE_GALLERY
+        from face_logger_sources import LatestFrameReader
+        from face_logger_frames import Frame
+
 class FaceLoggerApp:
-    def __init__(self, root):
+    def __init__(self, root, event_store=None, event_publisher=None):
         self.root = root
+        self.event_store = event_store
+        self.event_publisher = event_publisher
         self.root.title("Face Recognition Entry Logger")
         self.root.configure(bg="#2c3e50")
 
         self.known_face_encodings = []
         self.known_face_names = []
-        self.last_log_time = {}
+        self.thresholds = {}
+        self.last_log_time = event_store.last_log_times() if event_store else {}
         self.log_cooldown = timedelta(hours=1)
-        self.load_known_faces()
 
         self.create_widgets()
-
-    def load_known_faces(self):
-        self.known_face_encodings = []
-        self.known_face_names = []
-        if not os.path.exists("faces"):
-            os.makedirs("faces")
-
-        for person_name in os.listdir("faces"):
-            person_dir = os.path.join("faces", person_name)
-            if os.path.isdir(person_dir):
-                for filename in os.listdir(person_dir):
-                    if filename.endswith(".npy"):
-                        try:
-                            encoding = np.load(os.path.join(person_dir, filename))
-                            self.known_face_encodings.append(encoding)
-                            self.known_face_names.append(person_name)
-                        except Exception as e:
-                            print(f"Error loading encoding for {person_name}: {e}")
+        self._load_error = None
+        self._loader = threading.Thread(target=self._load_models, daemon=True)
+        # Start loading once the window has been drawn, so the imports don't compete with the first paint
+        self.root.after_idle(self._start_loading)
+
+    def _start_loading(self):
+        startup.mark("first paint")
+        self._loader.start()
+        self.root.after(50, self._check_models_loaded)
+
+    def _load_models(self):
+        try:
+            load_heavy_modules()
+            with startup.step("load gallery"):
+                self.load_known_faces()
+        except Exception as e:
+            self._load_error = e
+
+    def _check_models_loaded(self):
+        if self._loader.is_alive():
+            self.root.after(50, self._check_models_loaded)
+            return
+        self.progress.stop()
+        self.progress.pack_forget()
+        if self._load_error is not None:
+            self.status_label.config(text="Could not load face models.")
+            messagebox.showerror("Error", f"Could not load face models: {self._load_error}")
+            return
+        self.status_label.config(text=f"Ready. {len(self.known_face_names)} known faces.")
+        self.register_button.config(state=tk.NORMAL)
+        self.log_button.config(state=tk.NORMAL)
+        startup.mark("ready")
+        startup.report(STARTUP_REPORT)
+
+    def load_known_faces(self, changed_names=None):
+        self.known_face_encodings, self.known_face_names = load_gallery(quantize=QUANTIZE_GALLERY)
+        if changed_names:
+            # Recalibrate from the gallery just loaded instead of reading it all again
+            calibrate_gallery(changed_names=changed_names, gallery=(self.known_face_encodings, self.known_face_names))
+        self.thresholds = load_thresholds()
         print(f"Loaded {len(self.known_face_names)} known faces.")
 
     def create_widgets(self):
@@ -58,17 +151,23 @@ class FaceLoggerApp:
 
         button_style = {"font": ("Arial", 12), "bg": "#3498db", "fg": "white", "activebackground": "#2980b9", "relief": "flat", "width": 20, "height": 2}
         
-        self.register_button = tk.Button(main_frame, text="Register New Face", command=self.open_registration_window, **button_style)
+        self.register_button = tk.Button(main_frame, text="Register New Face", command=self.open_registration_window, state=tk.DISABLED, **button_style)
         self.register_button.pack(pady=10)
 
-        self.log_button = tk.Button(main_frame, text="Start Logging", command=self.open_logging_window, **button_style)
+        self.log_button = tk.Button(main_frame, text="Start Logging", command=self.open_logging_window, state=tk.DISABLED, **button_style)
         self.log_button.pack(pady=10)
 
+        self.status_label = tk.Label(main_frame, text="Loading face models...", font=("Arial", 10), bg="#2c3e50", fg="white")
+        self.status_label.pack(pady=(10, 0))
+        self.progress = ttk.Progressbar(main_frame, mode="indeterminate", length=200)
+        self.progress.pack(pady=5)
+        self.progress.start(10)
+
     def open_registration_window(self):
         RegistrationWindow(self.root, self.load_known_faces)
 
     def open_logging_window(self):
-        LoggingWindow(self.root, self.known_face_encodings, self.known_face_names, self.load_known_faces, self.last_log_time, self.log_cooldown)
+        LoggingWindow(self.root, self.known_face_encodings, self.known_face_names, self.load_known_faces, self.last_log_time, self.log_cooldown, self.event_store, self.thresholds, self.event_publisher)
 
 class RegistrationWindow(tk.Toplevel):
     def __init__(self, master, callback_on_close):
@@ -113,15 +212,13 @@ class RegistrationWindow(tk.Toplevel):
             messagebox.showerror("Error", "Please enter a name.")
             return
 
-        self.person_dir = os.path.join("faces", person_name)
-        if not os.path.exists(self.person_dir):
-            os.makedirs(self.person_dir)
-        else:
+        self.person_name = person_name
+        if os.path.exists(os.path.join("faces", person_name)):
             response = messagebox.askyesno("Name Exists", "This name already exists. Do you want to add more images to this person?")
             if not response:
                 return
 
-        self.cap = cv2.VideoCapture(0)
+        self.cap = LatestFrameReader(CAMERA_INDEX)
         if not self.cap.isOpened():
             messagebox.showerror("Error", "Could not open webcam.")
             return
@@ -136,8 +233,8 @@ class RegistrationWindow(tk.Toplevel):
         if self.is_capturing and self.cap:
             ret, frame = self.cap.read()
             if ret:
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                small_frame = cv2.resize(frame_rgb, (0, 0), fx=0.25, fy=0.25)
+                face_frame = Frame(frame)
+                small_frame = face_frame.detection_image("hog", 0.25)
                 face_locations = face_recognition.face_locations(small_frame)
 
                 for (top, right, bottom, left) in face_locations:
@@ -145,10 +242,9 @@ class RegistrationWindow(tk.Toplevel):
                     right *= 4
                     bottom *= 4
                     left *= 4
-                    cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+                    cv2.rectangle(face_frame.bgr, (left, top), (right, bottom), (0, 255, 0), 2)
 
-                img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-                img_tk = ImageTk.PhotoImage(image=img)
+                img_tk = ImageTk.PhotoImage(image=face_frame.to_image())
                 self.video_frame.config(image=img_tk)
                 self.video_frame.image = img_tk
             self.after(10, self.update_frame)
@@ -157,16 +253,14 @@ class RegistrationWindow(tk.Toplevel):
         if self.cap and self.is_capturing:
             ret, frame = self.cap.read()
             if ret:
-                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                face_locations = face_recognition.face_locations(rgb_frame)
-                if face_locations:
-                    face_encoding = face_recognition.face_encodings(rgb_frame, face_locations)[0]
+                pipeline = Frame(frame).pipeline()
+                if pipeline.face_rects:
+                    face_encoding = pipeline.face_encodings()[0]
                     self.face_encodings_to_save.append(face_encoding)
                     self.num_images_captured += 1
                     self.message_label.config(text=f"Captured {self.num_images_captured} images. Keep capturing or close.")
                     
-                    file_path = os.path.join(self.person_dir, f"face_{self.num_images_captured}.npy")
-                    np.save(file_path, face_encoding)
+                    save_encoding(self.person_name, face_encoding)
                 else:
                     self.message_label.config(text="No face detected. Please try again.")
             else:
@@ -176,11 +270,11 @@ class RegistrationWindow(tk.Toplevel):
         if self.cap:
             self.cap.release()
         self.is_capturing = False
-        self.callback_on_close()
+        self.callback_on_close([self.person_name] if self.num_images_captured else None)
         self.destroy()
 
 class LoggingWindow(tk.Toplevel):
-    def __init__(self, master, known_face_encodings, known_face_names, callback_on_close, last_log_time, log_cooldown):
+    def __init__(self, master, known_face_encodings, known_face_names, callback_on_close, last_log_time, log_cooldown, event_store=None, thresholds=None, event_publisher=None):
         super().__init__(master)
         self.title("Face Recognition Logging")
         self.configure(bg="#2c3e50")
@@ -188,9 +282,12 @@ class LoggingWindow(tk.Toplevel):
         
         self.known_face_encodings = known_face_encodings
         self.known_face_names = known_face_names
+        self.matcher = face_recognition.FaceMatcher(known_face_encodings, known_face_names, thresholds=thresholds)
         self.callback_on_close = callback_on_close
         self.last_log_time = last_log_time
         self.log_cooldown = log_cooldown
+        self.event_store = event_store
+        self.event_publisher = event_publisher
 
         log_frame = tk.Frame(self, bg="#2c3e50")
         log_frame.pack(padx=20, pady=20, fill="both", expand=True)
@@ -204,19 +301,13 @@ class LoggingWindow(tk.Toplevel):
         self.cap = None
         self.is_logging = False
         self.log_file = "logs.csv"
-        self.init_log_file()
+        self.log_writer = open_default_log_writer(self.log_file, event_store=self.event_store)
 
         self.start_logging()
         self.protocol("WM_DELETE_WINDOW", self.on_close)
 
-    def init_log_file(self):
-        if not os.path.exists(self.log_file):
-            with open(self.log_file, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(["Timestamp", "Name", "Status"])
-
     def start_logging(self):
-        self.cap = cv2.VideoCapture(0)
+        self.cap = LatestFrameReader(CAMERA_INDEX)
         if not self.cap.isOpened():
             messagebox.showerror("Error", "Could not open webcam.")
             self.on_close()
@@ -229,19 +320,20 @@ class LoggingWindow(tk.Toplevel):
         if self.is_logging and self.cap:
             ret, frame = self.cap.read()
             if ret:
-                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                face_locations = face_recognition.face_locations(rgb_frame)
-                face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+                face_frame = Frame(frame)
+                pipeline = face_frame.pipeline()
+                face_locations = pipeline.face_locations
+                face_encodings = pipeline.face_encodings()
 
                 for (top, right, bottom, left), face_encoding in zip(face_locations, face_encodings):
                     name = "Unknown"
-                    if self.known_face_encodings:
-                        matches = face_recognition.compare_faces(self.known_face_encodings, face_encoding)
-                        face_distances = face_recognition.face_distance(self.known_face_encodings, face_encoding)
-                        
-                        best_match_index = np.argmin(face_distances)
-                        if matches[best_match_index]:
-                            name = self.known_face_names[best_match_index]
+                    if len(self.matcher):
+                        best_name, best_distance = self.matcher.best_match(face_encoding)
+                        if self.event_publisher:
+                            self.event_publisher.publish(best_name or "Unknown", best_distance, (top, right, bottom, left),
+                                                         camera=CAMERA_INDEX)
+                        if best_name is not None:
+                            name = best_name
                             
                             current_time = datetime.now()
                             last_logged = self.last_log_time.get(name)
@@ -258,29 +350,35 @@ class LoggingWindow(tk.Toplevel):
                             self.log_entry("Unknown", "Detected")
                     
                     color = (0, 255, 0) if name != "Unknown" else (0, 0, 255)
-                    cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
-                    cv2.putText(frame, name, (left + 6, bottom - 6), cv2.FONT_HERSHEY_DUPLEX, 0.8, (255, 255, 255), 1)
+                    cv2.rectangle(face_frame.bgr, (left, top), (right, bottom), color, 2)
+                    cv2.putText(face_frame.bgr, name, (left + 6, bottom - 6), cv2.FONT_HERSHEY_DUPLEX, 0.8, (255, 255, 255), 1)
 
-                img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-                img_tk = ImageTk.PhotoImage(image=img)
+                img_tk = ImageTk.PhotoImage(image=face_frame.to_image())
                 self.video_frame.config(image=img_tk)
                 self.video_frame.image = img_tk
             self.after(10, self.update_logging_frame)
 
     def log_entry(self, name, status):
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with open(self.log_file, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([timestamp, name, status])
+        now = datetime.now()
+        self.log_writer.write(name, status, now, CAMERA_INDEX)
 
     def on_close(self):
         if self.cap:
             self.cap.release()
         self.is_logging = False
+        self.log_writer.close()
+        if self.event_store:
+            self.event_store.flush()
         self.callback_on_close()
         self.destroy()
 
 if __name__ == "__main__":
     root = tk.Tk()
-    app = FaceLoggerApp(root)
-    root.mainloop()
\ No newline at end of file
+    event_store = open_default_store()
+    event_publisher = open_default_publisher()
+    app = FaceLoggerApp(root, event_store, event_publisher)
+    root.mainloop()
+    if event_publisher:
+        event_publisher.close()
+    if event_store:
+        event_store.close()
\ No newline at end of file
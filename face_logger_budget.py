@@ -0,0 +1,183 @@
+import os
+import time
+import collections
+
+BudgetLevel = collections.namedtuple("BudgetLevel", ["scale", "upsample", "stride", "encode_rate"])
+
+# From the unbudgeted behaviour to the cheapest setting the controller will use:
+# (detection scale relative to --scale, upsample count, detect every Nth frame, most encodes per second or None)
+DEFAULT_LADDER = (
+    (1.0, 1, 1, None),
+    (1.0, 0, 1, None),
+    (0.75, 0, 1, None),
+    (0.5, 0, 1, None),
+    (0.5, 0, 2, 4.0),
+    (0.5, 0, 3, 2.0),
+    (0.35, 0, 4, 1.0),
+)
+
+
+class BudgetController:
+    """
+    Keeps the live logger within a frame-time or CPU budget by stepping through a ladder of cheaper settings:
+    a smaller detection scale, no upsampling, detecting only every Nth frame (frames in between are encoded at
+    the last detected locations) and a limit on how often faces are encoded.
+
+    The logger reports how long detection and encoding took on each frame. From that the controller learns the
+    detection cost per pixel, the encoding cost per face and the fixed overhead, and predicts what every level
+    would cost. Changes have hysteresis: it steps down (to the best level predicted to fit) only once the
+    measured cost is slack above the budget, steps up one level at a time only when the cost is well below it
+    and the better level is predicted to fit with room to spare, and never changes twice within hold_seconds.
+
+    With cpu_share, the per-frame budget is cpu_share of all cores spread over target_fps frames, the cost is
+    measured as process CPU time, and end_frame() also returns how long to sleep to stay within the share.
+    """
+
+    def __init__(self, frame_budget=None, cpu_share=None, target_fps=5.0, max_scale=1.0, ladder=DEFAULT_LADDER,
+                 slack=0.1, hold_seconds=3.0, smoothing=0.2, on_change=None):
+        if (frame_budget is None) == (cpu_share is None):
+            raise ValueError("Set exactly one of frame_budget or cpu_share")
+        self.cpus = os.cpu_count() or 1
+        self.cpu_share = cpu_share
+        if frame_budget is not None:
+            self.budget = frame_budget
+            self.target_fps = 1.0 / frame_budget
+        else:
+            self.budget = cpu_share * self.cpus / target_fps
+            self.target_fps = target_fps
+        self.levels = [BudgetLevel(round(max_scale * scale, 3), upsample, stride, rate)
+                       for scale, upsample, stride, rate in ladder]
+        self.slack = slack
+        self.hold_seconds = hold_seconds
+        self.smoothing = smoothing
+        self.on_change = on_change
+
+        self.level = 0
+        self.changes = 0
+        self.reason = "start"
+        self.frames_per_level = [0] * len(self.levels)
+        self.cost = None # smoothed seconds (wall or CPU) per frame
+        self.measured_share = None
+        self._detect_unit = None # detection seconds for a full-scale frame without upsampling
+        self._encode_per_face = None
+        self._faces = None
+        self._overhead = None
+        self._changed_at = time.perf_counter()
+        self._frames_at_level = 0
+        self._last_encode = None
+        self._frame_started = None
+        self._last_end = None
+
+    @property
+    def settings(self):
+        return self.levels[self.level]
+
+    def _clock(self):
+        return time.process_time() if self.cpu_share is not None else time.perf_counter()
+
+    def _smooth(self, average, value):
+        return value if average is None else average + self.smoothing * (value - average)
+
+    def start_frame(self):
+        self._frame_started = self._clock()
+
+    def should_detect(self):
+        """True if detection should run on this frame, False to reuse the last locations."""
+        return self._frames_at_level % self.settings.stride == 0
+
+    def should_encode(self):
+        """True if the faces on this frame may be encoded under the current encode rate limit."""
+        rate = self.settings.encode_rate
+        now = time.perf_counter()
+        if rate is not None and self._last_encode is not None and now - self._last_encode < 1.0 / rate:
+            return False
+        self._last_encode = now
+        return True
+
+    def end_frame(self, detect_seconds=None, encode_seconds=None, faces_encoded=0, faces_found=None):
+        """
+        Records the stage timings of the frame since start_frame() and adjusts the settings.
+
+        :param detect_seconds: Time spent detecting, or None if detection didn't run on this frame
+        :param encode_seconds: Time spent encoding faces_encoded faces, or None if nothing was encoded
+        :param faces_found: Faces detected, if detection ran
+        :return: Seconds the caller should sleep to stay within cpu_share (always 0 for a frame budget)
+        """
+        wall_now, clock_now = time.perf_counter(), self._clock()
+        cost = clock_now - (clock_now if self._frame_started is None else self._frame_started)
+        self.cost = self._smooth(self.cost, cost)
+        self.frames_per_level[self.level] += 1
+        self._frames_at_level += 1
+
+        level = self.settings
+        overhead = cost
+        if detect_seconds is not None:
+            self._detect_unit = self._smooth(self._detect_unit, detect_seconds / self._pixels(level))
+            self._faces = self._smooth(self._faces, faces_found or 0)
+            overhead -= detect_seconds
+        if encode_seconds is not None and faces_encoded:
+            self._encode_per_face = self._smooth(self._encode_per_face, encode_seconds / faces_encoded)
+            overhead -= encode_seconds
+        self._overhead = self._smooth(self._overhead, max(overhead, 0.0))
+
+        pause = 0.0
+        if self.cpu_share is not None and self._last_end is not None:
+            # CPU used since the previous frame ended (including the camera reader), against the share of the
+            # wall time that has passed
+            last_wall, last_clock = self._last_end
+            cpu_used, wall_used = clock_now - last_clock, wall_now - last_wall
+            pause = max(cpu_used / (self.cpu_share * self.cpus) - wall_used, 0.0)
+            if wall_used + pause > 0:
+                self.measured_share = self._smooth(self.measured_share, cpu_used / (wall_used + pause) / self.cpus)
+        self._last_end = (wall_now + pause, clock_now)
+
+        self._adjust(wall_now)
+        return pause
+
+    @staticmethod
+    def _pixels(level):
+        # HOG and CNN cost grows with the pixel count, and each upsample doubles both sides
+        return level.scale * level.scale * 4 ** level.upsample
+
+    def predict(self, level):
+        """Predicted cost per frame of a level, from the timings seen so far."""
+        encode_share = 1.0
+        if level.encode_rate is not None:
+            encode_share = min(1.0, level.encode_rate / self.target_fps)
+        return ((self._detect_unit or 0.0) * self._pixels(level) / level.stride
+                + (self._encode_per_face or 0.0) * (self._faces or 0.0) * encode_share
+                + (self._overhead or 0.0))
+
+    def _adjust(self, now):
+        if self._detect_unit is None or now - self._changed_at < self.hold_seconds:
+            return
+        if self.cost > self.budget * (1 + self.slack) and self.level < len(self.levels) - 1:
+            cheaper = range(self.level + 1, len(self.levels))
+            new_level = next((i for i in cheaper if self.predict(self.levels[i]) <= self.budget), cheaper[-1])
+            self._change(new_level, now, "over budget")
+        elif (self.level > 0 and self.cost < self.budget * (1 - 2 * self.slack)
+              and self.predict(self.levels[self.level - 1]) <= self.budget * (1 - self.slack)):
+            self._change(self.level - 1, now, "under budget")
+
+    def _change(self, new_level, now, reason):
+        old_cost = self.cost
+        self.level = new_level
+        self.reason = f"{reason} ({old_cost * 1000:.0f} ms per frame against {self.budget * 1000:.0f} ms)"
+        self.changes += 1
+        self._changed_at = now
+        self._frames_at_level = 0
+        # Start measuring the new level afresh
+        self.cost = self.predict(self.settings)
+        if self.on_change:
+            self.on_change(self)
+
+    def state(self):
+        """The current decision and the measurements behind it, as a JSON-serialisable dict."""
+        level = self.settings
+        return {"level": self.level, "scale": level.scale, "upsample": level.upsample, "stride": level.stride,
+                "encode_rate": level.encode_rate, "reason": self.reason, "changes": self.changes,
+                "budget_ms": round(self.budget * 1000, 1),
+                "cost_ms": None if self.cost is None else round(self.cost * 1000, 1),
+                "predicted_ms": [round(self.predict(level) * 1000, 1) for level in self.levels],
+                "cpu_share": None if self.measured_share is None else round(self.measured_share, 3),
+                "frames_per_level": list(self.frames_per_level)}
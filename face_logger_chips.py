@@ -0,0 +1,253 @@
+import os
+import csv
+import contextlib
+import zlib
+import struct
+import click
+import numpy as np
+from face_logger_gallery import FACES_DIR, VAULT_PATH, _write_temp_file, calibrate_gallery
+from face_logger_logd import file_lock
+
+CHIPS_FILE = "chips.pack"
+
+# magic, key length, chip height, chip width, channels, compressed pixel bytes
+_RECORD_HEADER = struct.Struct("<4sHHHBI")
+_MAGIC = b"FCH1"
+
+
+def chip_key(encoding_path, faces_dir=FACES_DIR):
+    """The archive key of an encoding file: its path relative to faces_dir, e.g. "alice/face_3.npy"."""
+    return os.path.relpath(encoding_path, faces_dir).replace(os.sep, "/")
+
+
+class ChipArchive:
+    """
+    The aligned 150x150 face chips that gallery encodings were computed from, packed into one append-only file
+    next to the gallery, so encodings can be recomputed or audited without decoding and detecting the source
+    images again.
+
+    Each record is a header, the key of the encoding file it belongs to and the zlib-compressed pixels. Records
+    are appended under a file lock, so several processes can add chips at once. A later record for a key
+    replaces an earlier one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._index = {} # key -> (offset of the pixels, compressed size, shape)
+        self._scanned_to = 0
+
+    def append(self, key, chip):
+        chip = np.ascontiguousarray(chip, dtype=np.uint8)
+        if chip.ndim == 2:
+            chip = chip[:, :, np.newaxis]
+        key_bytes = key.encode("utf-8")
+        pixels = zlib.compress(chip.tobytes(), 6)
+        header = _RECORD_HEADER.pack(_MAGIC, len(key_bytes), chip.shape[0], chip.shape[1], chip.shape[2], len(pixels))
+        with open(self.path, 'ab') as f:
+            with file_lock(f):
+                f.write(header + key_bytes + pixels)
+
+    def _scan(self):
+        """Indexes the records appended since the last scan."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._scanned_to)
+            while True:
+                header = f.read(_RECORD_HEADER.size)
+                if len(header) < _RECORD_HEADER.size:
+                    break
+                magic, key_length, height, width, channels, size = _RECORD_HEADER.unpack(header)
+                if magic != _MAGIC:
+                    raise ValueError(f"{self.path} is corrupt at byte {self._scanned_to}")
+                key = f.read(key_length).decode("utf-8")
+                offset = f.tell()
+                f.seek(size, os.SEEK_CUR)
+                if f.tell() > os.fstat(f.fileno()).st_size:
+                    break # A record still being written
+                self._index[key] = (offset, size, (height, width, channels))
+                self._scanned_to = f.tell()
+
+    def keys(self):
+        """The key of every chip, in the order they were first added."""
+        self._scan()
+        return list(self._index)
+
+    def __len__(self):
+        self._scan()
+        return len(self._index)
+
+    def __contains__(self, key):
+        self._scan()
+        return key in self._index
+
+    def read_many(self, keys):
+        """Returns the chips of keys as a list of (height, width, 3) uint8 arrays."""
+        self._scan()
+        chips = [None] * len(keys)
+        with open(self.path, 'rb') as f:
+            # Read in file order rather than key order
+            for i in sorted(range(len(keys)), key=lambda i: self._index[keys[i]][0]):
+                offset, size, shape = self._index[keys[i]]
+                f.seek(offset)
+                chip = np.frombuffer(zlib.decompress(f.read(size)), dtype=np.uint8).reshape(shape)
+                chips[i] = chip[:, :, 0] if shape[2] == 1 else chip
+        return chips
+
+    def read(self, key):
+        return self.read_many([key])[0]
+
+
+def open_chip_archive(faces_dir=FACES_DIR):
+    return ChipArchive(os.path.join(faces_dir, CHIPS_FILE))
+
+
+def gallery_chip_keys(archive, faces_dir=FACES_DIR):
+    """Returns (keys of archived chips whose encoding file still exists, encoding files without a chip)."""
+    archived = set(archive.keys())
+    keys = []
+    missing = []
+    for person_name in sorted(os.listdir(faces_dir)):
+        person_dir = os.path.join(faces_dir, person_name)
+        if not os.path.isdir(person_dir) or person_name.startswith("."):
+            continue
+        for filename in sorted(os.listdir(person_dir)):
+            if filename.endswith(".npy"):
+                key = f"{person_name}/{filename}"
+                (keys if key in archived else missing).append(key)
+    return keys, missing
+
+
+def _require_plain_gallery():
+    """Re-encoding and auditing read and replace faces/<name>/*.npy files, which a vault gallery doesn't have."""
+    if VAULT_PATH:
+        raise click.UsageError("The gallery is in the vault set by FACE_LOGGER_VAULT, which has no encoding files "
+                               "to re-encode or audit. Unset FACE_LOGGER_VAULT to work on a plain gallery.")
+
+
+def reencode_gallery(faces_dir=FACES_DIR, num_jitters=1, jitter_convergence=None, batch_size=64, show_progress=True):
+    """
+    Recomputes every gallery encoding that has an archived chip, without touching the source images, then
+    recalibrates the thresholds. Each .npy file is replaced atomically.
+
+    Returns (number re-encoded, encoding files that have no chip and were left as they were).
+    """
+    _require_plain_gallery()
+    # Imported here so enrolment's parent process, which only appends chips, doesn't load the models
+    import face_recognition
+    archive = open_chip_archive(faces_dir)
+    keys, missing = gallery_chip_keys(archive, faces_dir)
+
+    batches = range(0, len(keys), batch_size)
+    if show_progress:
+        bar = click.progressbar(batches, label="Re-encoding", show_pos=True)
+    else:
+        bar = contextlib.nullcontext(batches)
+    with bar as batches:
+        for start in batches:
+            batch = keys[start:start + batch_size]
+            encodings, _ = face_recognition.jittered_face_encodings(
+                archive.read_many(batch), num_jitters, chunk_size=5 if jitter_convergence else None,
+                convergence=jitter_convergence)
+            for key, encoding in zip(batch, encodings):
+                encoding_path = os.path.join(faces_dir, *key.split("/"))
+                temp_path = _write_temp_file(os.path.dirname(encoding_path), lambda f: np.save(f, encoding))
+                os.replace(temp_path, encoding_path)
+
+    if keys:
+        calibrate_gallery(faces_dir)
+    return len(keys), missing
+
+
+def audit_gallery(faces_dir=FACES_DIR, batch_size=64):
+    """
+    Checks every archived chip against its stored encoding.
+
+    Returns one dict per chip with its sharpness and brightness, "drift" (the distance between the stored
+    encoding and a fresh single-sample encoding of the chip, large when the stored one was made with other
+    settings) and "spread" (the distance from the stored encoding to the mean of that person's encodings, large
+    for a capture that looks unlike the rest).
+    """
+    _require_plain_gallery()
+    import face_recognition
+    from face_logger_enrol import _sharpness
+    archive = open_chip_archive(faces_dir)
+    keys, _ = gallery_chip_keys(archive, faces_dir)
+    stored = {key: np.load(os.path.join(faces_dir, *key.split("/"))).astype(np.float32) for key in keys}
+
+    by_person = {}
+    for key in keys:
+        by_person.setdefault(key.split("/")[0], []).append(stored[key])
+    centroids = {name: np.mean(encodings, axis=0) for name, encodings in by_person.items()}
+
+    rows = []
+    for start in range(0, len(keys), batch_size):
+        batch = keys[start:start + batch_size]
+        chips = archive.read_many(batch)
+        fresh, _ = face_recognition.jittered_face_encodings(chips, 1)
+        for key, chip, encoding in zip(batch, chips, fresh):
+            gray = chip.mean(axis=2) if chip.ndim == 3 else chip
+            name = key.split("/")[0]
+            rows.append({"key": key, "name": name, "sharpness": round(_sharpness(gray), 1),
+                         "brightness": round(float(gray.mean()), 1),
+                         "drift": round(float(np.linalg.norm(stored[key] - encoding)), 4),
+                         "spread": round(float(np.linalg.norm(stored[key] - centroids[name])), 4)})
+    return rows
+
+
+@click.group()
+@click.option('--faces-dir', default=FACES_DIR, help='Gallery directory holding the chip archive.')
+@click.pass_context
+def cli(ctx, faces_dir):
+    """Re-encodes and audits the gallery from archived face chips (see --keep-chips)."""
+    ctx.obj = faces_dir
+
+
+@cli.command()
+@click.option('--jitters', default=1, help='How many times to re-sample each face when encoding.')
+@click.option('--jitter-convergence', default=None, type=float, help='Stop re-sampling a face early once 5 more samples move its encoding less than this (e.g. 0.005).')
+@click.pass_obj
+def reencode(faces_dir, jitters, jitter_convergence):
+    """Recomputes every encoding from its chip."""
+    count, missing = reencode_gallery(faces_dir, jitters, jitter_convergence)
+    click.echo(f"[INFO] Re-encoded {count} faces.")
+    if missing:
+        click.echo(f"[WARNING] {len(missing)} encodings have no archived chip and were left unchanged.")
+
+
+@cli.command()
+@click.option('--output', default=None, help='Write every chip\'s scores to this CSV file.')
+@click.option('--max-spread', default=0.45, help='Report captures this far from the rest of the person\'s encodings.')
+@click.option('--min-sharpness', default=20.0, help='Report chips blurrier than this.')
+@click.pass_obj
+def audit(faces_dir, output, max_spread, min_sharpness):
+    """Scores every archived chip and lists the suspicious ones."""
+    rows = audit_gallery(faces_dir)
+    if output:
+        with open(output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=["key", "name", "sharpness", "brightness", "drift", "spread"])
+            writer.writeheader()
+            writer.writerows(rows)
+    flagged = [row for row in rows if row["spread"] > max_spread or row["sharpness"] < min_sharpness]
+    for row in sorted(flagged, key=lambda row: -row["spread"]):
+        click.echo(f"[WARNING] {row['key']}: spread {row['spread']}, sharpness {row['sharpness']}, drift {row['drift']}")
+    click.echo(f"[INFO] Audited {len(rows)} chips, {len(flagged)} flagged.")
+
+
+@cli.command()
+@click.argument('output_dir', type=click.Path(file_okay=False))
+@click.pass_obj
+def export(faces_dir, output_dir):
+    """Writes every archived chip to OUTPUT_DIR/<person>/face_N.png for review."""
+    import PIL.Image
+    archive = open_chip_archive(faces_dir)
+    keys = archive.keys()
+    for key in keys:
+        path = os.path.join(output_dir, *key.split("/"))[:-len(".npy")] + ".png"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        PIL.Image.fromarray(archive.read(key)).save(path)
+    click.echo(f"[INFO] Exported {len(keys)} chips to {output_dir}.")
+
+
+if __name__ == "__main__":
+    cli()
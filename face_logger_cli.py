@@ -1,206 +1,363 @@
 import cv2
 import os
-import numpy as np
 import face_recognition
-import csv
 from datetime import datetime
 import time
+import click
+from face_logger_gallery import load_gallery, load_thresholds, calibrate_gallery, save_encoding, QUANTIZE_GALLERY
+from face_logger_store import open_default_store
+from face_logger_logd import open_default_log_writer
+from face_logger_events import open_default_publisher
+from face_logger_sources import LatestFrameReader
+from face_logger_frames import Frame
+from face_logger_chips import open_chip_archive, chip_key, cli as chips_cli
+from face_logger_vault import cli as vault_cli
+from face_logger_budget import BudgetController
+from face_logger_enrol import main as enrol_main
+from face_logger_report import main as report_main
+from face_recognition.bench import main as bench_main
 
 class FaceLoggerCLI:
-    def __init__(self):
+    def __init__(self, log_file="logs.csv", event_store=None, log_writer=None, event_publisher=None, camera=1,
+                 scale=1.0, model="hog", tolerance=0.6, log_cooldown=5, buffer_size=1, num_jitters=1, keep_chips=False,
+                 budget=None):
         self.known_face_encodings = []
         self.known_face_names = []
-        self.log_file = "logs.csv"
-        self.init_log_file()
+        self.log_file = log_file
+        self.event_store = event_store
+        self.event_publisher = event_publisher
+        self.camera = camera
+        self.scale = scale # detect faces on a frame resized by this factor, encode them at full size
+        self.model = model
+        self.buffer_size = buffer_size
+        self.num_jitters = num_jitters # re-samples per registration capture; spread over all cores
+        self.chip_archive = open_chip_archive() if keep_chips else None # also archive each registered face chip
+        self.log_cooldown = log_cooldown # seconds before logging the same person again
+        self.tolerance = tolerance
+        self.log_writer = log_writer or open_default_log_writer(log_file, event_store=event_store)
+        self.budget = budget # optional BudgetController that picks scale/upsample/stride/encode rate while logging
+        self._budget_locations = []
+        if budget is not None:
+            budget.on_change = self._report_budget_change
         self.load_known_faces()
 
-    def init_log_file(self):
-        if not os.path.exists(self.log_file):
-            with open(self.log_file, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(["Timestamp", "Name", "Status"])
-
-    def load_known_faces(self):
-        self.known_face_encodings = []
-        self.known_face_names = []
-        if not os.path.exists("faces"):
-            os.makedirs("faces")
-
-        for person_name in os.listdir("faces"):
-            person_dir = os.path.join("faces", person_name)
-            if os.path.isdir(person_dir):
-                for filename in os.listdir(person_dir):
-                    if filename.endswith(".npy"):
-                        try:
-                            encoding = np.load(os.path.join(person_dir, filename))
-                            self.known_face_encodings.append(encoding)
-                            self.known_face_names.append(person_name)
-                        except Exception as e:
-                            print(f"Error loading encoding for {person_name}: {e}")
+    def load_known_faces(self, changed_names=None):
+        """Loads the gallery, first recalibrating it for changed_names (people just registered) if given."""
+        self.known_face_encodings, self.known_face_names = load_gallery(quantize=QUANTIZE_GALLERY, tolerance=self.tolerance)
+        if changed_names:
+            calibrate_gallery(changed_names=changed_names, gallery=(self.known_face_encodings, self.known_face_names))
+        self.matcher = face_recognition.FaceMatcher(self.known_face_encodings, self.known_face_names,
+                                                    thresholds=load_thresholds())
         print(f"[INFO] Loaded {len(self.known_face_names)} known faces.")
 
-    def _process_frame(self, frame):
-        """Ensures the frame is in the correct format (RGB, 8-bit) for face_recognition."""
-        if frame is None:
-            return None
-
-        # Ensure frame is 8-bit
-        if frame.dtype != np.uint8:
-            frame = frame.astype(np.uint8)
-
-        # Convert to RGB if it's a 3-channel image (assuming BGR from OpenCV)
-        if len(frame.shape) == 3 and frame.shape[2] == 3:
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        elif len(frame.shape) == 2: # Grayscale, convert to RGB
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
-        elif len(frame.shape) == 3 and frame.shape[2] == 4: # RGBA, convert to RGB
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2RGB)
+    def _open_camera(self):
+        # A digit selects a local camera; anything else (a file, an rtsp:// URL) is passed to OpenCV as is
+        source = int(self.camera) if str(self.camera).isdigit() else self.camera
+        if isinstance(source, int) or "://" in source:
+            # Live sources: always process the newest frame, never a backlog
+            cap = LatestFrameReader(source, self.buffer_size, fps=24)
         else:
-            print(f"[DEBUG] Unexpected frame shape or channels: {frame.shape}")
-            return None
-
-        # Ensure the array is contiguous in memory
-        if not rgb_frame.flags['C_CONTIGUOUS']:
-            rgb_frame = np.ascontiguousarray(rgb_frame)
-
-        return rgb_frame
-
-    def register_face(self):
-        person_name = input("Enter the name of the person to register: ").strip()
+            cap = cv2.VideoCapture(source)
+            cap.set(cv2.CAP_PROP_FPS, 24)
+        return cap
+
+    def _find_faces(self, frame):
+        """Returns (face_locations, face_encodings) for a Frame, detecting on a frame resized by self.scale."""
+        if self.scale == 1.0:
+            pipeline = frame.pipeline(model=self.model)
+        else:
+            pipeline = frame.pipeline(known_face_locations=self._detect_faces(frame, self.scale))
+        return pipeline.face_locations, pipeline.face_encodings()
+
+    def _detect_faces(self, frame, scale, upsample=1):
+        """Returns the face locations in a Frame, detected on a copy resized by scale."""
+        small_frame = frame.detection_image(self.model, scale)
+        small_locations = face_recognition.FacePipeline(small_frame, number_of_times_to_upsample=upsample,
+                                                        model=self.model).face_locations
+        if scale == 1.0:
+            return small_locations
+        return [tuple(int(round(v / scale)) for v in location) for location in small_locations]
+
+    def _find_faces_within_budget(self, frame):
+        """
+        Like _find_faces, with the settings self.budget currently allows. Between detections, faces are encoded at
+        the last detected locations. Returns (face_locations, face_encodings, stage timings for the budget).
+        """
+        settings = self.budget.settings
+        timings = {}
+        if self.budget.should_detect():
+            started = time.perf_counter()
+            self._budget_locations = self._detect_faces(frame, settings.scale, settings.upsample)
+            timings["detect_seconds"] = time.perf_counter() - started
+            timings["faces_found"] = len(self._budget_locations)
+
+        if not self._budget_locations or not self.budget.should_encode():
+            return [], [], timings
+        started = time.perf_counter()
+        pipeline = frame.pipeline(known_face_locations=self._budget_locations)
+        face_encodings = pipeline.face_encodings()
+        timings["encode_seconds"] = time.perf_counter() - started
+        timings["faces_encoded"] = len(face_encodings)
+        return pipeline.face_locations, face_encodings, timings
+
+    def _report_budget_change(self, budget):
+        settings = budget.settings
+        encode_limit = f"at most {settings.encode_rate:g} encodes/s" if settings.encode_rate else "no encode limit"
+        print(f"[INFO] Budget: {budget.reason}. Now detecting at scale {settings.scale:g}, upsample {settings.upsample}, "
+              f"every {settings.stride} frame(s), {encode_limit}.")
+        if self.event_publisher:
+            self.event_publisher.publish_status("budget", budget.state(), camera=self.camera)
+
+    def _encode_for_registration(self, frame, face_locations):
+        """Returns (encoding, aligned face chip) of the first face in a Frame."""
+        pipeline = frame.pipeline(known_face_locations=face_locations[:1])
+        face_chip = pipeline.face_chips()[0]
+        if self.num_jitters > 1:
+            encodings, _ = face_recognition.jittered_face_encodings([face_chip], self.num_jitters,
+                                                                    threads=os.cpu_count() or 1)
+            return encodings[0], face_chip
+        return pipeline.face_encodings()[0], face_chip
+
+    def _save_registration(self, person_name, face_encoding, face_chip=None):
+        encoding_path = save_encoding(person_name, face_encoding)
+        if self.chip_archive is not None and face_chip is not None:
+            self.chip_archive.append(chip_key(encoding_path), face_chip)
+
+    def register_face(self, person_name=None, count=None, interval=1.0, show=True):
+        """
+        Captures encodings of one person from the camera.
+
+        With show=True, a preview window is shown and 'c' captures an image. With show=False, no window is opened
+        and a frame with exactly one face is captured every interval seconds until count images are saved.
+        """
+        if person_name is None:
+            person_name = input("Enter the name of the person to register: ").strip()
         if not person_name:
             print("[ERROR] Name cannot be empty.")
             return
 
-        person_dir = os.path.join("faces", person_name)
-        if not os.path.exists(person_dir):
-            os.makedirs(person_dir)
-        else:
+        if os.path.exists(os.path.join("faces", person_name)):
             print(f"[INFO] Directory for {person_name} already exists. Adding more images.")
 
-        cap = cv2.VideoCapture(1)
-        cap.set(cv2.CAP_PROP_FPS, 24)
+        cap = self._open_camera()
         if not cap.isOpened():
             print("[ERROR] Could not open webcam.")
             return
 
-        print("[INFO] Press 'c' to capture an image, 'q' to quit registration.")
+        if show:
+            print("[INFO] Press 'c' to capture an image, 'q' to quit registration.")
+        else:
+            count = count or 5
+            print(f"[INFO] Capturing {count} images of {person_name}. Press Ctrl+C to stop.")
         num_images_captured = 0
+        last_capture_time = 0.0
+
+        try:
+            while count is None or num_images_captured < count:
+                ret, frame = cap.read()
+                if not ret or frame is None:
+                    print("[ERROR] Failed to grab frame or frame is empty.")
+                    break
+
+                face_frame = Frame.from_capture(frame)
+                if face_frame is None:
+                    continue
+
+                if not show:
+                    if time.time() - last_capture_time < interval:
+                        continue
+                    try:
+                        face_locations, face_encodings = self._find_faces(face_frame)
+                    except RuntimeError as e:
+                        print(f"[ERROR] RuntimeError during face processing: {e}")
+                        continue
+                    if len(face_encodings) == 1:
+                        face_chip = None
+                        if self.num_jitters > 1 or self.chip_archive is not None:
+                            face_encoding, face_chip = self._encode_for_registration(face_frame, face_locations)
+                            face_encodings = [face_encoding]
+                        self._save_registration(person_name, face_encodings[0], face_chip)
+                        num_images_captured += 1
+                        last_capture_time = time.time()
+                        print(f"[INFO] Captured image {num_images_captured} for {person_name}.")
+                    continue
 
-        while True:
-            ret, frame = cap.read()
-            if not ret or frame is None:
-                print("[ERROR] Failed to grab frame or frame is empty.")
-                break
-
-            rgb_frame = self._process_frame(frame)
-            if rgb_frame is None:
-                continue
-
-            try:
-                face_locations = face_recognition.face_locations(rgb_frame)
-            except RuntimeError as e:
-                print(f"[ERROR] RuntimeError during face_locations: {e}")
-                print(f"[DEBUG] Frame shape: {frame.shape}, Frame dtype: {frame.dtype}")
-                continue
+                try:
+                    face_locations = face_frame.pipeline().face_locations
+                except RuntimeError as e:
+                    print(f"[ERROR] RuntimeError during face_locations: {e}")
+                    print(f"[DEBUG] Frame shape: {frame.shape}, Frame dtype: {frame.dtype}")
+                    continue
 
-            for (top, right, bottom, left) in face_locations:
-                cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+                # Draw on a copy: a capture takes the face chip from this frame
+                preview = face_frame.bgr.copy()
+                for (top, right, bottom, left) in face_locations:
+                    cv2.rectangle(preview, (left, top), (right, bottom), (0, 255, 0), 2)
 
-            cv2.imshow("Registration - Press 'c' to capture, 'q' to quit", frame)
+                cv2.imshow("Registration - Press 'c' to capture, 'q' to quit", preview)
 
-            key = cv2.waitKey(1) & 0xFF
+                key = cv2.waitKey(1) & 0xFF
 
-            if key == ord('c'):
-                if face_locations:
-                    try:
-                        face_encoding = face_recognition.face_encodings(rgb_frame, face_locations)[0]
-                        num_images_captured += 1
-                        file_path = os.path.join(person_dir, f"face_{num_images_captured}.npy")
-                        np.save(file_path, face_encoding)
-                        print(f"[INFO] Captured image {num_images_captured} for {person_name}.")
-                    except RuntimeError as e:
-                        print(f"[ERROR] RuntimeError during face_encodings: {e}")
-                        print(f"[DEBUG] Frame shape: {frame.shape}, Frame dtype: {frame.dtype}")
-                else:
-                    print("[WARNING] No face detected. Please ensure your face is visible.")
-            elif key == ord('q'):
-                break
+                if key == ord('c'):
+                    if face_locations:
+                        try:
+                            face_encoding, face_chip = self._encode_for_registration(face_frame, face_locations)
+                            self._save_registration(person_name, face_encoding, face_chip)
+                            num_images_captured += 1
+                            print(f"[INFO] Captured image {num_images_captured} for {person_name}.")
+                        except RuntimeError as e:
+                            print(f"[ERROR] RuntimeError during face_encodings: {e}")
+                            print(f"[DEBUG] Frame shape: {frame.shape}, Frame dtype: {frame.dtype}")
+                    else:
+                        print("[WARNING] No face detected. Please ensure your face is visible.")
+                elif key == ord('q'):
+                    break
+        except KeyboardInterrupt:
+            pass # Ctrl+C ends a headless run
 
         cap.release()
-        cv2.destroyAllWindows()
-        self.load_known_faces() # Reload known faces after registration
+        if show:
+            cv2.destroyAllWindows()
+        # Reload known faces after registration
+        self.load_known_faces(changed_names=[person_name] if num_images_captured else None)
         print(f"[INFO] Registration for {person_name} complete. Captured {num_images_captured} images.")
 
-    def start_logging(self):
-        cap = cv2.VideoCapture(1)
-        cap.set(cv2.CAP_PROP_FPS, 24)
+    def start_logging(self, show=True, duration=None):
+        """
+        Logs recognised faces from the camera until 'q' is pressed, or with show=False (no preview window, no
+        display needed) until Ctrl+C or duration seconds have passed.
+        """
+        cap = self._open_camera()
         if not cap.isOpened():
             print("[ERROR] Could not open webcam.")
             return
 
-        print("[INFO] Starting logging. Press 'q' to quit.")
+        print("[INFO] Starting logging. Press 'q' to quit." if show else "[INFO] Starting headless logging. Press Ctrl+C to stop.")
+        started = time.time()
         last_logged_name = None
-        log_cooldown = 5 # seconds before logging the same person again
         last_log_time = time.time()
+        if self.event_store:
+            # Pick up the cooldown where the previous run left off instead of logging the same person again
+            last_log_times = self.event_store.last_log_times()
+            if last_log_times:
+                last_logged_name = max(last_log_times, key=last_log_times.get)
+                last_log_time = last_log_times[last_logged_name].timestamp()
+
+        try:
+            while duration is None or time.time() - started < duration:
+                ret, frame = cap.read()
+                if not ret or frame is None:
+                    print("[ERROR] Failed to grab frame or frame is empty.")
+                    break
+
+                if self.budget:
+                    self.budget.start_frame()
+                face_frame = Frame.from_capture(frame)
+                if face_frame is None:
+                    continue
+
+                try:
+                    if self.budget:
+                        face_locations, face_encodings, timings = self._find_faces_within_budget(face_frame)
+                    else:
+                        face_locations, face_encodings = self._find_faces(face_frame)
+                except RuntimeError as e:
+                    print(f"[ERROR] RuntimeError during face processing: {e}")
+                    print(f"[DEBUG] Frame shape: {frame.shape}, Frame dtype: {frame.dtype}")
+                    continue
+
+                current_time = time.time()
+
+                for (top, right, bottom, left), face_encoding in zip(face_locations, face_encodings):
+                    name, distance = self.match_face(face_encoding)
+                    if self.event_publisher:
+                        self.event_publisher.publish(name, distance, (top, right, bottom, left), camera=self.camera)
+
+                    if name != "Unknown":
+                        if name != last_logged_name or (current_time - last_log_time) > self.log_cooldown:
+                            self.log_entry(name, "Recognized")
+                            print(f'[LOG] {datetime.now().strftime("%Y-%m-%d %H:%M:%S")} - Recognized: {name}')
+                            last_logged_name = name
+                            last_log_time = current_time
+                    else:
+                        print("[WARNING] Unknown face detected. Please register this face.")
+                        self.log_entry("Unknown", "Detected")
+
+                    if show:
+                        cv2.rectangle(face_frame.bgr, (left, top), (right, bottom), (0, 255, 0) if name != "Unknown" else (0, 0, 255), 2)
+                        cv2.putText(face_frame.bgr, name, (left + 6, bottom - 6), cv2.FONT_HERSHEY_DUPLEX, 0.8, (255, 255, 255), 1)
+
+                pause = self.budget.end_frame(**timings) if self.budget else 0.0
+
+                if show:
+                    cv2.imshow("Logging - Press 'q' to quit", face_frame.bgr)
+
+                    # Sleep off any CPU budget pause in waitKey, so the preview window stays responsive
+                    key = cv2.waitKey(max(1, int(pause * 1000))) & 0xFF
+                    if key == ord('q'):
+                        break
+                elif pause:
+                    time.sleep(pause)
+        except KeyboardInterrupt:
+            pass # Ctrl+C ends a headless run
 
-        while True:
-            ret, frame = cap.read()
-            if not ret or frame is None:
-                print("[ERROR] Failed to grab frame or frame is empty.")
-                break
+        cap.release()
+        if show:
+            cv2.destroyAllWindows()
+        if self.event_store:
+            self.event_store.flush()
+        if isinstance(cap, LatestFrameReader):
+            print(f"[INFO] Processed {cap.frames_captured - cap.frames_dropped} of {cap.frames_captured} camera frames, skipped {cap.frames_dropped} to stay current.")
+        if self.budget:
+            state = self.budget.state()
+            print(f"[INFO] Budget: {state['changes']} setting changes, frames per level {state['frames_per_level']}, last cost {state['cost_ms']} ms per frame against {state['budget_ms']} ms.")
+        print("[INFO] Logging stopped.")
 
-            rgb_frame = self._process_frame(frame)
-            if rgb_frame is None:
+    def reprocess(self, source):
+        """Runs the logging pipeline over a recorded frame source, stamping log rows with the recording's time."""
+        print(f"[INFO] Reprocessing into {self.log_file}.")
+        last_logged_name = None
+        last_log_time = None
+        num_frames = 0
+        start = time.time()
+
+        for frame, frame_time in source:
+            num_frames += 1
+            face_frame = Frame.from_capture(frame)
+            if face_frame is None:
                 continue
 
             try:
-                face_locations = face_recognition.face_locations(rgb_frame)
-                face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+                face_locations, face_encodings = self._find_faces(face_frame)
             except RuntimeError as e:
                 print(f"[ERROR] RuntimeError during face processing: {e}")
-                print(f"[DEBUG] Frame shape: {frame.shape}, Frame dtype: {frame.dtype}")
                 continue
 
-            current_time = time.time()
-
-            for (top, right, bottom, left), face_encoding in zip(face_locations, face_encodings):
-                name = "Unknown"
-                if self.known_face_encodings:
-                    matches = face_recognition.compare_faces(self.known_face_encodings, face_encoding)
-                    face_distances = face_recognition.face_distance(self.known_face_encodings, face_encoding)
-                    
-                    best_match_index = np.argmin(face_distances)
-                    if matches[best_match_index]:
-                        name = self.known_face_names[best_match_index]
-
+            for face_encoding in face_encodings:
+                name = self.identify_face(face_encoding)
                 if name != "Unknown":
-                    if name != last_logged_name or (current_time - last_log_time) > log_cooldown:
-                        self.log_entry(name, "Recognized")
-                        print(f'[LOG] {datetime.now().strftime("%Y-%m-%d %H:%M:%S")} - Recognized: {name}')
+                    if (name != last_logged_name or last_log_time is None or
+                            (frame_time - last_log_time).total_seconds() > self.log_cooldown):
+                        self.log_entry(name, "Recognized", frame_time)
                         last_logged_name = name
-                        last_log_time = current_time
+                        last_log_time = frame_time
                 else:
-                    print("[WARNING] Unknown face detected. Please register this face.")
-                    self.log_entry("Unknown", "Detected")
-
-                cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0) if name != "Unknown" else (0, 0, 255), 2)
-                cv2.putText(frame, name, (left + 6, bottom - 6), cv2.FONT_HERSHEY_DUPLEX, 0.8, (255, 255, 255), 1)
+                    self.log_entry("Unknown", "Detected", frame_time)
 
-            cv2.imshow("Logging - Press 'q' to quit", frame)
+        elapsed = time.time() - start
+        print(f"[INFO] Reprocessed {num_frames} frames in {elapsed:.1f}s ({num_frames / max(elapsed, 1e-6):.1f} frames/s).")
 
-            key = cv2.waitKey(1) & 0xFF
-            if key == ord('q'):
-                break
+    def match_face(self, face_encoding):
+        """Returns (name or "Unknown", distance to the closest known encoding)."""
+        best_name, best_distance = self.matcher.best_match(face_encoding, self.tolerance)
+        return best_name or "Unknown", best_distance
 
-        cap.release()
-        cv2.destroyAllWindows()
-        print("[INFO] Logging stopped.")
+    def identify_face(self, face_encoding):
+        return self.match_face(face_encoding)[0]
 
-    def log_entry(self, name, status):
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with open(self.log_file, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([timestamp, name, status])
+    def log_entry(self, name, status, when=None):
+        when = when or datetime.now()
+        self.log_writer.write(name, status, when, self.camera)
 
     def run(self):
         while True:
@@ -215,11 +372,93 @@ class FaceLoggerCLI:
             elif choice == '2':
                 self.start_logging()
             elif choice == '3':
+                self.close()
                 print("Exiting. Goodbye!")
                 break
             else:
                 print("[ERROR] Invalid choice. Please try again.")
 
+    def close(self):
+        self.log_writer.close()
+        if self.event_publisher:
+            self.event_publisher.close()
+        if self.event_store:
+            self.event_store.close()
+
+
+def camera_options(func):
+    """Options shared by the subcommands that read from a camera."""
+    func = click.option('--camera', default="1", help='Camera index, video file or stream URL to read from.')(func)
+    func = click.option('--scale', default=1.0, help='Detect faces on frames resized by this factor (e.g. 0.5) to go faster.')(func)
+    func = click.option('--model', default="hog", type=click.Choice(["hog", "cnn", "haar+hog", "haar+cnn"]), help='Face detection model. The haar+ models only verify regions proposed by a fast Haar cascade.')(func)
+    func = click.option('--show/--headless', default=True, help='Show a preview window, or run without a display.')(func)
+    func = click.option('--buffer-size', default=1, help='Frames the camera driver may buffer (CAP_PROP_BUFFERSIZE), 0 for the driver default.')(func)
+    return func
+
+
+@click.group(invoke_without_command=True)
+@click.pass_context
+def cli(ctx):
+    """Face Recognition Entry Logger. Without a subcommand, starts the interactive menu."""
+    if ctx.invoked_subcommand is None:
+        app = FaceLoggerCLI(event_store=open_default_store(), event_publisher=open_default_publisher())
+        app.run()
+
+
+@cli.command()
+@click.option('--name', required=True, help='Name of the person to register.')
+@click.option('--count', default=None, type=int, help='Stop after this many images (5 by default when headless).')
+@click.option('--interval', default=1.0, help='Headless only: seconds between automatic captures.')
+@click.option('--jitters', default=1, help='How many times to re-sample each captured face. Higher is more accurate.')
+@click.option('--keep-chips', is_flag=True, help='Also archive each aligned face chip, so the gallery can later be re-encoded without the camera.')
+@camera_options
+def register(name, count, interval, jitters, keep_chips, camera, scale, model, show, buffer_size):
+    """Registers a person from the camera."""
+    app = FaceLoggerCLI(camera=camera, scale=scale, model=model, buffer_size=buffer_size, num_jitters=jitters,
+                        keep_chips=keep_chips)
+    app.register_face(name, count, interval, show)
+    app.close()
+
+
+@cli.command()
+@click.option('--log-file', default="logs.csv", help='CSV file to append log rows to.')
+@click.option('--tolerance', default=0.6, help='Match tolerance for people without a calibrated threshold.')
+@click.option('--cooldown', default=5.0, help='Seconds before the same person is logged again.')
+@click.option('--duration', default=None, type=float, help='Stop after this many seconds.')
+@click.option('--cpu-share', default=None, type=click.FloatRange(0.01, 1.0), help='Keep CPU use to this share of all cores (e.g. 0.25), lowering detection quality as needed.')
+@click.option('--frame-budget-ms', default=None, type=click.FloatRange(1.0), help='Keep processing time per frame within this, lowering detection quality as needed.')
+@click.option('--target-fps', default=5.0, help='With --cpu-share, the frame rate the share is spread over.')
+@camera_options
+def log(log_file, tolerance, cooldown, duration, cpu_share, frame_budget_ms, target_fps, camera, scale, model, show,
+        buffer_size):
+    """Logs recognised faces from the camera."""
+    if cpu_share is not None and frame_budget_ms is not None:
+        raise click.UsageError("Use either --cpu-share or --frame-budget-ms, not both.")
+    budget = None
+    if cpu_share is not None or frame_budget_ms is not None:
+        budget = BudgetController(frame_budget=frame_budget_ms / 1000.0 if frame_budget_ms else None,
+                                  cpu_share=cpu_share, target_fps=target_fps, max_scale=scale)
+    app = FaceLoggerCLI(log_file, event_store=open_default_store(), event_publisher=open_default_publisher(),
+                        camera=camera, scale=scale, model=model, tolerance=tolerance, log_cooldown=cooldown,
+                        buffer_size=buffer_size, budget=budget)
+    app.start_logging(show, duration)
+    app.close()
+
+
+@cli.command("rebuild-gallery")
+@click.option('--faces-dir', default="faces", help='Gallery directory to recalibrate.')
+def rebuild_gallery(faces_dir):
+    """Recomputes every person's match threshold from the saved encodings."""
+    calibration = calibrate_gallery(faces_dir)
+    print(f"[INFO] Calibrated {len(calibration)} people in {faces_dir}.")
+
+
+cli.add_command(enrol_main, "enrol-dir")
+cli.add_command(report_main, "report")
+cli.add_command(bench_main, "bench")
+cli.add_command(chips_cli, "chips")
+cli.add_command(vault_cli, "vault")
+
+
 if __name__ == "__main__":
-    app = FaceLoggerCLI()
-    app.run()
\ No newline at end of file
+    cli()
\ No newline at end of file
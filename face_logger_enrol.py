@@ -0,0 +1,180 @@
+import os
+import time
+import contextlib
+import multiprocessing
+import click
+import numpy as np
+from face_logger_gallery import FACES_DIR, save_encoding, calibrate_gallery
+from face_logger_chips import open_chip_archive, chip_key
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+# Photos are decoded at no more than this many pixels (JPEGs straight at a reduced scale) and larger non-JPEGs are
+# rejected, so one huge file in the enrolment folder can't exhaust a worker's memory
+MAX_DECODE_PIXELS = 50 * 1000 * 1000
+
+# Set in each pool worker by _init_worker so the dlib models are loaded once per process, not once per photo.
+face_recognition = None
+
+
+def find_enrolment_images(root):
+    """Walks <root>/<person>/*.jpg and returns a sorted list of (person_name, image_path)."""
+    tasks = []
+    for person_name in sorted(os.listdir(root)):
+        person_dir = os.path.join(root, person_name)
+        if not os.path.isdir(person_dir):
+            continue
+        for filename in sorted(os.listdir(person_dir)):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                tasks.append((person_name, os.path.join(person_dir, filename)))
+    return tasks
+
+
+def _init_worker():
+    global face_recognition
+    import face_recognition as fr
+    face_recognition = fr
+
+
+def _sharpness(gray):
+    """Variance of the Laplacian; blurry photos score low."""
+    if gray.shape[0] < 3 or gray.shape[1] < 3:
+        return 0.0
+    gray = gray.astype(np.float32)
+    laplacian = (4 * gray[1:-1, 1:-1] - gray[:-2, 1:-1] - gray[2:, 1:-1] - gray[1:-1, :-2] - gray[1:-1, 2:])
+    return float(laplacian.var())
+
+
+def encode_enrolment_image(task):
+    """
+    Decodes, quality-gates and encodes one enrolment photo. Runs inside a pool worker.
+
+    Returns (person_name, image_path, encoding, error, face_chip). encoding is None when the photo was rejected,
+    and error then says why. face_chip is the aligned chip that was encoded, if keep_chips is set.
+    """
+    person_name, image_path, max_size, min_face_size, min_sharpness, num_jitters, jitter_convergence, keep_chips = task
+    if face_recognition is None:
+        _init_worker()
+
+    try:
+        image, scale = face_recognition.load_image_file_bounded(image_path, MAX_DECODE_PIXELS)
+        if max(image.shape[:2]) > max_size:
+            # Badge photos are usually far larger than needed, decode once and detect on a smaller copy
+            import PIL.Image
+            pil_img = PIL.Image.fromarray(image)
+            pil_img.thumbnail((max_size, max_size), PIL.Image.LANCZOS)
+            scale *= pil_img.size[0] / image.shape[1]
+            image = np.array(pil_img)
+
+        pipeline = face_recognition.FacePipeline(image)
+        face_locations = pipeline.face_locations
+        if len(face_locations) == 0:
+            return person_name, image_path, None, "no face found", None
+        if len(face_locations) > 1:
+            return person_name, image_path, None, f"{len(face_locations)} faces found", None
+
+        top, right, bottom, left = face_locations[0]
+        face_size = min(bottom - top, right - left) / scale
+        if face_size < min_face_size:
+            return person_name, image_path, None, f"face too small ({face_size:.0f}px)", None
+
+        sharpness = _sharpness(image[top:bottom, left:right].mean(axis=2))
+        if sharpness < min_sharpness:
+            return person_name, image_path, None, f"image too blurry (sharpness {sharpness:.1f})", None
+
+        face_chip = pipeline.face_chips()[0] if keep_chips else None
+        if num_jitters > 1:
+            # Sample jitters in rounds of 5 so stable faces can stop early
+            encodings, _ = face_recognition.jittered_face_encodings(pipeline.face_chips(), num_jitters, chunk_size=5,
+                                                                    convergence=jitter_convergence)
+            return person_name, image_path, encodings[0], None, face_chip
+        return person_name, image_path, pipeline.face_encodings()[0], None, face_chip
+    except Exception as e:
+        return person_name, image_path, None, f"{type(e).__name__}: {e}", None
+
+
+def enrol_directory(root, faces_dir=FACES_DIR, processes=None, max_size=800, min_face_size=60,
+                    min_sharpness=20.0, num_jitters=1, show_progress=True, jitter_convergence=None, keep_chips=False):
+    """
+    Builds gallery entries for every <root>/<person>/*.jpg photo, encoding across a process pool.
+
+    Encodings are written by this (parent) process as results arrive, so workers never touch the gallery.
+    Per-person thresholds are recalibrated for everyone enrolled once all photos are done.
+    With keep_chips, each face chip is also added to the gallery's chip archive (see face_logger_chips.py).
+    Returns (number_enrolled, [(image_path, error), ...]).
+    """
+    tasks = [
+        (person_name, image_path, max_size, min_face_size, min_sharpness, num_jitters, jitter_convergence, keep_chips)
+        for person_name, image_path in find_enrolment_images(root)
+    ]
+    if not tasks:
+        return 0, []
+
+    if processes == 1:
+        results = map(encode_enrolment_image, tasks)
+        pool = None
+    else:
+        # macOS will crash due to a bug in libdispatch if you don't use 'forkserver'
+        context = multiprocessing
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+        pool = context.Pool(processes=processes, initializer=_init_worker)
+        chunksize = max(1, min(16, len(tasks) // ((processes or os.cpu_count() or 1) * 4)))
+        results = pool.imap_unordered(encode_enrolment_image, tasks, chunksize=chunksize)
+
+    enrolled = 0
+    errors = []
+    enrolled_names = set()
+    chip_archive = open_chip_archive(faces_dir) if keep_chips else None
+    start_time = time.time()
+    try:
+        if show_progress:
+            bar = click.progressbar(results, length=len(tasks), label="Enrolling", show_pos=True)
+        else:
+            bar = contextlib.nullcontext(results)
+        with bar as results:
+            for person_name, image_path, encoding, error, face_chip in results:
+                if encoding is None:
+                    errors.append((image_path, error))
+                    continue
+                encoding_path = save_encoding(person_name, encoding, faces_dir)
+                if chip_archive is not None:
+                    chip_archive.append(chip_key(encoding_path, faces_dir), face_chip)
+                enrolled_names.add(person_name)
+                enrolled += 1
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if enrolled_names:
+        calibrate_gallery(faces_dir, changed_names=sorted(enrolled_names))
+
+    elapsed = time.time() - start_time
+    if show_progress:
+        rate = len(tasks) / elapsed * 60 if elapsed > 0 else 0.0
+        click.echo(f"[INFO] Processed {len(tasks)} photos in {elapsed:.1f}s ({rate:.0f} photos/min).")
+    return enrolled, errors
+
+
+@click.command()
+@click.argument('photo_root', type=click.Path(exists=True, file_okay=False))
+@click.option('--faces-dir', default=FACES_DIR, help='Gallery directory to write encodings into.')
+@click.option('--cpus', default=-1, help='number of CPU cores to use in parallel. -1 means "use all in system"')
+@click.option('--max-size', default=800, help='Photos larger than this (in pixels) are shrunk before detection.')
+@click.option('--min-face-size', default=60, help='Reject photos whose face is smaller than this many pixels.')
+@click.option('--min-sharpness', default=20.0, help='Reject photos whose face crop is blurrier than this.')
+@click.option('--jitters', default=1, help='How many times to re-sample each face when encoding.')
+@click.option('--jitter-convergence', default=None, type=float, help='Stop re-sampling a face early once 5 more samples move its encoding less than this (e.g. 0.005).')
+@click.option('--keep-chips', is_flag=True, help='Also archive each aligned face chip, so the gallery can later be re-encoded without the photos.')
+def main(photo_root, faces_dir, cpus, max_size, min_face_size, min_sharpness, jitters, jitter_convergence, keep_chips):
+    """Bulk-enrol people from a PHOTO_ROOT/<person>/*.jpg folder tree."""
+    enrolled, errors = enrol_directory(photo_root, faces_dir, None if cpus == -1 else cpus, max_size,
+                                       min_face_size, min_sharpness, jitters, jitter_convergence=jitter_convergence,
+                                       keep_chips=keep_chips)
+    for image_path, error in errors:
+        click.echo(f"[WARNING] Skipped {image_path}: {error}")
+    click.echo(f"[INFO] Enrolled {enrolled} photos, skipped {len(errors)}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import os
+import json
+import queue
+import socket
+import threading
+from datetime import datetime
+import click
+from face_logger_logd import parse_address
+
+# Set FACE_LOGGER_EVENTS to an address (e.g. 127.0.0.1:8766 or unix:/tmp/face_logger_events.sock) to publish every
+# recognition from the loggers to subscribers on that socket.
+DEFAULT_EVENTS = os.environ.get("FACE_LOGGER_EVENTS")
+
+
+class _Subscriber:
+    """One connected consumer. Events wait in a bounded queue and are sent from this subscriber's own thread."""
+
+    def __init__(self, connection, queue_size, on_close):
+        self.connection = connection
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.closed = False
+        self._on_close = on_close
+        threading.Thread(target=self._send_events, daemon=True).start()
+
+    def offer(self, line):
+        """Queues one event line. Returns False if the subscriber has fallen too far behind to take it."""
+        try:
+            self.queue.put_nowait(line)
+            return True
+        except queue.Full:
+            return False
+
+    def _send_events(self):
+        try:
+            while not self.closed:
+                lines = [self.queue.get()]
+                while True:
+                    try:
+                        lines.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in lines or self.closed:
+                    break
+                self.connection.sendall(b"".join(lines))
+        except OSError:
+            pass
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection.close()
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self._on_close(self)
+
+
+class EventPublisher:
+    """
+    Publishes recognition events as newline-delimited JSON to every client connected to a local socket.
+
+    publish() never waits on a subscriber: each one has a bounded queue of queue_size events, and a subscriber that
+    falls further behind than that is disconnected, so a slow consumer can't stall the logging pipeline.
+    """
+
+    def __init__(self, address, queue_size=256, camera=None):
+        self.address = address
+        self.queue_size = queue_size
+        self.camera = camera
+        self.published = 0
+        self.dropped_subscribers = 0
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+        family, bind_address = parse_address(address)
+        if family == socket.AF_UNIX and os.path.exists(bind_address):
+            os.unlink(bind_address)
+        self._listener = socket.socket(family, socket.SOCK_STREAM)
+        if family != socket.AF_UNIX:
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(bind_address)
+        self._listener.listen()
+        threading.Thread(target=self._accept_subscribers, daemon=True).start()
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _accept_subscribers(self):
+        while True:
+            try:
+                connection, _ = self._listener.accept()
+            except OSError:
+                break # Listener closed
+            subscriber = _Subscriber(connection, self.queue_size, self._remove)
+            with self._lock:
+                self._subscribers.append(subscriber)
+
+    def _remove(self, subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def publish(self, name, distance=None, box=None, when=None, camera=None):
+        """
+        Sends one recognition to every subscriber.
+
+        :param name: The identity, or "Unknown"
+        :param distance: Distance to the best matching known encoding
+        :param box: The face location as a (top, right, bottom, left) tuple
+        :param camera: The camera the face was seen on, if not the publisher's camera (camera 0 is a real camera)
+        """
+        event = {"timestamp": (when or datetime.now()).isoformat(timespec="milliseconds"),
+                 "camera": self.camera if camera is None else camera, "name": name,
+                 "distance": None if distance is None else round(float(distance), 4),
+                 "box": None if box is None else dict(zip(("top", "right", "bottom", "left"), (int(v) for v in box)))}
+        self._send(event)
+
+    def publish_status(self, kind, state, when=None, camera=None):
+        """
+        Sends a status event, e.g. the budget controller's current settings. Status events carry a "type" and
+        no "name", which tells them apart from recognitions.
+        """
+        event = {"timestamp": (when or datetime.now()).isoformat(timespec="milliseconds"),
+                 "camera": self.camera if camera is None else camera, "type": kind}
+        event.update(state)
+        self._send(event)
+
+    def _send(self, event):
+        line = (json.dumps(event) + "\n").encode("utf-8")
+        self.published += 1
+
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            if not subscriber.offer(line):
+                print(f"[WARNING] Dropping event subscriber that fell {self.queue_size} events behind.")
+                self.dropped_subscribers += 1
+                subscriber.close()
+
+    def close(self):
+        self._listener.close()
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.close()
+
+
+def open_default_publisher(camera=None):
+    """Returns an EventPublisher on FACE_LOGGER_EVENTS, or None when it isn't set."""
+    if DEFAULT_EVENTS:
+        return EventPublisher(DEFAULT_EVENTS, camera=camera)
+    return None
+
+
+def subscribe(address):
+    """Connects to an EventPublisher and yields each event as a dict until the connection closes."""
+    family, connect_address = parse_address(address)
+    with socket.socket(family, socket.SOCK_STREAM) as connection:
+        connection.connect(connect_address)
+        with connection.makefile("rb") as stream:
+            for line in stream:
+                yield json.loads(line)
+
+
+@click.command()
+@click.option('--address', default=DEFAULT_EVENTS or "127.0.0.1:8766", help='host:port or unix:/path of the publishing logger.')
+@click.option('--name', default=None, help='Only show events for this person.')
+def main(address, name):
+    """Prints the recognition events published by a running logger, one JSON object per line."""
+    try:
+        for event in subscribe(address):
+            if name is None or event.get("name") == name:
+                print(json.dumps(event), flush=True)
+    except ConnectionRefusedError:
+        print(f"[ERROR] Nothing is publishing events on {address}.")
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
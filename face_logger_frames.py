@@ -0,0 +1,88 @@
+import cv2
+import numpy as np
+import PIL.Image
+import face_recognition
+
+# The pixel format each detection model runs on. HOG only looks at intensity gradients, so a single grey channel
+# is enough; the CNN models need colour.
+DETECTION_FORMATS = {"hog": "gray", "haar+hog": "gray", "cnn": "rgb", "haar+cnn": "rgb"}
+
+
+class Frame:
+    """
+    A camera frame kept in the format it arrived in, with every other format the face pipeline asks for derived
+    from it at most once:
+
+    * detection runs on a single grey channel (or RGB for the CNN models), resized by the detection scale,
+    * landmarks and face chips are taken from the original BGR buffer, and only the 150x150 chips are converted
+      to RGB for the encoder,
+    * boxes and names are drawn on the original BGR buffer for display, and to_image() reorders it while PIL
+      copies it for Tk.
+
+    So a BGR camera frame costs one full-frame conversion (to grey) instead of a BGR-to-RGB copy for the
+    pipeline plus another for display.
+    """
+
+    def __init__(self, image):
+        if image.dtype != np.uint8:
+            image = image.astype(np.uint8)
+        if image.ndim == 2:
+            # A mono camera: the frame already is the grey channel
+            self._gray = image
+            self._bgr = None
+        elif image.shape[2] == 4:
+            self._gray = None
+            self._bgr = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+        else:
+            self._gray = None
+            self._bgr = image
+        self._rgb = None
+
+    @classmethod
+    def from_capture(cls, frame):
+        """Wraps a frame read from OpenCV, or returns None if it is empty or has an unexpected shape."""
+        if frame is None:
+            return None
+        if frame.ndim not in (2, 3) or (frame.ndim == 3 and frame.shape[2] not in (3, 4)):
+            print(f"[DEBUG] Unexpected frame shape or channels: {frame.shape}")
+            return None
+        return cls(frame)
+
+    @property
+    def bgr(self):
+        """The frame to draw on and display (converted from grey once for a mono camera)."""
+        if self._bgr is None:
+            self._bgr = cv2.cvtColor(self._gray, cv2.COLOR_GRAY2BGR)
+        return self._bgr
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self._bgr, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def rgb(self):
+        """Only needed by the CNN detectors."""
+        if self._rgb is None:
+            self._rgb = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB)
+        return self._rgb
+
+    def detection_image(self, model="hog", scale=1.0):
+        """The frame in the format model detects on, resized by scale."""
+        image = self.gray if DETECTION_FORMATS.get(model, "rgb") == "gray" else self.rgb
+        if scale == 1.0:
+            return image
+        return cv2.resize(image, (0, 0), fx=scale, fy=scale)
+
+    def pipeline(self, known_face_locations=None, number_of_times_to_upsample=1, model="hog"):
+        """A FacePipeline over the original buffer that detects on detection_image(model)."""
+        detection_image = None if known_face_locations is not None else self.detection_image(model)
+        return face_recognition.FacePipeline(self.bgr, known_face_locations, number_of_times_to_upsample, model,
+                                             detection_image=detection_image, channel_order="BGR")
+
+    def to_image(self):
+        """The frame as an RGB PIL image. The channels are swapped during the copy PIL makes anyway."""
+        bgr = np.ascontiguousarray(self.bgr)
+        height, width = bgr.shape[:2]
+        return PIL.Image.frombuffer("RGB", (width, height), bgr, "raw", "BGR", 0, 1)
@@ -0,0 +1,184 @@
+import os
+import re
+import json
+import uuid
+import numpy as np
+from face_recognition.matcher import calibrate_thresholds
+from face_recognition.quantize import QuantizedGallery
+
+FACES_DIR = "faces"
+THRESHOLDS_FILE = "thresholds.json"
+
+_FACE_FILE_RE = re.compile(r"face_(\d+)\.npy$")
+
+# Set FACE_LOGGER_VAULT to an encrypted gallery file (see face_logger_vault.py) to keep the gallery in it instead
+# of in plain .npy files. It is unlocked once per process.
+VAULT_PATH = os.environ.get("FACE_LOGGER_VAULT")
+
+# Set FACE_LOGGER_INT8_GALLERY=1 for the loggers and the service to match against an int8 copy of the gallery, a
+# quarter of the memory of float32 (see face_recognition.quantize). Ignored with a vault, whose encodings must stay
+# in locked memory.
+QUANTIZE_GALLERY = os.environ.get("FACE_LOGGER_INT8_GALLERY") == "1"
+
+
+def _vault(plain=False):
+    if plain or not VAULT_PATH:
+        return None
+    from face_logger_vault import unlocked_vault
+    return unlocked_vault(VAULT_PATH)
+
+
+def load_gallery(faces_dir=FACES_DIR, plain=False, quantize=False, tolerance=0.6):
+    """
+    Loads every faces/<name>/*.npy encoding. Returns (encodings, names) as parallel lists.
+
+    With FACE_LOGGER_VAULT set (and plain=False), the encodings come from the unlocked vault instead, as one
+    (N, 128) array in locked memory.
+
+    With quantize=True, the encodings are returned as a QuantizedGallery (int8), which FaceMatcher accepts in
+    place of the list, calibrated so that matching at tolerance (and at per-person thresholds near it) makes the
+    same decisions as the float encodings. quantize is ignored for a vault.
+    """
+    vault = _vault(plain)
+    if vault is not None:
+        vault.refresh() # Pick up registrations by other processes
+        return vault.encodings, list(vault.names)
+
+    known_face_encodings = []
+    known_face_names = []
+    if not os.path.exists(faces_dir):
+        os.makedirs(faces_dir)
+
+    for person_name in os.listdir(faces_dir):
+        person_dir = os.path.join(faces_dir, person_name)
+        if os.path.isdir(person_dir) and not person_name.startswith("."):
+            for filename in os.listdir(person_dir):
+                if filename.endswith(".npy"):
+                    try:
+                        # Older galleries hold float64 encodings; everything is matched in float32
+                        encoding = np.load(os.path.join(person_dir, filename)).astype(np.float32, copy=False)
+                        known_face_encodings.append(encoding)
+                        known_face_names.append(person_name)
+                    except Exception as e:
+                        print(f"Error loading encoding for {person_name}: {e}")
+    if quantize:
+        encodings = np.asarray(known_face_encodings, np.float32).reshape(-1, 128)
+        gallery = QuantizedGallery.from_encodings(encodings)
+        gallery.calibrate(encodings, tolerance)
+        return gallery, known_face_names
+    return known_face_encodings, known_face_names
+
+
+def next_face_index(person_dir):
+    """Returns the next free N for face_N.npy in person_dir, so new captures never overwrite old ones."""
+    highest = 0
+    if os.path.isdir(person_dir):
+        for filename in os.listdir(person_dir):
+            match = _FACE_FILE_RE.match(filename)
+            if match:
+                highest = max(highest, int(match.group(1)))
+    return highest + 1
+
+
+def _write_temp_file(directory, write):
+    """Writes a uniquely named hidden temp file in directory with write(f) and returns its path."""
+    temp_path = os.path.join(directory, f".tmp-{os.getpid()}-{uuid.uuid4().hex}")
+    with open(temp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    return temp_path
+
+
+def _publish_new(temp_path, file_path):
+    """
+    Moves temp_path to file_path, failing with FileExistsError instead of overwriting an existing file.
+    Readers see either no file or the complete file, never a partial one.
+    """
+    try:
+        os.link(temp_path, file_path)
+    except FileExistsError:
+        raise
+    except OSError:
+        # No hard links on this file system (e.g. FAT on a USB stick). Windows' rename never overwrites.
+        if os.name != "nt":
+            raise
+        os.rename(temp_path, file_path)
+        return
+    os.unlink(temp_path)
+
+
+def save_encoding(person_name, face_encoding, faces_dir=FACES_DIR, plain=False):
+    """
+    Stores one encoding as faces/<person_name>/face_N.npy (float32) and returns the path written.
+
+    The file is written under a temporary name and then published as the next free face_N.npy without ever
+    replacing an existing file, so several processes can register the same person at once.
+
+    With FACE_LOGGER_VAULT set, the encoding is appended to the vault and nothing is written under faces_dir;
+    the path returned is the one it would have had (e.g. as its key in the chip archive).
+    """
+    vault = _vault(plain)
+    if vault is not None:
+        count = vault.add(person_name, face_encoding)
+        return os.path.join(faces_dir, person_name, f"face_{count}.npy")
+
+    person_dir = os.path.join(faces_dir, person_name)
+    os.makedirs(person_dir, exist_ok=True)
+    encoding = np.asarray(face_encoding, dtype=np.float32)
+    temp_path = _write_temp_file(person_dir, lambda f: np.save(f, encoding))
+    try:
+        while True:
+            file_path = os.path.join(person_dir, f"face_{next_face_index(person_dir)}.npy")
+            try:
+                _publish_new(temp_path, file_path)
+                return file_path
+            except FileExistsError:
+                continue # Another process took this number first
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+
+def load_thresholds(faces_dir=FACES_DIR, plain=False):
+    """Returns the per-person calibration saved by calibrate_gallery(), or {} if there is none yet."""
+    vault = _vault(plain)
+    if vault is not None:
+        return dict(vault.thresholds)
+
+    path = os.path.join(faces_dir, THRESHOLDS_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)["people"]
+    except (ValueError, KeyError) as e:
+        print(f"Error loading thresholds from {path}: {e}")
+        return {}
+
+
+def calibrate_gallery(faces_dir=FACES_DIR, changed_names=None, tolerance=0.6, gallery=None):
+    """
+    Recomputes per-person match thresholds and stores them in faces/thresholds.json.
+
+    Pass the names that were just registered as changed_names to only recalibrate what they affect, and the
+    (encodings, names) just returned by load_gallery() as gallery so it isn't read again. A quantized gallery is
+    dequantized first, so thresholds are always calibrated on float distances; the quantized gallery's own
+    calibration maps them to int8 distances when matching.
+    """
+    if gallery is None:
+        gallery = load_gallery(faces_dir)
+    known_face_encodings, known_face_names = gallery
+    if isinstance(known_face_encodings, QuantizedGallery):
+        known_face_encodings = known_face_encodings.dequantize()
+    previous = load_thresholds(faces_dir) if changed_names is not None else None
+    calibration = calibrate_thresholds(known_face_encodings, known_face_names, tolerance,
+                                       previous=previous or None, changed_names=changed_names)
+    vault = _vault()
+    if vault is not None:
+        vault.set_thresholds(calibration, tolerance)
+        return calibration
+    data = json.dumps({"tolerance": tolerance, "people": calibration}, indent=1, sort_keys=True).encode("utf-8")
+    temp_path = _write_temp_file(faces_dir, lambda f: f.write(data))
+    os.replace(temp_path, os.path.join(faces_dir, THRESHOLDS_FILE))
+    return calibration
@@ -0,0 +1,300 @@
+import os
+import csv
+import io
+import json
+import queue
+import socket
+import threading
+import socketserver
+import contextlib
+from datetime import datetime
+import click
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+LOG_HEADER = ["Timestamp", "Name", "Status"]
+
+# Set FACE_LOGGER_LOGD to the daemon address (e.g. 127.0.0.1:8765 or unix:/tmp/face_logger.sock) to send log
+# rows to a single face_logger_logd.py process instead of appending to logs.csv from every logger.
+DEFAULT_LOGD = os.environ.get("FACE_LOGGER_LOGD")
+
+if os.name == "nt":
+    import msvcrt
+
+    @contextlib.contextmanager
+    def file_lock(f):
+        """Advisory exclusive lock on an open file, held for the duration of the with block."""
+        # msvcrt locks a byte range from the current position; byte 0 serves as the lock for the whole file
+        position = f.tell()
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            f.seek(position)
+            yield f
+        finally:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    @contextlib.contextmanager
+    def file_lock(f):
+        """Advisory exclusive lock on an open file, held for the duration of the with block."""
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield f
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _format_rows(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def init_log_file(log_file):
+    """Writes the header row to log_file unless it already has rows. Safe to call from several processes."""
+    # Checked under the lock append_log_rows() takes, so another process' row can't land above the header
+    with open(log_file, 'a', newline='') as f:
+        with file_lock(f):
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                f.write(_format_rows([LOG_HEADER]))
+
+
+def append_log_rows(log_file, rows):
+    """
+    Appends Timestamp,Name,Status rows to log_file under an advisory lock, in a single write, so rows from
+    processes logging at the same time never interleave.
+    """
+    data = _format_rows(rows)
+    with open(log_file, 'a', newline='') as f:
+        with file_lock(f):
+            f.seek(0, os.SEEK_END)
+            f.write(data)
+            f.flush()
+
+
+class LogWriter:
+    """
+    Writes log rows straight to the CSV file, locking it for every append, and to event_store (an EventStore)
+    when one is given.
+    """
+
+    def __init__(self, log_file="logs.csv", event_store=None):
+        self.log_file = log_file
+        self.event_store = event_store
+        init_log_file(log_file)
+
+    def write(self, name, status, when=None, camera=None):
+        when = when or datetime.now()
+        append_log_rows(self.log_file, [[when.strftime(TIMESTAMP_FORMAT), name, status]])
+        if self.event_store:
+            self.event_store.add_event(name, status, when, camera)
+
+    def close(self):
+        pass
+
+
+def parse_address(address):
+    """Returns (family, address) for "host:port" or "unix:/path/to/socket"."""
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+class LogClient:
+    """
+    Sends log rows to a face_logger_logd.py daemon as newline-delimited JSON. The daemon writes the log file and
+    its event store, and acknowledges each row once it is in the log file.
+
+    A row the daemon doesn't acknowledge is sent again over a new connection, then appended to the local log file
+    under a lock (and to event_store) instead, so nothing is lost. If the daemon died after writing a row but
+    before acknowledging it, that row is logged twice.
+    """
+
+    def __init__(self, address, log_file="logs.csv", camera=None, event_store=None, timeout=5.0):
+        self.address = address
+        self.camera = camera
+        self.timeout = timeout
+        self.fallback = LogWriter(log_file, event_store)
+        self._socket = None
+        self._replies = None
+
+    def _connect(self):
+        family, address = parse_address(self.address)
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._socket.settimeout(self.timeout)
+        self._socket.connect(address)
+        self._replies = self._socket.makefile("rb")
+
+    def write(self, name, status, when=None, camera=None):
+        when = when or datetime.now()
+        event = {"timestamp": when.strftime(TIMESTAMP_FORMAT), "name": name, "status": status,
+                 "camera": self.camera if camera is None else camera}
+        message = (json.dumps(event) + "\n").encode("utf-8")
+        for attempt in range(2):
+            try:
+                if self._socket is None:
+                    self._connect()
+                self._socket.sendall(message)
+                # A write to a connection the daemon has dropped usually succeeds; only the reply tells
+                reply = self._replies.readline()
+                if reply == b"ok\n":
+                    return
+                raise ConnectionError(f"log daemon replied {reply!r}")
+            except OSError:
+                self.close()
+        print("[WARNING] Log daemon unreachable, writing to the log file directly.")
+        self.fallback.write(name, status, when, camera)
+
+    def close(self):
+        if self._socket is not None:
+            try:
+                if self._replies is not None:
+                    self._replies.close()
+                self._socket.close()
+            finally:
+                self._socket = None
+                self._replies = None
+
+
+def open_default_log_writer(log_file="logs.csv", camera=None, event_store=None):
+    """
+    Returns a LogClient when FACE_LOGGER_LOGD is set, otherwise a LogWriter for log_file.
+
+    Each event is written to event_store by exactly one process: by this LogWriter, or by the daemon (started
+    with --db) for a LogClient, which only uses event_store when the daemon can't be reached.
+    """
+    if DEFAULT_LOGD:
+        return LogClient(DEFAULT_LOGD, log_file, camera, event_store)
+    return LogWriter(log_file, event_store)
+
+
+class _PendingEvent:
+    """An event waiting for the writer thread, which sets done once it was written (ok) or failed."""
+
+    __slots__ = ("row", "when", "camera", "ok", "done")
+
+    def __init__(self, row, when, camera):
+        self.row = row
+        self.when = when
+        self.camera = camera
+        self.ok = False
+        self.done = threading.Event()
+
+
+class _EventHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                event = json.loads(line)
+                when = datetime.strptime(event["timestamp"], TIMESTAMP_FORMAT)
+                pending = _PendingEvent([event["timestamp"], str(event["name"]), str(event["status"])], when,
+                                        event.get("camera"))
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"[WARNING] Ignoring malformed event from {self.client_address}: {e}")
+                self.wfile.write(b"error\n")
+                continue
+            self.server.events.put(pending)
+            # Acknowledge only once the row is in the log file
+            pending.done.wait()
+            self.wfile.write(b"ok\n" if pending.ok else b"error\n")
+
+
+class LogDaemon:
+    """
+    Single writer for logs.csv (and optionally the SQLite event store). Any number of logger processes send
+    events over a local socket; handler threads only parse them onto a queue, and one writer thread appends
+    whatever has queued up in a single locked write, then lets the handlers acknowledge those events.
+    """
+
+    def __init__(self, address, log_file="logs.csv", db_path=None):
+        family, bind_address = parse_address(address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(bind_address):
+                os.unlink(bind_address)
+            server_class = socketserver.ThreadingUnixStreamServer
+        else:
+            server_class = socketserver.ThreadingTCPServer
+        server_class.daemon_threads = True
+        server_class.allow_reuse_address = True
+        self.log_file = log_file
+        self.db_path = db_path
+        self.events_written = 0
+        # Opened before listening, so a bad --log-file or --db stops the daemon instead of its writer thread
+        init_log_file(log_file)
+        self._store = None
+        if db_path:
+            from face_logger_store import EventStore
+            self._store = EventStore(db_path)
+        self.server = server_class(bind_address, _EventHandler)
+        self.server.events = queue.Queue()
+        self._writer = threading.Thread(target=self._write_events, daemon=True)
+
+    def _write_events(self):
+        store = self._store
+        while True:
+            batch = [self.server.events.get()]
+            while True:
+                try:
+                    batch.append(self.server.events.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                stopping = True
+            else:
+                stopping = False
+            if batch:
+                try:
+                    append_log_rows(self.log_file, [event.row for event in batch])
+                    if store:
+                        for event in batch:
+                            store.add_event(event.row[1], event.row[2], event.when, event.camera)
+                        store.flush()
+                    ok = True
+                    self.events_written += len(batch)
+                except Exception as e:
+                    # Fail this batch, not the thread: the clients fall back to writing their rows themselves
+                    print(f"[ERROR] Could not write {len(batch)} events: {e}")
+                    ok = False
+                for event in batch:
+                    event.ok = ok
+                    event.done.set()
+            if stopping:
+                break
+        if store:
+            store.close()
+
+    def serve_forever(self):
+        self._writer.start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.server.events.put(None)
+            self._writer.join()
+
+    def shutdown(self):
+        self.server.shutdown()
+
+
+@click.command()
+@click.option('--address', default=DEFAULT_LOGD or "127.0.0.1:8765", help='host:port or unix:/path to listen on.')
+@click.option('--log-file', default="logs.csv", help='CSV log file to write.')
+@click.option('--db', default=None, help='Also record events in this SQLite event store.')
+def main(address, log_file, db):
+    """Single-writer log daemon that face logger processes send their events to."""
+    daemon = LogDaemon(address, log_file, db)
+    print(f"[INFO] Log daemon listening on {address}, writing {log_file}.")
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"[INFO] Log daemon stopped after {daemon.events_written} events.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import os
+import re
+import csv
+import json
+import html
+import locale
+import click
+
+SUMMARY_HEADER = ["Day", "Name", "FirstSeen", "LastSeen", "Visits", "PresenceMinutes"]
+
+_TIMESTAMP_RE = re.compile(r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d")
+
+
+def _seconds_of_day(timestamp):
+    # Much cheaper than datetime.strptime, which dominates the run time over millions of rows
+    return int(timestamp[11:13]) * 3600 + int(timestamp[14:16]) * 60 + int(timestamp[17:19])
+
+
+def _format_seconds(seconds):
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class PersonDay:
+    """Running totals for one person on one day. Sightings closer together than the gap form one visit."""
+
+    __slots__ = ("first_seen", "last_seen", "visits", "presence", "span_start")
+
+    def __init__(self, seconds):
+        self.first_seen = seconds
+        self.last_seen = seconds
+        self.visits = 1
+        self.presence = 0
+        self.span_start = seconds
+
+    def add(self, seconds, gap):
+        if seconds < self.last_seen:
+            # Slightly out-of-order rows from concurrent writers: widen the day, but keep the current span
+            self.first_seen = min(self.first_seen, seconds)
+            return
+        if seconds - self.last_seen > gap:
+            self.presence += self.last_seen - self.span_start
+            self.visits += 1
+            self.span_start = seconds
+        self.last_seen = seconds
+
+    def summary_row(self, day, name):
+        presence = self.presence + self.last_seen - self.span_start
+        return [day, name, _format_seconds(self.first_seen), _format_seconds(self.last_seen), self.visits,
+                round(presence / 60.0, 1)]
+
+    def to_json(self):
+        return [self.first_seen, self.last_seen, self.visits, self.presence, self.span_start]
+
+    @classmethod
+    def from_json(cls, values):
+        state = cls(values[0])
+        state.first_seen, state.last_seen, state.visits, state.presence, state.span_start = values
+        return state
+
+
+class AttendanceAggregator:
+    """
+    Streaming per-person daily aggregation over Timestamp,Name,Status rows.
+
+    logs.csv is written in time order, so only the days that are still "open" are kept in memory; as soon as
+    a row for a later day arrives, earlier days are final and can be written out. Memory is bounded by the
+    number of people seen in a day, not by the length of the log.
+    """
+
+    def __init__(self, gap_seconds=1800):
+        self.gap_seconds = gap_seconds
+        self.open_days = {}
+        self.closed_through = ""
+        self.late_rows = 0
+        self.malformed_rows = 0
+        self.first_malformed = None
+
+    def add(self, timestamp, name):
+        if not _TIMESTAMP_RE.match(timestamp):
+            # e.g. a row torn by a crash mid-write; it must not abort the whole report
+            self.malformed_rows += 1
+            if self.first_malformed is None:
+                self.first_malformed = timestamp
+            return
+        day = timestamp[:10]
+        if day <= self.closed_through:
+            self.late_rows += 1
+            return
+        seconds = _seconds_of_day(timestamp)
+        people = self.open_days.get(day)
+        if people is None:
+            people = self.open_days[day] = {}
+        state = people.get(name)
+        if state is None:
+            people[name] = PersonDay(seconds)
+        else:
+            state.add(seconds, self.gap_seconds)
+
+    def pop_closed_days(self):
+        """Removes and returns summary rows for every day before the latest day seen."""
+        if len(self.open_days) < 2:
+            return []
+        latest = max(self.open_days)
+        rows = []
+        for day in sorted(d for d in self.open_days if d < latest):
+            rows.extend(self._day_rows(day, self.open_days.pop(day)))
+            self.closed_through = day
+        return rows
+
+    def open_rows(self):
+        rows = []
+        for day in sorted(self.open_days):
+            rows.extend(self._day_rows(day, self.open_days[day]))
+        return rows
+
+    @staticmethod
+    def _day_rows(day, people):
+        return [people[name].summary_row(day, name) for name in sorted(people)]
+
+    def to_json(self):
+        return {
+            "gap_seconds": self.gap_seconds,
+            "closed_through": self.closed_through,
+            "open_days": {day: {name: state.to_json() for name, state in people.items()}
+                          for day, people in self.open_days.items()},
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        aggregator = cls(data["gap_seconds"])
+        aggregator.closed_through = data["closed_through"]
+        aggregator.open_days = {day: {name: PersonDay.from_json(values) for name, values in people.items()}
+                                for day, people in data["open_days"].items()}
+        return aggregator
+
+
+def iter_log_rows(log_path, offset=0, chunk_size=1 << 20):
+    """
+    Yields (rows, end_offset) for successive chunks of a logs.csv file starting at byte offset.
+
+    Only complete lines are returned, so a row the logger is still appending is picked up by the next run.
+    """
+    # The loggers write logs.csv with the platform's default encoding
+    encoding = locale.getpreferredencoding(False)
+    with open(log_path, 'rb') as f:
+        f.seek(offset)
+        if offset == 0:
+            header = f.readline()
+            offset = len(header)
+        pending = b""
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            data = pending + chunk
+            end = data.rfind(b"\n") + 1
+            pending = data[end:]
+            if end == 0:
+                continue
+            offset += end
+            yield list(csv.reader(data[:end].decode(encoding, errors="replace").splitlines())), offset
+
+
+def _write_html(summary_csv, html_path):
+    with open(summary_csv, newline='', encoding="utf-8") as src, open(html_path, 'w', encoding="utf-8") as out:
+        out.write("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>Attendance report</title>\n"
+                  "<style>body{font-family:Arial,sans-serif}table{border-collapse:collapse}"
+                  "td,th{border:1px solid #ccc;padding:4px 8px}th{background:#2c3e50;color:white}</style>\n"
+                  "</head><body><h1>Attendance report</h1>\n<table>\n")
+        for index, row in enumerate(csv.reader(src)):
+            cell = "th" if index == 0 else "td"
+            out.write("<tr>" + "".join(f"<{cell}>{html.escape(value)}</{cell}>" for value in row) + "</tr>\n")
+        out.write("</table></body></html>\n")
+
+
+def build_report(log_path, summary_csv, cursor_path=None, html_path=None, gap_minutes=30, chunk_size=1 << 20):
+    """
+    Aggregates log_path into summary_csv with one row per person per day.
+
+    With cursor_path, the read position and the state of still-open days are saved, and the next run only
+    reads rows appended since. Rows of the last (still open) day are written at the end of summary_csv and
+    replaced on the next run. Returns the number of log rows read.
+    """
+    cursor = {}
+    if cursor_path and os.path.exists(cursor_path) and os.path.exists(summary_csv):
+        with open(cursor_path) as f:
+            cursor = json.load(f)
+        if cursor.get("log_offset", 0) > os.path.getsize(log_path):
+            # The log was rotated or truncated since the last run
+            cursor = {}
+        elif cursor["aggregator"]["gap_seconds"] != gap_minutes * 60:
+            # Visits already reported were split with the old gap; they must all be recounted with the new one
+            print(f"[INFO] The visit gap changed from {cursor['aggregator']['gap_seconds'] // 60} to {gap_minutes} "
+                  f"minutes since the last run, rebuilding the report from the start.")
+            cursor = {}
+
+    if cursor:
+        aggregator = AttendanceAggregator.from_json(cursor["aggregator"])
+        offset = cursor["log_offset"]
+        summary = open(summary_csv, 'r+', newline='', encoding="utf-8")
+        summary.seek(cursor["summary_offset"])
+        summary.truncate()
+    else:
+        aggregator = AttendanceAggregator(gap_minutes * 60)
+        offset = 0
+        summary = open(summary_csv, 'w', newline='', encoding="utf-8")
+        csv.writer(summary).writerow(SUMMARY_HEADER)
+
+    rows_read = 0
+    with summary:
+        writer = csv.writer(summary)
+        for rows, offset in iter_log_rows(log_path, offset, chunk_size):
+            for row in rows:
+                if len(row) >= 3 and row[2] == "Recognized":
+                    aggregator.add(row[0], row[1])
+            rows_read += len(rows)
+            writer.writerows(aggregator.pop_closed_days())
+
+        summary.flush()
+        summary_offset = summary.tell()
+        writer.writerows(aggregator.open_rows())
+
+    if cursor_path:
+        with open(cursor_path, 'w') as f:
+            json.dump({
+                "log_offset": offset,
+                "summary_offset": summary_offset,
+                "aggregator": aggregator.to_json(),
+            }, f)
+
+    if aggregator.late_rows:
+        print(f"[WARNING] Ignored {aggregator.late_rows} rows for days that were already reported.")
+    if aggregator.malformed_rows:
+        print(f"[WARNING] Skipped {aggregator.malformed_rows} rows with a malformed timestamp "
+              f"(the first was {aggregator.first_malformed!r}).")
+    if html_path:
+        _write_html(summary_csv, html_path)
+    return rows_read
+
+
+@click.command()
+@click.option('--log', 'log_path', default="logs.csv", help='Log file written by the face loggers.')
+@click.option('--output', default="attendance.csv", help='Summary CSV with one row per person per day.')
+@click.option('--html', 'html_path', default=None, help='Also write the summary as an HTML table.')
+@click.option('--cursor', 'cursor_path', default=None, help='Cursor file; later runs only read new log rows.')
+@click.option('--gap', default=30, help='Minutes between sightings that start a new visit.')
+def main(log_path, output, html_path, cursor_path, gap):
+    """Summarise logs.csv into per-person daily first-seen, last-seen, visits and presence time."""
+    rows_read = build_report(log_path, output, cursor_path, html_path, gap)
+    click.echo(f"[INFO] Read {rows_read} new log rows into {output}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import click
+from face_logger_cli import FaceLoggerCLI
+from face_logger_sources import open_source, is_image_sequence
+from face_logger_logd import LogWriter
+
+
+@click.command()
+@click.argument('source')
+@click.option('--output', default="logs_reprocessed.csv", help='CSV file to write log rows to (same schema as logs.csv).')
+@click.option('--stride', default=1, help='Only process every Nth frame.')
+@click.option('--start', default=None, type=click.DateTime(formats=["%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S"]),
+              help='Wall-clock time of the first frame. Defaults to the file modification time minus its duration. '
+                   'Image sequences also need --fps.')
+@click.option('--fps', default=None, type=float, help='Frame rate of an image sequence. Without it, file modification times are used.')
+def main(source, output, stride, start, fps):
+    """Re-run recognition over a recorded video file, an image folder or a glob like "cam1/*.jpg"."""
+    if start is not None and fps is None and is_image_sequence(source):
+        raise click.UsageError("--start needs --fps for an image folder or glob; without it each file's "
+                               "modification time is used.")
+    # Always write the output file directly; reprocessed rows must not go to a running log daemon's logs.csv
+    app = FaceLoggerCLI(log_file=output, log_writer=LogWriter(output))
+    app.reprocess(open_source(source, stride=stride, start_time=start, fps=fps))
+
+
+if __name__ == "__main__":
+    main()
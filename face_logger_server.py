@@ -0,0 +1,458 @@
+import io
+import json
+import base64
+import struct
+import asyncio
+import hashlib
+import collections
+import concurrent.futures
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+import click
+import numpy as np
+import face_recognition
+from face_recognition.shard import parse_shard_address
+from face_recognition.quantize import QuantizedGallery
+from face_logger_gallery import load_gallery, load_thresholds, calibrate_gallery, save_encoding, QUANTIZE_GALLERY, \
+    VAULT_PATH
+from face_logger_events import open_default_publisher
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error",
+                503: "Service Unavailable"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class RecognitionService:
+    """
+    Loads the models and gallery once and answers identify/enrol requests.
+
+    Requests are queued and handled in micro-batches: the batcher waits batch_window seconds after the first
+    request for others to arrive, then decodes and detects each image, encodes every face of the whole batch with
+    a single encoder call and matches them all with a single lookup, on the worker thread. The queue is bounded,
+    so when the service is saturated new requests are refused with 503 instead of piling up.
+
+    Enrolments update the gallery on a thread of their own, so a recalibration or shard rebalance never stops
+    the event loop or the worker thread; batches keep matching against the previous gallery until the new one
+    is ready.
+    """
+
+    def __init__(self, tolerance=0.6, model="hog", upsample=1, max_batch=16, batch_window=0.005, queue_size=64,
+                 recent_events=1000, event_publisher=None, shards=0, shard_addresses=(), shard_authkey=None):
+        self.tolerance = tolerance
+        self.model = model
+        self.upsample = upsample
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.queue_size = queue_size
+        self.events = collections.deque(maxlen=recent_events)
+        self.event_publisher = event_publisher
+        self.batches = 0
+        self.images = 0
+        # dlib's models are used from one thread only
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # Gallery updates, one at a time
+        self._gallery_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._gallery = None
+        self._queue = None
+        self._batcher = None
+        self.load_known_faces(shards, shard_addresses, shard_authkey)
+
+    def load_known_faces(self, shards=0, shard_addresses=(), shard_authkey=None, changed_names=None):
+        sharded = bool(shards or shard_addresses)
+        # Shards hold their own float32 slices of the gallery
+        known_face_encodings, known_face_names = load_gallery(quantize=QUANTIZE_GALLERY and not sharded,
+                                                              tolerance=self.tolerance)
+        if changed_names:
+            calibrate_gallery(changed_names=changed_names, gallery=(known_face_encodings, known_face_names))
+        if sharded:
+            self.matcher = face_recognition.ShardedMatcher(known_face_encodings, known_face_names, shards=shards,
+                                                           addresses=shard_addresses, authkey=shard_authkey,
+                                                           thresholds=load_thresholds())
+            print(f"[INFO] Loaded {len(known_face_names)} known faces into shards of {self.matcher.shard_sizes}.")
+        else:
+            if not isinstance(known_face_encodings, QuantizedGallery):
+                known_face_encodings = np.asarray(known_face_encodings, dtype=np.float32).reshape(-1, 128)
+            # Kept so an enrolment can be added without reading the gallery again
+            self._gallery = (known_face_encodings, list(known_face_names))
+            self.matcher = face_recognition.FaceMatcher(known_face_encodings, known_face_names,
+                                                        thresholds=load_thresholds())
+            print(f"[INFO] Loaded {len(known_face_names)} known faces.")
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._batcher = asyncio.ensure_future(self._run_batches())
+
+    async def stop(self):
+        if self._batcher:
+            self._batcher.cancel()
+        self._executor.shutdown(wait=True)
+        self._gallery_executor.shutdown(wait=True)
+        if isinstance(self.matcher, face_recognition.ShardedMatcher):
+            self.matcher.close()
+
+    @property
+    def pending(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def _submit(self, image_data):
+        if self._queue.full():
+            raise HTTPError(503, "Too many pending requests, try again shortly.")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((image_data, future))
+        result = await future
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            if self._queue.qsize() < self.max_batch - 1:
+                await asyncio.sleep(self.batch_window)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            try:
+                results = await loop.run_in_executor(self._executor, self._process_batch, [item[0] for item in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            for (image_data, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def _process_batch(self, images):
+        """
+        Runs on the worker thread. Returns one (locations, encodings, matches) tuple or exception per image, where
+        matches holds a (name or None, distance) pair per face.
+        """
+        self.batches += 1
+        self.images += len(images)
+        pipelines = []
+        for image_data in images:
+            try:
+                image = face_recognition.load_image_file(io.BytesIO(image_data))
+                pipeline = face_recognition.FacePipeline(image, number_of_times_to_upsample=self.upsample,
+                                                         model=self.model)
+                pipeline.face_chips()
+                pipelines.append(pipeline)
+            except Exception as e:
+                pipelines.append(HTTPError(400, f"Could not read image: {e}"))
+
+        face_chips = [chip for pipeline in pipelines if not isinstance(pipeline, Exception)
+                      for chip in pipeline.face_chips()]
+        descriptors = []
+        if face_chips:
+            descriptors = face_recognition.api.face_encoder.compute_face_descriptor(face_chips, 1)
+        descriptors = np.array(descriptors, dtype=np.float32).reshape(-1, 128)
+        matches = iter(self._best_matches(descriptors))
+        descriptors = iter(descriptors)
+
+        results = []
+        for pipeline in pipelines:
+            if isinstance(pipeline, Exception):
+                results.append(pipeline)
+            else:
+                chips = pipeline.face_chips()
+                results.append((pipeline.face_locations, [next(descriptors) for _ in chips],
+                                [next(matches) for _ in chips]))
+        return results
+
+    def _best_matches(self, face_encodings):
+        """(name or None, distance) of the closest known face to each encoding, in one lookup."""
+        matcher = self.matcher # An enrolment may replace it meanwhile
+        if len(face_encodings) == 0 or len(matcher) == 0:
+            return [(None, None)] * len(face_encodings)
+        matches = []
+        for (index, name, distance), in matcher.top_k(face_encodings, 1):
+            matches.append((name if distance <= matcher.tolerance_for(name, self.tolerance) else None, distance))
+        return matches
+
+    def _match(self, face_locations, matches):
+        faces = []
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for (top, right, bottom, left), (name, distance) in zip(face_locations, matches):
+            face = {"name": name or "Unknown", "distance": None if distance is None else round(float(distance), 4),
+                    "box": {"top": top, "right": right, "bottom": bottom, "left": left}}
+            faces.append(face)
+            self.events.append(dict(face, timestamp=now))
+            if self.event_publisher:
+                self.event_publisher.publish(face["name"], distance, (top, right, bottom, left))
+        return faces
+
+    async def identify(self, image_data):
+        face_locations, face_encodings, matches = await self._submit(image_data)
+        return {"faces": self._match(face_locations, matches)}
+
+    async def enrol(self, name, image_data):
+        if not name or name.startswith(".") or any(c in name for c in "/\\:"):
+            raise HTTPError(400, "A valid name is required.")
+        face_locations, face_encodings, matches = await self._submit(image_data)
+        if len(face_encodings) != 1:
+            raise HTTPError(422, f"Expected exactly one face, found {len(face_encodings)}.")
+
+        path = await asyncio.get_running_loop().run_in_executor(self._gallery_executor, self._add_to_gallery, name,
+                                                                face_encodings[0])
+        return {"name": name, "file": path, "known_faces": len(self.matcher)}
+
+    def _add_to_gallery(self, name, face_encoding):
+        """Runs on the gallery thread. Saves an enrolled encoding and adds it to the gallery being matched."""
+        path = save_encoding(name, face_encoding)
+        if isinstance(self.matcher, face_recognition.ShardedMatcher):
+            # Only the new encoding is sent, to the smallest shard
+            calibration = calibrate_gallery(changed_names=[name])
+            self.matcher.add([face_encoding], [name])
+            self.matcher.set_thresholds(calibration)
+        elif VAULT_PATH:
+            # The vault only decrypts what was appended since it was read, into locked memory
+            self.load_known_faces(changed_names=[name])
+        else:
+            encodings, names = self._gallery
+            if isinstance(encodings, QuantizedGallery):
+                encodings = encodings.extend([face_encoding])
+            else:
+                encodings = np.concatenate([encodings, np.asarray(face_encoding, dtype=np.float32).reshape(1, 128)])
+            names = names + [name]
+            calibration = calibrate_gallery(changed_names=[name], gallery=(encodings, names))
+            self._gallery = (encodings, names)
+            self.matcher = face_recognition.FaceMatcher(encodings, names, thresholds=calibration)
+        return path
+
+    def recent_events(self, limit=50):
+        return list(self.events)[-limit:] if limit > 0 else []
+
+
+class RecognitionServer:
+    """
+    Minimal HTTP/1.1 and WebSocket front-end for a RecognitionService, built on asyncio streams.
+
+      POST /identify          image bytes in the body -> {"faces": [{"name", "distance", "box"}]}
+      POST /enrol?name=Alice  image bytes with exactly one face -> adds it to the gallery
+      GET  /events?limit=50   the most recent recognitions
+      GET  /health            gallery size and queue depth
+      GET  /ws                WebSocket: send images as binary messages, get identify results back as text
+    """
+
+    def __init__(self, service, max_connections=64, max_body_bytes=10 * 1024 * 1024):
+        self.service = service
+        self.max_connections = max_connections
+        self.max_body_bytes = max_body_bytes
+        self.connections = 0
+
+    async def handle_connection(self, reader, writer):
+        if self.connections >= self.max_connections:
+            await self._send_json(writer, 503, {"error": "Too many connections."}, keep_alive=False)
+            writer.close()
+            return
+
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HTTPError as e:
+                    # Where the next request starts is unknown, so answer this one and close
+                    await self._send_json(writer, e.status, {"error": e.message}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, query, headers, body = request
+                if path == "/ws" and headers.get("upgrade", "").lower() == "websocket":
+                    await self._websocket(reader, writer, headers)
+                    break
+                keep_alive = headers.get("connection", "").lower() != "close"
+                try:
+                    status, payload = 200, await self._route(method, path, query, body)
+                except HTTPError as e:
+                    status, payload = e.status, {"error": e.message}
+                except Exception as e:
+                    print(f"[ERROR] {method} {path}: {e}")
+                    status, payload = 500, {"error": str(e)}
+                await self._send_json(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line.")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length", 0) or 0)
+        except ValueError:
+            raise HTTPError(400, "Content-Length must be a whole number.")
+        if length < 0:
+            raise HTTPError(400, "Content-Length must not be negative.")
+        if length > self.max_body_bytes:
+            raise HTTPError(413, "Request body too large.")
+        body = await reader.readexactly(length) if length else b""
+
+        url = urlsplit(target)
+        return method.upper(), url.path, parse_qs(url.query), headers, body
+
+    async def _route(self, method, path, query, body):
+        if path == "/identify":
+            if method != "POST":
+                raise HTTPError(405, "Use POST with the image as the request body.")
+            return await self.service.identify(body)
+        if path == "/enrol":
+            if method != "POST":
+                raise HTTPError(405, "Use POST with the image as the request body.")
+            return await self.service.enrol(query.get("name", [""])[0].strip(), body)
+        if path == "/events":
+            try:
+                limit = int(query.get("limit", ["50"])[0])
+            except ValueError:
+                raise HTTPError(400, "limit must be a whole number.")
+            return {"events": self.service.recent_events(limit)}
+        if path == "/health":
+            return {"status": "ok", "known_faces": len(self.service.matcher), "pending": self.service.pending,
+                    "batches": self.service.batches, "images": self.service.images}
+        raise HTTPError(404, f"No such endpoint: {path}")
+
+    async def _send_json(self, writer, status, payload, keep_alive=True):
+        body = json.dumps(payload).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n")
+        if status == 503:
+            head += "Retry-After: 1\r\n"
+        writer.write(head.encode("latin-1") + b"\r\n" + body)
+        await writer.drain()
+
+    async def _websocket(self, reader, writer, headers):
+        key = headers.get("sec-websocket-key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+        message = bytearray()
+        message_opcode = None
+        while True:
+            opcode, fin, payload = await self._read_frame(reader)
+            if opcode == 0x8: # close
+                writer.write(_websocket_frame(0x8, payload[:2]))
+                await writer.drain()
+                return
+            if opcode == 0x9: # ping
+                writer.write(_websocket_frame(0xA, payload))
+                await writer.drain()
+                continue
+            if opcode == 0xA: # pong
+                continue
+            if opcode != 0x0:
+                message_opcode = opcode
+                message = bytearray()
+            message += payload
+            if not fin:
+                continue
+
+            try:
+                if message_opcode == 0x2:
+                    result = await self.service.identify(bytes(message))
+                else:
+                    request = json.loads(message.decode("utf-8"))
+                    result = {"events": self.service.recent_events(int(request.get("limit", 50)))}
+            except HTTPError as e:
+                result = {"error": e.message, "status": e.status}
+            except Exception as e:
+                result = {"error": str(e), "status": 400}
+            writer.write(_websocket_frame(0x1, json.dumps(result).encode("utf-8")))
+            await writer.drain()
+
+    async def _read_frame(self, reader):
+        first, second = await reader.readexactly(2)
+        length = second & 0x7F
+        if length == 126:
+            length, = struct.unpack("!H", await reader.readexactly(2))
+        elif length == 127:
+            length, = struct.unpack("!Q", await reader.readexactly(8))
+        if length > self.max_body_bytes:
+            raise ConnectionError("WebSocket message too large")
+        mask = await reader.readexactly(4) if second & 0x80 else None
+        payload = await reader.readexactly(length)
+        if mask:
+            padded = np.frombuffer(payload + b"\0" * (-length % 4), dtype=np.uint32)
+            payload = (padded ^ np.frombuffer(mask, dtype=np.uint32)).tobytes()[:length]
+        return first & 0x0F, bool(first & 0x80), payload
+
+
+def _websocket_frame(opcode, payload):
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+async def serve(host, port, service, server):
+    await service.start()
+    listener = await asyncio.start_server(server.handle_connection, host, port)
+    print(f"[INFO] Recognition service listening on http://{host}:{port}")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        await service.stop()
+
+
+@click.command()
+@click.option('--host', default="127.0.0.1", help='Address to listen on.')
+@click.option('--port', default=8080, help='Port to listen on.')
+@click.option('--model', default="hog", type=click.Choice(["hog", "cnn", "haar+hog", "haar+cnn"]), help='Face detection model. The haar+ models only verify regions proposed by a fast Haar cascade.')
+@click.option('--upsample', default=1, help='How many times to upsample images looking for faces.')
+@click.option('--tolerance', default=0.6, help='Match tolerance for people without a calibrated threshold.')
+@click.option('--max-batch', default=16, help='Most images encoded together in one batch.')
+@click.option('--batch-window-ms', default=5.0, help='How long to wait for more requests before running a batch.')
+@click.option('--queue-size', default=64, help='Pending requests allowed before new ones are refused with 503.')
+@click.option('--max-connections', default=64, help='Open connections allowed before new ones are refused.')
+@click.option('--max-body-mb', default=10.0, help='Largest accepted image or message, in megabytes.')
+@click.option('--shards', default=0, help='Split the gallery across this many matching processes (0 matches in this process).')
+@click.option('--shard-address', multiple=True, help='host:port of a running "python -m face_recognition.shard" to hold part of the gallery. Repeat for each shard.')
+@click.option('--shard-authkey', envvar="FACE_RECOGNITION_SHARD_KEY", default=None, help='Key the shard servers were started with (or set FACE_RECOGNITION_SHARD_KEY).')
+def main(host, port, model, upsample, tolerance, max_batch, batch_window_ms, queue_size, max_connections, max_body_mb,
+         shards, shard_address, shard_authkey):
+    """Serves face identification and enrolment over local HTTP and WebSocket."""
+    service = RecognitionService(tolerance, model, upsample, max_batch, batch_window_ms / 1000.0, queue_size,
+                                 event_publisher=open_default_publisher(camera="server"), shards=shards,
+                                 shard_addresses=[parse_shard_address(address) for address in shard_address],
+                                 shard_authkey=shard_authkey.encode("utf-8") if shard_authkey else None)
+    server = RecognitionServer(service, max_connections, int(max_body_mb * 1024 * 1024))
+    try:
+        asyncio.run(serve(host, port, service, server))
+    except KeyboardInterrupt:
+        print("[INFO] Recognition service stopped.")
+
+
+if __name__ == "__main__":
+    main()
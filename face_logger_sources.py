@@ -0,0 +1,258 @@
+import os
+import glob
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+import cv2
+
+_END_OF_STREAM = object()
+
+# Characters that make a source a glob pattern rather than a file name
+_WILDCARD_CHARACTERS = "*?["
+
+
+class _ThreadedFrameSource:
+    """
+    Decodes frames in a reader thread and hands them over through a bounded queue, so decoding the next
+    frame overlaps with face processing of the current one. Iterating yields (frame, timestamp) pairs where
+    frame is a BGR numpy array and timestamp is the datetime the frame was recorded.
+    """
+
+    def __init__(self, stride=1, queue_size=32):
+        if stride < 1:
+            raise ValueError("stride must be at least 1")
+        self.stride = stride
+        self.queue_size = queue_size
+        self.frames_read = 0
+        self.error = None
+
+    def _read_frames(self):
+        raise NotImplementedError
+
+    def _reader(self, frames, stop):
+        try:
+            for item in self._read_frames():
+                while not stop.is_set():
+                    try:
+                        frames.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        except Exception as e:
+            self.error = e
+        finally:
+            frames.put(_END_OF_STREAM)
+
+    def __iter__(self):
+        frames = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        reader = threading.Thread(target=self._reader, args=(frames, stop), daemon=True)
+        reader.start()
+        try:
+            while True:
+                item = frames.get()
+                if item is _END_OF_STREAM:
+                    break
+                yield item
+        finally:
+            stop.set()
+            # Unblock the reader if it is waiting on a full queue, then let it finish
+            while reader.is_alive():
+                try:
+                    frames.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            reader.join()
+        if self.error is not None:
+            raise self.error
+
+
+class VideoFileSource(_ThreadedFrameSource):
+    """
+    Frames from a recorded video file. Timestamps come from the video's own timecode (CAP_PROP_POS_MSEC)
+    added to start_time. When start_time is not given, the recording is assumed to have ended at the
+    file's modification time.
+    """
+
+    def __init__(self, path, stride=1, start_time=None, queue_size=32):
+        super().__init__(stride, queue_size)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(path)
+        self.path = path
+        self.start_time = start_time
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.path)
+        if not cap.isOpened():
+            raise IOError(f"Could not open video file {self.path}")
+        return cap
+
+    def _guess_start_time(self, cap):
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        duration = frame_count / fps if fps > 0 and frame_count > 0 else 0.0
+        return datetime.fromtimestamp(os.path.getmtime(self.path)) - timedelta(seconds=duration)
+
+    def _read_frames(self):
+        cap = self._open()
+        try:
+            start_time = self.start_time or self._guess_start_time(cap)
+            index = 0
+            while True:
+                # grab() demuxes without decoding, so skipped frames cost almost nothing
+                if not cap.grab():
+                    break
+                if index % self.stride == 0:
+                    position_ms = cap.get(cv2.CAP_PROP_POS_MSEC)
+                    ret, frame = cap.retrieve()
+                    if not ret or frame is None:
+                        break
+                    self.frames_read += 1
+                    yield frame, start_time + timedelta(milliseconds=position_ms)
+                index += 1
+        finally:
+            cap.release()
+
+
+class ImageSequenceSource(_ThreadedFrameSource):
+    """
+    Frames from a glob of image files (e.g. "recordings/cam1/*.jpg"), taken in sorted filename order.
+    With fps set, frame N is timestamped start_time + N / fps; otherwise each file's modification time is used,
+    so start_time can only be given together with fps.
+    """
+
+    def __init__(self, pattern, stride=1, fps=None, start_time=None, queue_size=32):
+        super().__init__(stride, queue_size)
+        if start_time is not None and fps is None:
+            raise ValueError("start_time needs fps for an image sequence; without it file modification times are used")
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*")
+        self.paths = sorted(glob.glob(pattern))
+        if not self.paths:
+            raise FileNotFoundError(f"No images match {pattern}")
+        if fps is not None and start_time is None:
+            start_time = datetime.fromtimestamp(os.path.getmtime(self.paths[0]))
+        self.fps = fps
+        self.start_time = start_time
+
+    def _read_frames(self):
+        for index in range(0, len(self.paths), self.stride):
+            path = self.paths[index]
+            frame = cv2.imread(path, cv2.IMREAD_COLOR)
+            if frame is None:
+                print(f"[WARNING] Could not decode {path}, skipping.")
+                continue
+            if self.fps:
+                timestamp = self.start_time + timedelta(seconds=index / self.fps)
+            else:
+                timestamp = datetime.fromtimestamp(os.path.getmtime(path))
+            self.frames_read += 1
+            yield frame, timestamp
+
+
+def is_image_sequence(spec):
+    """True if spec names a directory or a glob pattern of images rather than a video file."""
+    return os.path.isdir(spec) or any(character in spec for character in _WILDCARD_CHARACTERS)
+
+
+def open_source(spec, stride=1, start_time=None, fps=None):
+    """Returns an ImageSequenceSource for a directory or glob pattern, otherwise a VideoFileSource."""
+    if is_image_sequence(spec):
+        return ImageSequenceSource(spec, stride=stride, fps=fps, start_time=start_time)
+    return VideoFileSource(spec, stride=stride, start_time=start_time)
+
+
+class LatestFrameReader:
+    """
+    Wraps a live camera so that read() always returns the newest frame instead of the oldest one still buffered
+    by the driver. A background thread reads frames as fast as the camera delivers them and keeps only the latest,
+    so when processing is slower than the camera, frames are skipped rather than queued and the delay between
+    capture and processing stays at about one frame.
+
+    Drop-in for cv2.VideoCapture in the logging loops (read, isOpened, get, set, release).
+    """
+
+    def __init__(self, source, buffer_size=1, fps=None):
+        """
+        :param source: Camera index or stream URL, as for cv2.VideoCapture
+        :param buffer_size: Frames the driver may buffer (CAP_PROP_BUFFERSIZE), 0 to leave the backend default.
+                            Not every backend honours it; the reader thread keeps latency low either way.
+        :param fps: Optional - frame rate to ask the camera for (CAP_PROP_FPS). The capture is configured here,
+                    before the reader thread starts, since it isn't safe to change while a read is in progress.
+        """
+        self.capture = cv2.VideoCapture(source)
+        if buffer_size:
+            self.capture.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+        if fps:
+            self.capture.set(cv2.CAP_PROP_FPS, fps)
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.last_timestamp = None
+        self._frame = None
+        self._timestamp = None
+        self._returned = 0
+        self._ended = False
+        self._running = True
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._read_frames, daemon=True)
+        if self.capture.isOpened():
+            self._thread.start()
+
+    def _read_frames(self):
+        try:
+            while self._running:
+                ret, frame = self.capture.read()
+                timestamp = time.time()
+                with self._condition:
+                    if not ret or frame is None:
+                        self._ended = True
+                        self._condition.notify_all()
+                        return
+                    self._frame = frame
+                    self._timestamp = timestamp
+                    self.frames_captured += 1
+                    self._condition.notify_all()
+        finally:
+            # Once started, this thread owns the capture: releasing it from another thread could race a read()
+            self.capture.release()
+
+    def read_latest(self, timeout=5.0):
+        """
+        Waits for a frame newer than the last one returned.
+
+        :return: (frame, sequence number, capture time as returned by time.time()), or (None, None, None) if the
+                 camera stopped delivering frames or none arrived within timeout seconds
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.frames_captured > self._returned or self._ended, timeout)
+            if self.frames_captured == self._returned:
+                return None, None, None
+            # Frames captured since the previous call that nobody will ever see
+            self.frames_dropped += self.frames_captured - self._returned - 1
+            self._returned = self.frames_captured
+            self.last_timestamp = self._timestamp
+            return self._frame, self._returned, self._timestamp
+
+    def read(self):
+        frame, sequence, timestamp = self.read_latest()
+        return frame is not None, frame
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def get(self, prop):
+        return self.capture.get(prop)
+
+    def set(self, prop, value):
+        return self.capture.set(prop, value)
+
+    def release(self):
+        self._running = False
+        if self._thread.is_alive():
+            # The thread releases the capture when its current read() returns; waiting here is only a courtesy
+            self._thread.join(timeout=1.0)
+        elif not self._thread.ident:
+            self.capture.release()
@@ -0,0 +1,230 @@
+import os
+import csv
+import time
+import sqlite3
+import threading
+from datetime import datetime
+import click
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Set FACE_LOGGER_DB to a path (e.g. events.db) to record events in SQLite as well as logs.csv.
+DEFAULT_DB = os.environ.get("FACE_LOGGER_DB")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    camera TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_name_timestamp ON events(name, timestamp);
+CREATE INDEX IF NOT EXISTS idx_events_camera_timestamp ON events(camera, timestamp);
+CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events(timestamp);
+CREATE TABLE IF NOT EXISTS cooldown (
+    name TEXT PRIMARY KEY,
+    last_logged TEXT NOT NULL
+);
+"""
+
+
+class EventStore:
+    """
+    SQLite-backed event log kept alongside logs.csv.
+
+    Events are buffered and written in one transaction once batch_size events are pending or flush_interval
+    seconds have passed, so logging a busy doorway does not cost a disk sync per face. A background thread flushes
+    every flush_interval seconds, so events from a quiet period are committed too. The database runs in WAL mode
+    so report queries never block the logger. The last time each person was logged is kept in the cooldown
+    table, so a restarted logger does not log everyone in view a second time.
+    """
+
+    def __init__(self, path, batch_size=64, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # The flush thread shares the connection; self._lock serialises every use of it
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(_SCHEMA)
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+            self._flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            with self._lock:
+                if self._closed.is_set():
+                    break
+                if time.monotonic() - self._last_flush >= self.flush_interval:
+                    self.flush()
+
+    def add_event(self, name, status, when=None, camera=None):
+        """Buffers one event. camera identifies the camera that saw it (e.g. its index) for per-camera reports."""
+        timestamp = (when or datetime.now()).strftime(TIMESTAMP_FORMAT)
+        with self._lock:
+            self._pending.append((timestamp, name, status, None if camera is None else str(camera)))
+            if len(self._pending) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, []
+            latest = {}
+            for timestamp, name, status, camera in pending:
+                if status == "Recognized":
+                    latest[name] = max(timestamp, latest.get(name, timestamp))
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT INTO events (timestamp, name, status, camera) VALUES (?, ?, ?, ?)", pending)
+                self.connection.executemany(
+                    "INSERT INTO cooldown (name, last_logged) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET last_logged = MAX(last_logged, excluded.last_logged)",
+                    latest.items())
+
+    def close(self):
+        with self._lock:
+            self._closed.set()
+            self.flush()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.connection.close()
+
+    def last_log_times(self):
+        """Returns {name: datetime} of the last time each person was logged as recognized."""
+        with self._lock:
+            self.flush()
+            rows = self.connection.execute("SELECT name, last_logged FROM cooldown").fetchall()
+        return {name: datetime.strptime(last_logged, TIMESTAMP_FORMAT) for name, last_logged in rows}
+
+    def first_in_last_out(self, since=None, until=None, name=None, camera=None):
+        """
+        Returns (day, name, first_seen, last_seen, count) rows for recognized people, one per person per day.
+        since/until are "YYYY-MM-DD" strings; until is inclusive.
+        """
+        query = ("SELECT substr(timestamp, 1, 10) AS day, name, MIN(timestamp), MAX(timestamp), COUNT(*) "
+                 "FROM events WHERE status = 'Recognized'")
+        parameters = []
+        if since:
+            query += " AND timestamp >= ?"
+            parameters.append(since)
+        if until:
+            query += " AND timestamp < ?"
+            parameters.append(until + "\x7f")
+        if name:
+            query += " AND name = ?"
+            parameters.append(name)
+        if camera:
+            query += " AND camera = ?"
+            parameters.append(camera)
+        query += " GROUP BY day, name ORDER BY day, name"
+        with self._lock:
+            self.flush()
+            return self.connection.execute(query, parameters).fetchall()
+
+    def export_csv(self, csv_path, since=None, until=None):
+        """Writes events as Timestamp,Name,Status rows, the same schema as logs.csv. Returns the row count."""
+        query = "SELECT timestamp, name, status FROM events WHERE 1"
+        parameters = []
+        if since:
+            query += " AND timestamp >= ?"
+            parameters.append(since)
+        if until:
+            query += " AND timestamp < ?"
+            parameters.append(until + "\x7f")
+        query += " ORDER BY timestamp, id"
+
+        count = 0
+        with self._lock, open(csv_path, 'w', newline='') as f:
+            self.flush()
+            writer = csv.writer(f)
+            writer.writerow(["Timestamp", "Name", "Status"])
+            for row in self.connection.execute(query, parameters):
+                writer.writerow(row)
+                count += 1
+        return count
+
+    def import_csv(self, csv_path, camera=None):
+        """Loads the rows of an existing logs.csv. Returns the row count."""
+        count = 0
+        with self._lock, open(csv_path, newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                if len(row) >= 3:
+                    self._pending.append((row[0], row[1], row[2], camera))
+                    count += 1
+                    if len(self._pending) >= 10000:
+                        self.flush()
+            self.flush()
+        return count
+
+
+def open_default_store():
+    """Returns an EventStore for FACE_LOGGER_DB, or None when the event store is not enabled."""
+    if not DEFAULT_DB:
+        return None
+    return EventStore(DEFAULT_DB)
+
+
+@click.group()
+@click.option('--db', default=DEFAULT_DB or "events.db", help='SQLite event database.')
+@click.pass_context
+def main(ctx, db):
+    """Query and maintain the face logger event store."""
+    ctx.obj = db
+
+
+@main.command()
+@click.option('--since', default=None, help='First day to include (YYYY-MM-DD).')
+@click.option('--until', default=None, help='Last day to include (YYYY-MM-DD).')
+@click.option('--name', default=None, help='Only report this person.')
+@click.option('--camera', default=None, help='Only report events from this camera.')
+@click.pass_obj
+def report(db, since, until, name, camera):
+    """Print first-in/last-out times per person per day."""
+    with EventStore(db) as store:
+        click.echo("Day,Name,FirstIn,LastOut,Count")
+        for day, person, first_seen, last_seen, count in store.first_in_last_out(since, until, name, camera):
+            click.echo(f"{day},{person},{first_seen[11:]},{last_seen[11:]},{count}")
+
+
+@main.command(name="export")
+@click.argument('csv_path')
+@click.option('--since', default=None, help='First day to include (YYYY-MM-DD).')
+@click.option('--until', default=None, help='Last day to include (YYYY-MM-DD).')
+@click.pass_obj
+def export_command(db, csv_path, since, until):
+    """Export events to CSV_PATH in the logs.csv format."""
+    with EventStore(db) as store:
+        click.echo(f"[INFO] Exported {store.export_csv(csv_path, since, until)} events to {csv_path}.")
+
+
+@main.command(name="import")
+@click.argument('csv_path')
+@click.option('--camera', default=None, help='Camera name to record for the imported rows.')
+@click.pass_obj
+def import_command(db, csv_path, camera):
+    """Load the rows of an existing logs.csv into the event store."""
+    with EventStore(db) as store:
+        click.echo(f"[INFO] Imported {store.import_csv(csv_path, camera)} events from {csv_path}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,640 @@
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import ctypes
+import ctypes.util
+import contextlib
+import getpass
+import hashlib
+import tempfile
+import click
+import numpy as np
+from face_logger_gallery import FACES_DIR, THRESHOLDS_FILE, _write_temp_file, load_gallery, load_thresholds
+from face_logger_logd import file_lock
+
+VAULT_FILE = "gallery.vault"
+# Set FACE_LOGGER_VAULT_PASSPHRASE (e.g. in the kiosk's service configuration) to unlock without a prompt
+PASSPHRASE_ENV = "FACE_LOGGER_VAULT_PASSPHRASE"
+
+# magic, format version, scrypt log2(N), r, p, salt
+_HEADER = struct.Struct("<4sBBBB16s")
+_MAGIC = b"FLV1"
+# nonce, ciphertext length; followed by the ciphertext and the 16-byte GCM tag
+_BLOCK_HEADER = struct.Struct("<12sI")
+_TAG_SIZE = 16
+# names/thresholds JSON length, encoding count; followed by the JSON, padding to 4 bytes and the float32 encodings
+_SEGMENT_HEADER = struct.Struct("<II")
+BLOCK_SIZE = 4 * 1024 * 1024
+ENCODING_BYTES = 128 * 4
+
+# scrypt with N=2**15, r=8 uses 32 MB and takes about 0.1s, once per unlock
+SCRYPT_LOG2_N = 15
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+_EVP_CTRL_GCM_GET_TAG = 0x10
+_EVP_CTRL_GCM_SET_TAG = 0x11
+
+
+class VaultError(Exception):
+    pass
+
+
+def _load_libcrypto():
+    """
+    The OpenSSL libcrypto that _ssl and _hashlib are built on. The bundled Windows runtime ships it next to
+    python.exe; elsewhere it is the system's.
+    """
+    names = ["libcrypto-1_1.dll", "libcrypto-1_1-x64.dll", "libcrypto-3.dll", "libcrypto-3-x64.dll"]
+    candidates = [os.path.join(directory, name) for directory in
+                  (os.path.dirname(sys.executable), os.path.join(sys.base_prefix, "DLLs")) for name in names]
+    candidates += [ctypes.util.find_library("crypto"), "libcrypto.so.3", "libcrypto.so.1.1"]
+    for candidate in candidates:
+        if not candidate:
+            continue
+        try:
+            lib = ctypes.CDLL(candidate)
+            lib.EVP_aes_256_gcm
+        except (OSError, AttributeError):
+            continue
+        lib.EVP_CIPHER_CTX_new.restype = ctypes.c_void_p
+        lib.EVP_CIPHER_CTX_free.argtypes = [ctypes.c_void_p]
+        lib.EVP_aes_256_gcm.restype = ctypes.c_void_p
+        for name in ("EVP_EncryptInit_ex", "EVP_DecryptInit_ex"):
+            getattr(lib, name).argtypes = [ctypes.c_void_p] * 5
+        for name in ("EVP_EncryptUpdate", "EVP_DecryptUpdate"):
+            getattr(lib, name).argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.POINTER(ctypes.c_int),
+                                           ctypes.c_void_p, ctypes.c_int]
+        for name in ("EVP_EncryptFinal_ex", "EVP_DecryptFinal_ex"):
+            getattr(lib, name).argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.POINTER(ctypes.c_int)]
+        lib.EVP_CIPHER_CTX_ctrl.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+        return lib
+    raise VaultError("Could not find OpenSSL's libcrypto, which the encrypted gallery needs")
+
+
+_libcrypto = None
+
+
+def _crypto():
+    global _libcrypto
+    if _libcrypto is None:
+        _libcrypto = _load_libcrypto()
+    return _libcrypto
+
+
+def _address(data):
+    """Address of a bytes object's or writable buffer's memory, for passing to libcrypto."""
+    if isinstance(data, bytes):
+        return ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value
+    return ctypes.addressof(ctypes.c_char.from_buffer(data))
+
+
+def _gcm(encrypt, key_address, nonce, aad, in_address, length, out_address, tag):
+    """
+    AES-256-GCM over length bytes at in_address, written to out_address. Returns the tag when encrypting;
+    when decrypting, checks tag and raises VaultError if the data or aad were modified or the key is wrong.
+    """
+    lib = _crypto()
+    ctx = lib.EVP_CIPHER_CTX_new()
+    if not ctx:
+        raise MemoryError("EVP_CIPHER_CTX_new failed")
+    prefix = "EVP_Encrypt" if encrypt else "EVP_Decrypt"
+    init, update, final = (getattr(lib, prefix + stage) for stage in ("Init_ex", "Update", "Final_ex"))
+    out_length = ctypes.c_int(0)
+    try:
+        if not init(ctx, lib.EVP_aes_256_gcm(), None, key_address, _address(nonce)):
+            raise VaultError(f"{prefix}Init_ex failed")
+        if not update(ctx, None, ctypes.byref(out_length), _address(aad), len(aad)):
+            raise VaultError(f"{prefix}Update failed")
+        if length and not update(ctx, out_address, ctypes.byref(out_length), in_address, length):
+            raise VaultError(f"{prefix}Update failed")
+        if encrypt:
+            if not final(ctx, None, ctypes.byref(out_length)):
+                raise VaultError("EVP_EncryptFinal_ex failed")
+            tag = ctypes.create_string_buffer(_TAG_SIZE)
+            lib.EVP_CIPHER_CTX_ctrl(ctx, _EVP_CTRL_GCM_GET_TAG, _TAG_SIZE, tag)
+            return tag.raw
+        lib.EVP_CIPHER_CTX_ctrl(ctx, _EVP_CTRL_GCM_SET_TAG, _TAG_SIZE, ctypes.c_char_p(tag))
+        if not final(ctx, None, ctypes.byref(out_length)):
+            raise VaultError("authentication failed")
+    finally:
+        lib.EVP_CIPHER_CTX_free(ctx)
+
+
+def _lock_memory(address, size):
+    """Keeps the pages out of swap. Returns False if the OS refused (e.g. over the process' lock limit)."""
+    if os.name == "nt":
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        process = kernel32.GetCurrentProcess()
+        minimum, maximum = ctypes.c_size_t(), ctypes.c_size_t()
+        # VirtualLock is limited by the minimum working set, so grow it by the size to lock first
+        if kernel32.GetProcessWorkingSetSize(process, ctypes.byref(minimum), ctypes.byref(maximum)):
+            kernel32.SetProcessWorkingSetSize(process, ctypes.c_size_t(minimum.value + size),
+                                              ctypes.c_size_t(maximum.value + size))
+        return bool(kernel32.VirtualLock(ctypes.c_void_p(address), ctypes.c_size_t(size)))
+    libc = ctypes.CDLL(None, use_errno=True)
+    return libc.mlock(ctypes.c_void_p(address), ctypes.c_size_t(size)) == 0
+
+
+def _unlock_memory(address, size):
+    if os.name == "nt":
+        ctypes.WinDLL("kernel32").VirtualUnlock(ctypes.c_void_p(address), ctypes.c_size_t(size))
+    else:
+        ctypes.CDLL(None).munlock(ctypes.c_void_p(address), ctypes.c_size_t(size))
+
+
+class LockedBuffer:
+    """
+    Anonymous memory that is locked into RAM where the OS allows it (so it is never written to the swap or page
+    file), kept out of core dumps on Linux, and zeroed by close().
+    """
+
+    def __init__(self, size):
+        self.size = max(size, 1)
+        self._mmap = mmap.mmap(-1, self.size)
+        if hasattr(mmap, "MADV_DONTDUMP"):
+            self._mmap.madvise(mmap.MADV_DONTDUMP)
+        self.address = _address(self._mmap)
+        self.locked = _lock_memory(self.address, self.size)
+
+    def array(self, dtype, count, offset=0):
+        return np.frombuffer(self._mmap, dtype=dtype, count=count, offset=offset)
+
+    def close(self):
+        if self._mmap is None:
+            return
+        ctypes.memset(self.address, 0, self.size)
+        if self.locked:
+            _unlock_memory(self.address, self.size)
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass # Arrays still view it; it is zeroed and goes when they do
+        self._mmap = None
+
+
+def derive_key(passphrase, salt, log2_n=SCRYPT_LOG2_N, r=SCRYPT_R, p=SCRYPT_P):
+    """The 32-byte AES key for passphrase, in a LockedBuffer."""
+    key = hashlib.scrypt(passphrase.encode("utf-8"), salt=salt, n=2 ** log2_n, r=r, p=p,
+                         maxmem=256 * r * 2 ** log2_n, dklen=32)
+    key_buffer = LockedBuffer(32)
+    ctypes.memmove(key_buffer.address, key, 32)
+    return key_buffer
+
+
+def _segment(names=(), encodings=None, thresholds=None, tolerance=None):
+    """One plaintext segment: the names (and optionally thresholds) as JSON, then the encodings."""
+    meta = {"names": list(names)}
+    if thresholds is not None:
+        meta["thresholds"] = thresholds
+        meta["tolerance"] = tolerance
+    meta_bytes = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+    meta_bytes += b" " * (-len(meta_bytes) % 4)
+    count = len(meta["names"])
+    if count:
+        data = np.ascontiguousarray(encodings, dtype=np.float32).reshape(count, 128).tobytes()
+    else:
+        data = b""
+    return _SEGMENT_HEADER.pack(len(meta_bytes), count) + meta_bytes + data
+
+
+class GalleryVault:
+    """
+    The gallery (names, encodings and per-person thresholds) encrypted into one file with AES-256-GCM, keyed by
+    a passphrase through scrypt.
+
+    The file is a plaintext header (format, scrypt parameters, salt) followed by blocks of up to BLOCK_SIZE,
+    each with its own random nonce and tag. Each block authenticates the header and its own position, so blocks
+    can't be modified, reordered or moved between vaults. New registrations and recalibrations are appended as
+    small blocks under a lock file, without rewriting the file; compact() packs them into large blocks again.
+    Dropping blocks from the end of the file is not detected.
+
+    unlock() reads the file, derives the key once and decrypts every block straight into locked memory; the
+    encodings are then gathered into one (N, 128) float32 array, also in locked memory, which FaceMatcher uses
+    as is. Names and thresholds are ordinary Python objects.
+    """
+
+    def __init__(self, path, header, key_buffer):
+        self.path = path
+        self._header = header
+        self._key = key_buffer
+        self.locked = key_buffer.locked
+        self._buffer = None
+        self._retired = [] # earlier encoding buffers, which matchers may still use until close()
+        self._reset()
+
+    def _reset(self):
+        self.names = []
+        self.thresholds = {}
+        self.tolerance = None
+        self._count = 0
+        self._blocks = 0
+        self._read_to = _HEADER.size
+        self._file_id = None
+
+    @classmethod
+    def create(cls, path, passphrase, encodings=(), names=(), thresholds=None, tolerance=None):
+        """Writes a new vault (atomically replacing path) and returns it unlocked."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        header = _HEADER.pack(_MAGIC, 1, SCRYPT_LOG2_N, SCRYPT_R, SCRYPT_P, os.urandom(16))
+        vault = cls(path, header, derive_key(passphrase, header[-16:]))
+        segment = _segment(names, encodings, thresholds or {}, tolerance)
+        with vault._lock():
+            vault._rewrite(segment)
+        vault._ingest(_address(segment), len(segment))
+        return vault
+
+    @classmethod
+    def unlock(cls, path, passphrase, timings=None):
+        """
+        :param timings: Optional - a dict. The seconds spent reading the file ("read"), deriving the key ("kdf")
+                        and decrypting into locked memory ("decrypt") are added to it.
+        """
+        started = time.perf_counter()
+        with open(path, 'rb') as f:
+            data = f.read()
+            file_id = _file_id(f)
+        read = time.perf_counter()
+        if len(data) < _HEADER.size or data[:4] != _MAGIC:
+            raise VaultError(f"{path} is not an encrypted gallery")
+        header = data[:_HEADER.size]
+        _, version, log2_n, r, p, salt = _HEADER.unpack(header)
+        if version != 1:
+            raise VaultError(f"{path} has unsupported format version {version}")
+        vault = cls(path, header, derive_key(passphrase, salt, log2_n, r, p))
+        derived = time.perf_counter()
+        try:
+            vault._decrypt(data, _HEADER.size)
+        except VaultError:
+            vault.close()
+            raise
+        vault._file_id = file_id
+        if timings is not None:
+            timings["read"] = timings.get("read", 0.0) + read - started
+            timings["kdf"] = timings.get("kdf", 0.0) + derived - read
+            timings["decrypt"] = timings.get("decrypt", 0.0) + time.perf_counter() - derived
+        return vault
+
+    def _decrypt(self, data, start):
+        """Decrypts and adds the complete blocks in data (file contents from self._read_to) from start on."""
+        blocks = []
+        offset = start
+        while offset + _BLOCK_HEADER.size <= len(data):
+            nonce, length = _BLOCK_HEADER.unpack_from(data, offset)
+            end = offset + _BLOCK_HEADER.size + length + _TAG_SIZE
+            if end > len(data):
+                break # A block still being appended
+            blocks.append((nonce, offset + _BLOCK_HEADER.size, length, data[end - _TAG_SIZE:end]))
+            offset = end
+        if not blocks:
+            return
+
+        plaintext = LockedBuffer(sum(length for _, _, length, _ in blocks))
+        self.locked = self.locked and plaintext.locked
+        try:
+            source = _address(data)
+            position = 0
+            for nonce, block_offset, length, tag in blocks:
+                aad = self._header + struct.pack("<Q", self._blocks)
+                try:
+                    _gcm(False, self._key.address, nonce, aad, source + block_offset, length,
+                         plaintext.address + position, tag)
+                except VaultError:
+                    if self._blocks == 0:
+                        raise VaultError(f"Wrong passphrase for {self.path}, or the file is corrupt")
+                    raise VaultError(f"{self.path} is corrupt or was tampered with at block {self._blocks}")
+                position += length
+                self._blocks += 1
+            self._ingest(plaintext.address, position)
+            self._read_to += offset - start
+        finally:
+            plaintext.close()
+
+    def _ingest(self, address, length):
+        """Adds the names, thresholds and encodings of the plaintext segments at address."""
+        segments = []
+        position = 0
+        while position < length:
+            meta_length, count = _SEGMENT_HEADER.unpack(ctypes.string_at(address + position, _SEGMENT_HEADER.size))
+            position += _SEGMENT_HEADER.size
+            meta = json.loads(ctypes.string_at(address + position, meta_length).decode("utf-8"))
+            position += meta_length
+            segments.append((meta, position, count))
+            position += count * ENCODING_BYTES
+
+        self._reserve(self._count + sum(count for _, _, count in segments))
+        for meta, offset, count in segments:
+            self.names.extend(meta["names"])
+            if "thresholds" in meta:
+                self.thresholds.update(meta["thresholds"])
+                self.tolerance = meta.get("tolerance", self.tolerance)
+            if count:
+                ctypes.memmove(self._buffer.address + self._count * ENCODING_BYTES, address + offset,
+                               count * ENCODING_BYTES)
+                self._count += count
+
+    def _reserve(self, count):
+        """Makes room for count encodings, growing the locked buffer by at least half when it is full."""
+        capacity = self._buffer.size // ENCODING_BYTES if self._buffer is not None else 0
+        if count <= capacity:
+            return
+        buffer = LockedBuffer(max(count, capacity + capacity // 2, 16) * ENCODING_BYTES)
+        self.locked = self.locked and buffer.locked
+        if self._buffer is not None:
+            ctypes.memmove(buffer.address, self._buffer.address, self._count * ENCODING_BYTES)
+            self._retired.append(self._buffer)
+        self._buffer = buffer
+
+    @property
+    def encodings(self):
+        """An (N, 128) float32 array of every encoding, in locked memory."""
+        if self._buffer is None:
+            return np.zeros((0, 128), dtype=np.float32)
+        return self._buffer.array(np.float32, self._count * 128).reshape(self._count, 128)
+
+    def __len__(self):
+        return self._count
+
+    @contextlib.contextmanager
+    def _lock(self):
+        # A separate lock file, because compact() replaces the vault file itself
+        with open(self.path + ".lock", 'a+b') as f:
+            with file_lock(f):
+                yield
+
+    def refresh(self):
+        """Reads what other processes appended since this vault was read, or all of it if one compacted it."""
+        with self._lock():
+            self._refresh()
+
+    def _refresh(self):
+        # Call with the lock held. Returns where the complete blocks end.
+        with open(self.path, 'rb') as f:
+            if _file_id(f) != self._file_id:
+                self._reset()
+                self._retired.append(self._buffer)
+                self._buffer = None
+                self._file_id = _file_id(f)
+            f.seek(self._read_to)
+            self._decrypt(f.read(), 0)
+            return self._read_to
+
+    def _encrypt_blocks(self, plaintext, first_index):
+        """Encrypts plaintext (bytes) into blocks numbered from first_index. Returns the bytes to write."""
+        out = []
+        for index, start in enumerate(range(0, len(plaintext), BLOCK_SIZE), first_index):
+            chunk = plaintext[start:start + BLOCK_SIZE]
+            nonce = os.urandom(12)
+            ciphertext = ctypes.create_string_buffer(len(chunk))
+            tag = _gcm(True, self._key.address, nonce, self._header + struct.pack("<Q", index), _address(chunk),
+                       len(chunk), ctypes.addressof(ciphertext), None)
+            out.append(_BLOCK_HEADER.pack(nonce, len(chunk)) + ciphertext.raw + tag)
+        return b"".join(out)
+
+    def _rewrite(self, plaintext):
+        """Replaces the file with plaintext as large blocks. Call with the lock held."""
+        blocks = self._encrypt_blocks(plaintext, 0)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        temp_path = _write_temp_file(directory, lambda f: f.write(self._header + blocks))
+        os.replace(temp_path, self.path)
+        self._blocks = (len(plaintext) + BLOCK_SIZE - 1) // BLOCK_SIZE
+        self._read_to = _HEADER.size + len(blocks)
+        with open(self.path, 'rb') as f:
+            self._file_id = _file_id(f)
+
+    def _append(self, plaintext):
+        """Appends plaintext as new blocks, after reading whatever other processes appended."""
+        with self._lock():
+            end = self._refresh()
+            blocks = self._encrypt_blocks(plaintext, self._blocks)
+            with open(self.path, 'r+b') as f:
+                # Overwrites a block left incomplete by a process that died while appending
+                f.seek(end)
+                f.write(blocks)
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+            self._blocks += (len(plaintext) + BLOCK_SIZE - 1) // BLOCK_SIZE
+            self._read_to = end + len(blocks)
+        self._ingest(_address(plaintext), len(plaintext))
+
+    def add(self, name, encoding):
+        """Adds one encoding. Returns how many encodings name now has."""
+        self._append(_segment([name], np.asarray(encoding, dtype=np.float32).reshape(1, 128)))
+        return self.names.count(name)
+
+    def set_thresholds(self, thresholds, tolerance):
+        """Stores a recalibration (from calibrate_thresholds()) for the people in thresholds."""
+        self._append(_segment(thresholds=thresholds, tolerance=tolerance))
+
+    def compact(self):
+        """Rewrites the vault as large blocks, folding in everything appended since it was sealed."""
+        with self._lock():
+            self._refresh()
+            self._rewrite(_segment(self.names, self.encodings, self.thresholds, self.tolerance))
+
+    def close(self):
+        """Zeroes and releases the key and every decrypted encoding."""
+        for buffer in self._retired + [self._buffer, self._key]:
+            if buffer is not None:
+                buffer.close()
+        self._retired = []
+        self._buffer = None
+
+
+def _file_id(f):
+    stat = os.fstat(f.fileno())
+    return stat.st_dev, stat.st_ino
+
+
+def read_passphrase(confirm=False):
+    passphrase = os.environ.get(PASSPHRASE_ENV)
+    if passphrase:
+        return passphrase
+    passphrase = getpass.getpass("Gallery passphrase: ")
+    if confirm and getpass.getpass("Repeat the passphrase: ") != passphrase:
+        raise VaultError("The passphrases don't match")
+    if not passphrase:
+        raise VaultError("The passphrase can't be empty")
+    return passphrase
+
+
+_unlocked = {}
+
+
+def unlocked_vault(path):
+    """
+    The vault at path, unlocked once per process with the passphrase from FACE_LOGGER_VAULT_PASSPHRASE or a
+    prompt. An empty vault is created if there is none yet.
+    """
+    path = os.path.abspath(path)
+    if path not in _unlocked:
+        if not os.path.exists(path):
+            print(f"[INFO] Creating encrypted gallery {path}.")
+            _unlocked[path] = GalleryVault.create(path, read_passphrase(confirm=True))
+        else:
+            timings = {}
+            vault = GalleryVault.unlock(path, read_passphrase(), timings)
+            print(f"[INFO] Unlocked {len(vault)} encodings from {path} in "
+                  f"{sum(timings.values()) * 1000:.0f} ms (key derivation {timings['kdf'] * 1000:.0f} ms).")
+            _unlocked[path] = vault
+        if not _unlocked[path].locked:
+            print("[WARNING] Could not lock the decrypted gallery in memory; it may be written to swap. Raise the "
+                  "process' locked memory limit (ulimit -l) to prevent this.")
+    return _unlocked[path]
+
+
+def seal_gallery(faces_dir=FACES_DIR, path=None, passphrase=None, remove_plain=False):
+    """
+    Encrypts the plain faces/<name>/*.npy gallery and its thresholds into one vault file. With remove_plain, the
+    .npy files and thresholds.json are deleted once the vault has been unlocked and checked.
+
+    Returns the number of encodings sealed.
+    """
+    path = path or os.path.join(faces_dir, VAULT_FILE)
+    encodings, names = load_gallery(faces_dir, plain=True)
+    thresholds = load_thresholds(faces_dir, plain=True)
+    tolerance = None
+    thresholds_path = os.path.join(faces_dir, THRESHOLDS_FILE)
+    if os.path.exists(thresholds_path):
+        with open(thresholds_path) as f:
+            tolerance = json.load(f).get("tolerance")
+    GalleryVault.create(path, passphrase, encodings, names, thresholds, tolerance).close()
+
+    check = GalleryVault.unlock(path, passphrase)
+    try:
+        if check.names != list(names) or not np.array_equal(check.encodings, np.asarray(encodings, np.float32).reshape(-1, 128)):
+            raise VaultError(f"{path} doesn't match the gallery it was sealed from")
+    finally:
+        check.close()
+
+    if remove_plain:
+        for person_name in os.listdir(faces_dir):
+            person_dir = os.path.join(faces_dir, person_name)
+            if not os.path.isdir(person_dir) or person_name.startswith("."):
+                continue
+            for filename in os.listdir(person_dir):
+                if filename.endswith(".npy"):
+                    os.unlink(os.path.join(person_dir, filename))
+            if not os.listdir(person_dir):
+                os.rmdir(person_dir)
+        if os.path.exists(thresholds_path):
+            os.unlink(thresholds_path)
+    return len(names)
+
+
+def benchmark_unlock(identities=100000, repeats=3):
+    """
+    Seals a random gallery of identities encodings (one per person) in a temporary directory and times
+    unlocking it, against reading the same encodings unencrypted from one .npy file.
+    """
+    rng = np.random.default_rng(0)
+    encodings = rng.standard_normal((identities, 128)).astype(np.float32)
+    names = [f"person_{i:06d}" for i in range(identities)]
+    passphrase = "benchmark passphrase"
+    results = {"identities": identities}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, VAULT_FILE)
+        started = time.perf_counter()
+        GalleryVault.create(path, passphrase, encodings, names).close()
+        results["seal_ms"] = (time.perf_counter() - started) * 1000
+        results["file_mb"] = os.path.getsize(path) / 1e6
+
+        plain_path = os.path.join(directory, "plain.npy")
+        np.save(plain_path, encodings)
+        best = None
+        for _ in range(repeats):
+            started = time.perf_counter()
+            np.load(plain_path)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        results["plain_npy_ms"] = best * 1000
+
+        best = None
+        for _ in range(repeats):
+            timings = {}
+            started = time.perf_counter()
+            vault = GalleryVault.unlock(path, passphrase, timings)
+            timings["total"] = time.perf_counter() - started
+            results["locked"] = vault.locked
+            vault.close()
+            if best is None or timings["total"] < best["total"]:
+                best = timings
+        for stage, seconds in best.items():
+            results[f"unlock_{stage}_ms"] = seconds * 1000
+        results["decrypt_mb_per_s"] = results["file_mb"] / max(best["decrypt"], 1e-9)
+    return results
+
+
+@click.group()
+@click.option('--faces-dir', default=FACES_DIR, help='Gallery directory.')
+@click.option('--vault', 'vault_path', default=None, help=f'Encrypted gallery file (default: <faces-dir>/{VAULT_FILE}).')
+@click.pass_context
+def cli(ctx, faces_dir, vault_path):
+    """Seals the gallery into one encrypted file that the logger unlocks into locked memory (see FACE_LOGGER_VAULT)."""
+    ctx.obj = (faces_dir, vault_path or os.path.join(faces_dir, VAULT_FILE))
+
+
+@cli.command()
+@click.option('--remove-plain', is_flag=True, help='Delete the unencrypted .npy files and thresholds.json once the vault checks out.')
+@click.pass_obj
+def seal(paths, remove_plain):
+    """Encrypts the faces/<name>/*.npy gallery into the vault."""
+    faces_dir, vault_path = paths
+    count = seal_gallery(faces_dir, vault_path, read_passphrase(confirm=True), remove_plain)
+    click.echo(f"[INFO] Sealed {count} encodings into {vault_path}.")
+    if os.path.exists(os.path.join(faces_dir, "chips.pack")):
+        click.echo("[WARNING] The face chip archive (chips.pack) is not encrypted. Delete it if it isn't needed.")
+
+
+@cli.command()
+@click.pass_obj
+def unseal(paths):
+    """Writes the vault back out as a plain faces/<name>/face_N.npy gallery."""
+    from face_logger_gallery import save_encoding
+    faces_dir, vault_path = paths
+    vault = GalleryVault.unlock(vault_path, read_passphrase())
+    try:
+        for name, encoding in zip(vault.names, vault.encodings):
+            save_encoding(name, encoding, faces_dir, plain=True)
+        data = json.dumps({"tolerance": vault.tolerance, "people": vault.thresholds}, indent=1, sort_keys=True)
+        temp_path = _write_temp_file(faces_dir, lambda f: f.write(data.encode("utf-8")))
+        os.replace(temp_path, os.path.join(faces_dir, THRESHOLDS_FILE))
+        click.echo(f"[INFO] Wrote {len(vault)} encodings to {faces_dir}.")
+    finally:
+        vault.close()
+
+
+@cli.command()
+@click.pass_obj
+def compact(paths):
+    """Packs registrations appended since sealing into large blocks."""
+    _, vault_path = paths
+    vault = GalleryVault.unlock(vault_path, read_passphrase())
+    try:
+        vault.compact()
+        click.echo(f"[INFO] Compacted {len(vault)} encodings.")
+    finally:
+        vault.close()
+
+
+@cli.command()
+@click.option('--identities', default=100000, help='Size of the random gallery to seal and unlock.')
+@click.option('--repeats', default=3, help='Unlock this many times and report the fastest.')
+def bench(identities, repeats):
+    """Times unlocking a vault of --identities encodings."""
+    results = benchmark_unlock(identities, repeats)
+    click.echo(f"[INFO] {results['identities']} identities, {results['file_mb']:.1f} MB vault, sealed in {results['seal_ms']:.0f} ms.")
+    click.echo(f"[INFO] Unlock: {results['unlock_total_ms']:.0f} ms (read {results['unlock_read_ms']:.0f} ms, "
+               f"key derivation {results['unlock_kdf_ms']:.0f} ms, decrypt into locked memory "
+               f"{results['unlock_decrypt_ms']:.0f} ms at {results['decrypt_mb_per_s']:.0f} MB/s).")
+    click.echo(f"[INFO] Reading the same encodings from one unencrypted .npy file: {results['plain_npy_ms']:.0f} ms.")
+    if not results["locked"]:
+        click.echo("[WARNING] The memory could not be locked (ulimit -l); timings include no page locking.")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The face_logger_*.py scripts live at the top of the bundle, next to python.exe
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
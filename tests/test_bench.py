@@ -0,0 +1,11 @@
+from face_recognition.bench import benchmark_face_distance
+
+
+def test_face_distance_benchmark_covers_every_representation():
+    results = benchmark_face_distance([50], {"min_repeat": 1, "min_time": 0.0})
+
+    assert [(result["stage"], result["params"].get("dtype") or result["params"]["metric"]) for result in results] == [
+        ("face_distance", "float32"), ("face_matcher_top_k", "euclidean"), ("face_matcher_top_k", "cosine"),
+        ("face_distance", "int8")]
+    assert all(result["params"]["gallery_size"] == 50 for result in results)
+    assert results[3]["params"]["gallery_bytes"] < results[0]["params"]["gallery_bytes"]
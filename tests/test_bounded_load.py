@@ -0,0 +1,65 @@
+import threading
+
+import PIL.Image
+import pytest
+
+import face_recognition
+
+
+def _save(tmp_path, name, size):
+    path = str(tmp_path / name)
+    PIL.Image.new("RGB", size, (200, 120, 40)).save(path)
+    return path
+
+
+def test_small_image_is_loaded_as_is(tmp_path):
+    image, scale = face_recognition.load_image_file_bounded(_save(tmp_path, "small.png", (40, 30)), 10000)
+    assert (image.shape, scale) == ((30, 40, 3), 1.0)
+
+
+def test_large_jpeg_is_shrunk_to_the_budget(tmp_path):
+    image, scale = face_recognition.load_image_file_bounded(_save(tmp_path, "large.jpg", (800, 600)), 120000)
+    assert image.shape[0] * image.shape[1] <= 120000
+    assert scale == pytest.approx(0.5, abs=0.01)
+
+
+def test_large_png_is_rejected_before_decoding(tmp_path, monkeypatch):
+    path = _save(tmp_path, "large.png", (800, 600))
+    loaded = []
+    monkeypatch.setattr(PIL.ImageFile.ImageFile, "load", lambda im: loaded.append(im))
+
+    with pytest.raises(PIL.Image.DecompressionBombError):
+        face_recognition.load_image_file_bounded(path, 120000)
+    assert loaded == []
+
+
+def test_bomb_limit_is_restored_under_concurrent_loads(tmp_path):
+    path = _save(tmp_path, "large.jpg", (400, 300))
+    limit = PIL.Image.MAX_IMAGE_PIXELS
+    errors = []
+
+    def load():
+        try:
+            for _ in range(20):
+                face_recognition.load_image_file_bounded(path, 30000)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=load) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert PIL.Image.MAX_IMAGE_PIXELS == limit
+
+
+def test_jpeg_too_large_even_at_an_eighth_is_rejected(tmp_path):
+    path = _save(tmp_path, "huge.jpg", (800, 600))
+
+    with pytest.raises(PIL.Image.DecompressionBombError, match="at most 8 times"):
+        face_recognition.load_image_file_bounded(path, 7000)
+    # Exactly 64 times over still fits at 1/8 scale
+    image, scale = face_recognition.load_image_file_bounded(path, 7500)
+    assert image.shape[0] * image.shape[1] <= 7500
@@ -0,0 +1,110 @@
+import pytest
+
+import face_logger_budget
+from face_logger_budget import BudgetController
+
+
+class FakeClock:
+    """Stands in for the time module: wall and CPU time only move when the test says so."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.cpu = 0.0
+
+    def perf_counter(self):
+        return self.now
+
+    def process_time(self):
+        return self.cpu
+
+    def advance(self, seconds, cpu=True):
+        self.now += seconds
+        if cpu:
+            self.cpu += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(face_logger_budget, "time", clock)
+    return clock
+
+
+def run_frames(controller, clock, detect_unit, frames, encode_per_face=0.01):
+    """Simulates frames with one face whose detection costs detect_unit seconds per full-scale frame."""
+    for _ in range(frames):
+        controller.start_frame()
+        level = controller.settings
+        detect_seconds = None
+        if controller.should_detect():
+            detect_seconds = detect_unit * level.scale * level.scale * 4 ** level.upsample
+            clock.advance(detect_seconds)
+        clock.advance(encode_per_face)
+        controller.end_frame(detect_seconds, encode_per_face, 1, 1 if detect_seconds is not None else None)
+
+
+def test_exactly_one_budget_is_required():
+    with pytest.raises(ValueError):
+        BudgetController()
+    with pytest.raises(ValueError):
+        BudgetController(frame_budget=0.1, cpu_share=0.5)
+
+
+def test_over_budget_steps_down_to_the_first_level_that_fits(clock):
+    controller = BudgetController(frame_budget=0.1, hold_seconds=1.0)
+    run_frames(controller, clock, 0.075, 1)
+    # Far over budget, but still within the hold time
+    assert controller.level == 0
+
+    run_frames(controller, clock, 0.075, 10)
+    # Level 1 (no upsampling) is predicted at 75 + 10 ms, so the controller doesn't go any further
+    assert controller.level == 1
+    assert controller.reason.startswith("over budget")
+    assert controller.predict(controller.levels[1]) == pytest.approx(0.085)
+
+    run_frames(controller, clock, 0.075, 50)
+    assert (controller.level, controller.changes) == (1, 1)
+
+
+def test_under_budget_steps_up_one_level_at_a_time(clock):
+    levels = []
+    controller = BudgetController(frame_budget=0.1, hold_seconds=1.0,
+                                  on_change=lambda controller: levels.append(controller.level))
+    controller.level = 3
+    run_frames(controller, clock, 0.01, 200)
+
+    assert levels == [2, 1, 0]
+    assert controller.reason.startswith("under budget")
+    state = controller.state()
+    assert (state["level"], state["changes"], state["scale"], state["upsample"]) == (0, 3, 1.0, 1)
+
+
+def test_stride_and_encode_rate(clock):
+    controller = BudgetController(frame_budget=0.1)
+    controller.level = 4 # detect every 2nd frame, at most 4 encodes per second
+    detected = []
+    for _ in range(4):
+        controller.start_frame()
+        detected.append(controller.should_detect())
+        controller.end_frame()
+    assert detected == [True, False, True, False]
+
+    assert controller.should_encode()
+    clock.advance(0.1)
+    assert not controller.should_encode()
+    clock.advance(0.2)
+    assert controller.should_encode()
+
+
+def test_cpu_share_pauses_to_stay_within_the_share(clock):
+    controller = BudgetController(cpu_share=0.5)
+    controller.cpus = 1
+    controller.start_frame()
+    clock.advance(0.1)
+    assert controller.end_frame() == 0.0
+
+    controller.start_frame()
+    clock.advance(0.1)
+    # 100 ms of CPU is a 50% share of 200 ms
+    assert controller.end_frame() == pytest.approx(0.1)
+    assert controller.measured_share == pytest.approx(0.5)
@@ -0,0 +1,84 @@
+import re
+
+import numpy as np
+import pytest
+
+import face_logger_gallery
+from face_logger_gallery import calibrate_gallery, load_gallery, load_thresholds, save_encoding
+from face_recognition.matcher import FaceMatcher, calibrate_thresholds
+
+
+def person(rng, centre, samples, spread):
+    return [centre + rng.normal(0, spread, 128).astype(np.float32) for _ in range(samples)]
+
+
+@pytest.fixture
+def gallery():
+    rng = np.random.RandomState(0)
+    encodings, names = [], []
+    for index in range(6):
+        centre = rng.normal(0, 0.09, 128).astype(np.float32)
+        encodings += person(rng, centre, 3, 0.01 + 0.005 * index)
+        names += ["person_{}".format(index)] * 3
+    return encodings, names
+
+
+def test_thresholds_follow_intra_distance(gallery):
+    encodings, names = gallery
+    calibration = calibrate_thresholds(encodings, names)
+
+    thresholds = [calibration["person_{}".format(i)]["threshold"] for i in range(6)]
+    assert thresholds == sorted(thresholds)
+    assert all(0.45 <= threshold <= 0.7 for threshold in thresholds)
+    assert calibration["person_0"]["templates"] == 3
+
+
+def test_lookalikes_never_accept_each_other(gallery):
+    encodings, names = gallery
+    rng = np.random.RandomState(1)
+    # A twin 0.3 away from person_0: min_tolerance (0.45) alone would let each accept the other
+    twin = encodings[0] + (rng.normal(0, 1, 128) * 0.3 / np.sqrt(128)).astype(np.float32)
+    encodings = encodings + [twin]
+    names = names + ["twin"]
+
+    with pytest.warns(UserWarning) as warned:
+        calibration = calibrate_thresholds(encodings, names)
+
+    assert sorted(re.search(r"from (\S+),", str(warning.message)).group(1) for warning in warned) == ["person_0", "twin"]
+
+    for name in ("person_0", "twin"):
+        assert calibration[name]["threshold"] <= calibration[name]["impostor"] - 0.05
+    matcher = FaceMatcher(encodings, names, thresholds=calibration)
+    assert matcher.best_match(twin + 0.001)[0] in ("twin", None)
+    assert matcher.best_match(encodings[1])[0] == "person_0"
+
+
+def test_incremental_calibration_matches_full(gallery):
+    encodings, names = gallery
+    previous = calibrate_thresholds(encodings[:-3], names[:-3])
+
+    incremental = calibrate_thresholds(encodings, names, previous=previous, changed_names=["person_5"])
+    full = calibrate_thresholds(encodings, names)
+
+    assert set(incremental) == set(full)
+    for name in full:
+        assert incremental[name]["impostor"] == pytest.approx(full[name]["impostor"], abs=1e-5)
+        assert incremental[name]["threshold"] == pytest.approx(full[name]["threshold"], abs=1e-5)
+
+
+def test_calibrate_gallery_reuses_the_loaded_gallery(gallery, tmp_path, monkeypatch):
+    monkeypatch.setattr(face_logger_gallery, "VAULT_PATH", None)
+    faces_dir = str(tmp_path / "faces")
+    encodings, names = gallery
+    for encoding, name in zip(encodings, names):
+        save_encoding(name, encoding, faces_dir)
+    calibrate_gallery(faces_dir)
+    loaded = load_gallery(faces_dir)
+
+    def read_again(*args, **kwargs):
+        raise AssertionError("the gallery was read again")
+    monkeypatch.setattr(face_logger_gallery, "load_gallery", read_again)
+    calibration = calibrate_gallery(faces_dir, changed_names=["person_2"], gallery=loaded)
+
+    assert load_thresholds(faces_dir) == calibration
+    assert set(calibration) == set(names)
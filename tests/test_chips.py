@@ -0,0 +1,138 @@
+import os
+
+import numpy as np
+import PIL.Image
+import pytest
+from click.testing import CliRunner
+
+import face_logger_chips
+from face_logger_chips import ChipArchive, audit_gallery, open_chip_archive, reencode_gallery
+from face_recognition import api
+
+
+def _chip(value, size=150):
+    rng = np.random.RandomState(value)
+    return np.clip(rng.normal(value, 20, (size, size, 3)), 0, 255).astype(np.uint8)
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "chips.pack")
+    writer = ChipArchive(path)
+    gray = _chip(50)[:, :, 0]
+    writer.append("alice/face_1.npy", _chip(100))
+    writer.append("bob/face_1.npy", gray)
+    writer.append("alice/face_1.npy", _chip(120))
+
+    reader = ChipArchive(path)
+    assert reader.keys() == ["alice/face_1.npy", "bob/face_1.npy"]
+    # The later record replaces the earlier one
+    np.testing.assert_array_equal(reader.read("alice/face_1.npy"), _chip(120))
+    np.testing.assert_array_equal(reader.read("bob/face_1.npy"), gray)
+    assert os.path.getsize(path) < 3 * 150 * 150 * 3
+
+    # Records appended since are picked up by the next scan
+    writer.append("carol/face_1.npy", _chip(140))
+    assert "carol/face_1.npy" in reader and len(reader) == 3
+
+
+@pytest.mark.parametrize("cut", [10, 200])
+def test_a_truncated_trailing_record_is_skipped_until_complete(tmp_path, cut):
+    path = str(tmp_path / "chips.pack")
+    ChipArchive(path).append("alice/face_1.npy", _chip(100))
+    complete = os.path.getsize(path)
+    ChipArchive(path).append("bob/face_1.npy", _chip(150))
+    with open(path, 'rb') as f:
+        data = f.read()
+    # A record still being written: only part of its header, or of its pixels, is in the file
+    with open(path, 'wb') as f:
+        f.write(data[:complete + cut])
+
+    archive = ChipArchive(path)
+    assert archive.keys() == ["alice/face_1.npy"]
+
+    with open(path, 'ab') as f:
+        f.write(data[complete + cut:])
+    assert archive.keys() == ["alice/face_1.npy", "bob/face_1.npy"]
+    np.testing.assert_array_equal(archive.read("bob/face_1.npy"), _chip(150))
+
+
+def test_garbage_is_reported_as_corrupt(tmp_path):
+    path = tmp_path / "chips.pack"
+    path.write_bytes(b"x" * 100)
+
+    with pytest.raises(ValueError, match="corrupt at byte 0"):
+        ChipArchive(str(path)).keys()
+
+
+@pytest.fixture
+def gallery(tmp_path, monkeypatch):
+    """A gallery of three encodings, two of them with archived chips, and an encoder that returns chip.mean()."""
+    class Encoder(object):
+        def compute_face_descriptor(self, chips, num_jitters=1):
+            return [np.full(128, chip.mean() / 255.0) for chip in chips]
+
+    monkeypatch.setattr(api, "face_encoder", Encoder())
+    monkeypatch.setattr(face_logger_chips, "VAULT_PATH", None)
+    calibrated = []
+    monkeypatch.setattr(face_logger_chips, "calibrate_gallery", lambda faces_dir: calibrated.append(faces_dir))
+
+    faces_dir = str(tmp_path / "faces")
+    archive = open_chip_archive(faces_dir)
+    for key, value in (("alice/face_1.npy", 60), ("alice/face_2.npy", 90), ("bob/face_1.npy", 200)):
+        os.makedirs(os.path.join(faces_dir, key.split("/")[0]), exist_ok=True)
+        np.save(os.path.join(faces_dir, *key.split("/")), np.zeros(128, dtype=np.float32))
+        if key != "alice/face_2.npy":
+            archive.append(key, _chip(value))
+    return faces_dir, calibrated
+
+
+def test_reencode_replaces_encodings_from_chips(gallery):
+    faces_dir, calibrated = gallery
+
+    count, missing = reencode_gallery(faces_dir, show_progress=False)
+
+    assert (count, missing) == (2, ["alice/face_2.npy"])
+    assert calibrated == [faces_dir]
+    archive = open_chip_archive(faces_dir)
+    for key in ("alice/face_1.npy", "bob/face_1.npy"):
+        np.testing.assert_allclose(np.load(os.path.join(faces_dir, key)), archive.read(key).mean() / 255.0,
+                                   rtol=1e-6)
+    np.testing.assert_array_equal(np.load(os.path.join(faces_dir, "alice", "face_2.npy")), 0)
+
+
+def test_audit_measures_drift_from_the_stored_encodings(gallery):
+    faces_dir, _ = gallery
+
+    before = {row["key"]: row for row in audit_gallery(faces_dir)}
+    reencode_gallery(faces_dir, show_progress=False)
+    after = {row["key"]: row for row in audit_gallery(faces_dir)}
+
+    assert sorted(before) == ["alice/face_1.npy", "bob/face_1.npy"]
+    assert before["bob/face_1.npy"]["drift"] > 5
+    assert [row["drift"] for row in after.values()] == [0.0, 0.0]
+    assert after["bob/face_1.npy"]["spread"] == 0.0 # bob's only encoding
+    assert after["bob/face_1.npy"]["brightness"] > after["alice/face_1.npy"]["brightness"]
+
+
+def test_export_writes_each_chip_as_a_png(gallery, tmp_path):
+    faces_dir, _ = gallery
+    output_dir = str(tmp_path / "review")
+
+    result = CliRunner().invoke(face_logger_chips.cli, ["--faces-dir", faces_dir, "export", output_dir])
+
+    assert result.exit_code == 0, result.output
+    exported = np.array(PIL.Image.open(os.path.join(output_dir, "bob", "face_1.png")))
+    np.testing.assert_array_equal(exported, open_chip_archive(faces_dir).read("bob/face_1.npy"))
+    assert not os.path.exists(os.path.join(output_dir, "alice", "face_2.png"))
+
+
+@pytest.mark.parametrize("command", ["reencode", "audit"])
+def test_vault_galleries_are_refused(gallery, monkeypatch, command):
+    faces_dir, _ = gallery
+    monkeypatch.setattr(face_logger_chips, "VAULT_PATH", "gallery.vault")
+
+    result = CliRunner().invoke(face_logger_chips.cli, ["--faces-dir", faces_dir, command])
+
+    assert result.exit_code == 2
+    assert "FACE_LOGGER_VAULT" in result.output
+    np.testing.assert_array_equal(np.load(os.path.join(faces_dir, "bob", "face_1.npy")), 0)
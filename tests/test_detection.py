@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from face_recognition import api
+from test_pipeline import FakeRect
+
+
+def _paint(height, width, faces):
+    """A black image with each face a square of its own grey level, from 200 up."""
+    img = np.zeros((height, width, 3), dtype=np.uint8)
+    for i, (top, right, bottom, left) in enumerate(faces):
+        img[top:bottom, left:right] = 200 + i
+    return img
+
+
+def _boxes(channel):
+    """The visible part of each painted face, in css order."""
+    boxes = []
+    for value in np.unique(channel[channel >= 200]):
+        rows, cols = np.nonzero(channel == value)
+        boxes.append((int(rows.min()), int(cols.max()) + 1, int(rows.max()) + 1, int(cols.min())))
+    return boxes
+
+
+class FakeCascade(object):
+    def __init__(self, false_positives=()):
+        self.false_positives = list(false_positives)
+
+    def detectMultiScale(self, gray, scaleFactor, minNeighbors, minSize):
+        return [(left, top, right - left, bottom - top) for top, right, bottom, left in _boxes(gray)] + \
+            self.false_positives
+
+
+@pytest.fixture
+def detector(monkeypatch):
+    """HOG 'finds' every painted face, or the part of it inside the image it is given."""
+    def detect(img, number_of_times_to_upsample=1):
+        return [FakeRect(left, top, right, bottom) for top, right, bottom, left in _boxes(img[..., 0])]
+
+    monkeypatch.setattr(api, "face_detector", detect)
+    cascade = FakeCascade()
+    monkeypatch.setattr(api, "_haar_cascade", lambda cascade_file=None: cascade)
+    return cascade
+
+
+@pytest.mark.parametrize("regions, expected", [
+    ([(0, 50, 50, 0), (100, 150, 150, 100)], [(0, 50, 50, 0), (100, 150, 150, 100)]),
+    ([(0, 50, 50, 0), (40, 80, 90, 30)], [(0, 80, 90, 0)]),
+    ([(0, 100, 100, 0), (20, 60, 60, 20)], [(0, 100, 100, 0)]),
+    # Only joined through the middle one
+    ([(0, 30, 30, 0), (100, 130, 130, 100), (20, 110, 110, 20)], [(0, 130, 130, 0)]),
+    # Touching edges share no pixel
+    ([(0, 50, 50, 0), (0, 100, 50, 50)], [(0, 50, 50, 0), (0, 100, 50, 50)]),
+])
+def test_merge_regions(regions, expected):
+    assert api._merge_regions(regions) == expected
+
+
+@pytest.mark.parametrize("cascade_scale", [0.5, 0.3, 0.25])
+def test_cascade_boxes_are_mapped_back_to_the_full_image(detector, cascade_scale):
+    faces = [(101, 263, 181, 183), (301, 587, 391, 497)]
+    img = _paint(480, 640, faces)
+
+    assert sorted(api.cascade_face_locations(img, cascade_scale=cascade_scale)) == faces
+
+
+def test_haar_hog_agrees_with_hog(detector):
+    faces = [(40, 140, 120, 60), (300, 500, 380, 420)]
+    img = _paint(480, 640, faces)
+    # A proposal the detector does not confirm
+    detector.false_positives.append((200, 20, 30, 30))
+    timings = {}
+
+    assert sorted(api.face_locations(img, model="haar+hog")) == sorted(api.face_locations(img)) == faces
+    assert sorted(api.cascade_face_locations(img, timings=timings)) == faces
+    assert timings["proposals"] == 3
+
+
+def test_overlapping_proposals_are_verified_once(detector):
+    faces = [(100, 180, 180, 100), (100, 280, 180, 200)]
+    timings = {}
+
+    assert sorted(api.cascade_face_locations(_paint(480, 640, faces), timings=timings)) == faces
+    assert timings["proposals"] == 1
+
+
+def test_tiles_join_faces_cut_by_their_edges(detector):
+    faces = [
+        (100, 550, 180, 450), # Cut by one tile's edge, whole in the next
+        (300, 600, 420, 300), # Wider than the overlap, so cut in every tile
+        (700, 480, 780, 400), # Whole in four overlapping tiles
+    ]
+    img = _paint(1000, 1000, faces)
+
+    assert sorted(api.tiled_face_locations(img, tile_size=512, tile_overlap=128)) == sorted(faces)
+    assert sorted(api.tiled_face_locations(img, tile_size=512, tile_overlap=128)) == sorted(api.face_locations(img))
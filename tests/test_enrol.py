@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+import PIL.Image
+import pytest
+
+import face_logger_enrol
+from face_logger_enrol import encode_enrolment_image, enrol_directory
+from face_logger_gallery import load_gallery
+from face_recognition import api, pipeline
+from test_pipeline import FakeLandmarks, FakeRect
+
+
+@pytest.fixture
+def faces(monkeypatch):
+    """Fake dlib models. Append (left, top, right, bottom) boxes to the returned list to 'detect' faces."""
+    boxes = []
+
+    def detect(image, number_of_times_to_upsample, model):
+        return [FakeRect(*box) for box in boxes]
+
+    def predict(image, rect):
+        return FakeLandmarks([(rect.left() + i, rect.top() + i) for i in range(68)])
+
+    def face_chips(image, landmarks, size=150, padding=0.25):
+        return [np.full((size, size, 3), 7, dtype=np.uint8) for _ in landmarks]
+
+    class Encoder(object):
+        def compute_face_descriptor(self, chips, num_jitters=1):
+            return [np.full(128, 0.1, dtype=np.float64) for _ in chips]
+
+    monkeypatch.setattr(api, "_raw_face_locations", detect)
+    monkeypatch.setattr(api, "pose_predictor_5_point", predict)
+    monkeypatch.setattr(api, "pose_predictor_68_point", predict)
+    monkeypatch.setattr(api, "face_encoder", Encoder())
+    monkeypatch.setattr(pipeline.dlib, "get_face_chips", face_chips)
+    return boxes
+
+
+def _photo(path, size=(200, 200), sharp=True):
+    if sharp:
+        pixels = np.random.RandomState(0).randint(0, 256, (size[1], size[0], 3)).astype(np.uint8)
+    else:
+        pixels = np.full((size[1], size[0], 3), 128, dtype=np.uint8)
+    PIL.Image.fromarray(pixels).save(str(path))
+    return str(path)
+
+
+def _task(image_path, max_size=800, min_face_size=60, min_sharpness=20.0):
+    return "alice", image_path, max_size, min_face_size, min_sharpness, 1, None, False
+
+
+def test_sharp_single_face_is_encoded(tmp_path, faces):
+    faces.append((20, 20, 120, 120))
+    name, path, encoding, error, _ = encode_enrolment_image(_task(_photo(tmp_path / "a.png")))
+    assert error is None
+    np.testing.assert_allclose(encoding, 0.1, rtol=1e-6)
+
+
+@pytest.mark.parametrize("boxes, sharp, expected", [
+    ([], True, "no face found"),
+    ([(20, 20, 120, 120), (130, 20, 190, 80)], True, "2 faces found"),
+    ([(20, 20, 60, 60)], True, "face too small (40px)"),
+    ([(20, 20, 120, 120)], False, "image too blurry (sharpness 0.0)"),
+])
+def test_quality_gates(tmp_path, faces, boxes, sharp, expected):
+    faces.extend(boxes)
+    _, _, encoding, error, _ = encode_enrolment_image(_task(_photo(tmp_path / "a.png", sharp=sharp)))
+    assert (encoding, error) == (None, expected)
+
+
+def test_face_size_is_measured_on_the_original_photo(tmp_path, faces):
+    # Shrunk from 400 to 200 pixels for detection, so this 40 pixel box is an 80 pixel face
+    faces.append((20, 20, 60, 60))
+    _, _, encoding, error, _ = encode_enrolment_image(_task(_photo(tmp_path / "a.png", (400, 400)), max_size=200))
+    assert error is None
+
+
+def test_huge_photo_is_rejected_without_decoding(tmp_path, faces, monkeypatch):
+    monkeypatch.setattr(face_logger_enrol, "MAX_DECODE_PIXELS", 10000)
+    faces.append((20, 20, 120, 120))
+    _, _, encoding, error, _ = encode_enrolment_image(_task(_photo(tmp_path / "a.png")))
+    assert encoding is None
+    assert error.startswith("DecompressionBombError")
+
+
+def test_parent_saves_and_calibrates(tmp_path, faces, monkeypatch):
+    faces.append((20, 20, 120, 120))
+    root = tmp_path / "photos"
+    for person in ("alice", "bob"):
+        os.makedirs(str(root / person))
+        _photo(root / person / "1.png")
+    _photo(root / "bob" / "blurry.png", sharp=False)
+    calibrated = []
+    monkeypatch.setattr(face_logger_enrol, "calibrate_gallery",
+                        lambda faces_dir, changed_names: calibrated.append((faces_dir, changed_names)))
+
+    faces_dir = str(tmp_path / "faces")
+    enrolled, errors = enrol_directory(str(root), faces_dir, processes=1, show_progress=False)
+
+    assert enrolled == 2
+    assert [(os.path.basename(path), error) for path, error in errors] == [
+        ("blurry.png", "image too blurry (sharpness 0.0)")]
+    assert sorted(load_gallery(faces_dir, plain=True)[1]) == ["alice", "bob"]
+    assert calibrated == [(faces_dir, ["alice", "bob"])]
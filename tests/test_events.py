@@ -0,0 +1,30 @@
+import json
+import socket
+import time
+
+from face_logger_events import EventPublisher
+
+
+def _subscribe(publisher):
+    host, port = publisher._listener.getsockname()
+    connection = socket.create_connection((host, port), timeout=5.0)
+    deadline = time.time() + 5.0
+    while publisher.subscriber_count == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    return connection.makefile("rb")
+
+
+def test_events_carry_the_camera():
+    publisher = EventPublisher("127.0.0.1:0", camera="server")
+    try:
+        events = _subscribe(publisher)
+        publisher.publish("Alice", 0.31, (10, 60, 60, 10), camera=0)
+        publisher.publish("Bob")
+        publisher.publish_status("budget", {"scale": 0.5}, camera=2)
+
+        assert json.loads(events.readline())["camera"] == 0
+        assert json.loads(events.readline())["camera"] == "server"
+        status = json.loads(events.readline())
+        assert (status["camera"], status["type"], status["scale"]) == (2, "budget", 0.5)
+    finally:
+        publisher.close()
@@ -0,0 +1,37 @@
+import os
+
+import numpy as np
+
+import face_logger_gallery
+from face_logger_gallery import load_gallery, save_encoding
+from face_recognition.matcher import FaceMatcher
+from face_recognition.quantize import QuantizedGallery
+
+
+def test_save_encoding_never_overwrites(tmp_path):
+    faces_dir = str(tmp_path / "faces")
+    paths = [save_encoding("Alice", np.full(128, i, dtype=np.float64), faces_dir) for i in range(3)]
+
+    assert [os.path.basename(path) for path in paths] == ["face_1.npy", "face_2.npy", "face_3.npy"]
+    assert np.load(paths[2]).dtype == np.float32
+    assert not [name for name in os.listdir(os.path.dirname(paths[0])) if name.startswith(".tmp")]
+
+
+def test_load_gallery_can_quantize(tmp_path, monkeypatch):
+    monkeypatch.setattr(face_logger_gallery, "VAULT_PATH", None)
+    faces_dir = str(tmp_path / "faces")
+    rng = np.random.RandomState(0)
+    for name in ("Alice", "Bob"):
+        for _ in range(2):
+            save_encoding(name, rng.normal(0, 0.1, 128), faces_dir)
+
+    encodings, names = load_gallery(faces_dir)
+    quantized, quantized_names = load_gallery(faces_dir, quantize=True)
+
+    assert isinstance(quantized, QuantizedGallery)
+    # Calibrated for the tolerance it is matched at
+    assert list(quantized.thresholds) == [0.6]
+    assert list(load_gallery(faces_dir, quantize=True, tolerance=0.5)[0].thresholds) == [0.5]
+    assert sorted(quantized_names) == sorted(names) == ["Alice", "Alice", "Bob", "Bob"]
+    matcher = FaceMatcher(quantized, quantized_names)
+    assert matcher.best_match(encodings[0])[0] == names[0]
@@ -0,0 +1,97 @@
+import dlib
+import numpy as np
+import pytest
+
+from face_recognition import api, jitter
+from face_recognition.jitter import jittered_face_encodings
+
+
+def _descriptor(chip):
+    """The mean of each of 128 horizontal bands of the chip."""
+    return np.array([band.mean() / 255.0 for band in np.array_split(chip.astype(np.float64), 128)])
+
+
+class FakeEncoder(object):
+    """Encodes like dlib: a list of chips one by one, or a face in an image averaged over num_jitters copies."""
+
+    def __init__(self, busy=None):
+        self.busy = busy
+
+    def compute_face_descriptor(self, image, landmarks_or_jitters=1, num_jitters=1):
+        if self.busy is not None:
+            assert self not in self.busy, "encoder used by two threads at once"
+            self.busy.add(self)
+        try:
+            if isinstance(image, list):
+                return [_descriptor(chip) for chip in image]
+            chip = dlib.get_face_chip(image, landmarks_or_jitters)
+            if num_jitters <= 1:
+                return _descriptor(chip)
+            return np.mean([_descriptor(copy) for copy in dlib.jitter_image(chip, num_jitters)], axis=0)
+        finally:
+            if self.busy is not None:
+                self.busy.discard(self)
+
+
+@pytest.fixture
+def fake_dlib(monkeypatch):
+    """Jitters shift a chip by up to 2 pixels, drawn from a seeded generator."""
+    rng = np.random.RandomState(0)
+
+    def jitter_image(img, num_jitters=1, disturb_colors=False):
+        return [np.roll(img, tuple(rng.randint(-2, 3, 2)), axis=(0, 1)) for _ in range(num_jitters)]
+
+    monkeypatch.setattr(dlib, "jitter_image", jitter_image)
+    monkeypatch.setattr(dlib, "get_face_chip", lambda image, landmarks, size=150, padding=0.25: image)
+    monkeypatch.setattr(api, "_raw_face_landmarks", lambda image, locations, model: [None] * len(locations))
+    monkeypatch.setattr(api, "face_encoder", FakeEncoder())
+    return rng
+
+
+def _chip(seed):
+    # Smooth and periodic, so a small shift changes the encoding a little
+    rng = np.random.RandomState(seed)
+    rows = 128 + sum(rng.uniform(10, 30) * np.sin(2 * np.pi * k * np.arange(150) / 150 + rng.uniform(0, 6.3))
+                     for k in (1, 2, 3))
+    return np.repeat(rows[:, np.newaxis, np.newaxis], 150, axis=1).repeat(3, axis=2).astype(np.uint8)
+
+
+def test_matches_serial_face_encodings(fake_dlib):
+    chips = [_chip(1), _chip(2)]
+
+    serial = [api.face_encodings(chip, [(0, 150, 150, 0)], num_jitters=40)[0] for chip in chips]
+    batched, counts = jittered_face_encodings(chips, num_jitters=40)
+
+    assert counts == [40, 40]
+    for a, b in zip(serial, batched):
+        # Different random jitters, so only equal within sampling noise, well inside the 0.6 match tolerance
+        assert np.linalg.norm(a - b) < 0.1
+    assert np.linalg.norm(batched[0] - batched[1]) > 0.6
+
+
+def test_stable_faces_stop_early(fake_dlib):
+    # Shifting a flat chip changes nothing, so its mean stops moving after the second round
+    flat = np.full((150, 150, 3), 90, dtype=np.uint8)
+
+    encodings, counts = jittered_face_encodings([flat, _chip(1)], num_jitters=40, chunk_size=5, convergence=1e-6)
+
+    assert counts[0] == 10
+    assert counts[1] > 10
+    np.testing.assert_allclose(encodings[0], 90 / 255.0, rtol=1e-6)
+    # Without convergence every face gets every jitter
+    assert jittered_face_encodings([flat, _chip(1)], num_jitters=40, chunk_size=5)[1] == [40, 40]
+
+
+def test_each_thread_encodes_with_its_own_encoder(fake_dlib, monkeypatch):
+    busy = set()
+    monkeypatch.setattr(jitter.dlib, "face_recognition_model_v1", lambda model: FakeEncoder(busy))
+    monkeypatch.setattr(api, "face_encoder", FakeEncoder(busy))
+    chips = [_chip(seed) for seed in range(8)]
+
+    fake_dlib.seed(3)
+    serial, _ = jittered_face_encodings(chips, num_jitters=10)
+    fake_dlib.seed(3)
+    threaded, _ = jittered_face_encodings(chips, num_jitters=10, threads=4)
+
+    np.testing.assert_allclose(threaded, serial)
+    assert busy == set()
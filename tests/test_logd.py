@@ -0,0 +1,131 @@
+import csv
+import json
+import socket
+import threading
+from datetime import datetime
+
+import face_logger_logd
+from face_logger_logd import LogClient, LogDaemon, LogWriter, append_log_rows, init_log_file
+from face_logger_store import EventStore
+
+
+def _start_daemon(tmp_path, db_path=None):
+    daemon = LogDaemon("127.0.0.1:0", str(tmp_path / "logs.csv"), db_path)
+    thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    thread.start()
+    host, port = daemon.server.server_address
+    return daemon, thread, f"{host}:{port}"
+
+
+def _read_log(path):
+    with open(path, newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_daemon_writes_before_acknowledging(tmp_path):
+    db_path = str(tmp_path / "events.db")
+    daemon, thread, address = _start_daemon(tmp_path, db_path)
+    client = LogClient(address, str(tmp_path / "fallback.csv"), camera=2)
+    try:
+        client.write("Alice", "Recognized", datetime(2024, 5, 2, 8, 0, 0))
+        client.write("Bob", "Recognized", datetime(2024, 5, 2, 8, 0, 1), camera=3)
+        # Acknowledged rows are already in the file
+        assert _read_log(tmp_path / "logs.csv")[1:] == [["2024-05-02 08:00:00", "Alice", "Recognized"],
+                                                        ["2024-05-02 08:00:01", "Bob", "Recognized"]]
+    finally:
+        client.close()
+        daemon.shutdown()
+        thread.join()
+
+    assert _read_log(tmp_path / "fallback.csv")[1:] == []
+    with EventStore(db_path) as store:
+        assert [row[1:] for row in store.first_in_last_out()] == [
+            ("Alice", "2024-05-02 08:00:00", "2024-05-02 08:00:00", 1),
+            ("Bob", "2024-05-02 08:00:01", "2024-05-02 08:00:01", 1)]
+        assert store.first_in_last_out(camera="3")[0][1] == "Bob"
+
+
+def test_rows_sent_after_the_daemon_stops_are_not_lost(tmp_path):
+    daemon, thread, address = _start_daemon(tmp_path)
+    client = LogClient(address, str(tmp_path / "fallback.csv"), timeout=0.5)
+    try:
+        client.write("Alice", "Recognized", datetime(2024, 5, 2, 8, 0, 0))
+        daemon.shutdown()
+        thread.join()
+        # The connection is still open, so this send succeeds, but nothing writes or acknowledges it
+        client.write("Bob", "Recognized", datetime(2024, 5, 2, 8, 0, 1))
+    finally:
+        client.close()
+
+    assert _read_log(tmp_path / "logs.csv")[1:] == [["2024-05-02 08:00:00", "Alice", "Recognized"]]
+    assert _read_log(tmp_path / "fallback.csv")[1:] == [["2024-05-02 08:00:01", "Bob", "Recognized"]]
+
+
+def test_log_writer_records_each_event_once(tmp_path):
+    with EventStore(str(tmp_path / "events.db")) as store:
+        writer = LogWriter(str(tmp_path / "logs.csv"), store)
+        writer.write("Alice", "Recognized", datetime(2024, 5, 2, 8, 0, 0), camera=0)
+        writer.write("Alice", "Recognized", datetime(2024, 5, 2, 9, 0, 0), camera=0)
+
+        assert store.first_in_last_out(camera="0") == [("2024-05-02", "Alice", "2024-05-02 08:00:00",
+                                                        "2024-05-02 09:00:00", 2)]
+    assert len(_read_log(tmp_path / "logs.csv")) == 3
+
+
+def _send(connection, replies, event):
+    connection.sendall((json.dumps(event) + "\n").encode("utf-8"))
+    return replies.readline()
+
+
+def test_malformed_events_are_refused_without_stopping_the_writer(tmp_path):
+    daemon, thread, address = _start_daemon(tmp_path, str(tmp_path / "events.db"))
+    host, port = daemon.server.server_address
+    connection = socket.create_connection((host, port), timeout=5.0)
+    replies = connection.makefile("rb")
+    try:
+        bogus = {"timestamp": "bogus", "name": "Eve", "status": "Recognized"}
+        assert _send(connection, replies, bogus) == b"error\n"
+        assert _send(connection, replies, {"name": "Eve", "status": "Recognized"}) == b"error\n"
+        assert _send(connection, replies, ["not", "an", "event"]) == b"error\n"
+        assert _send(connection, replies, {"timestamp": "2024-05-02 08:00:00", "name": "Alice",
+                                           "status": "Recognized"}) == b"ok\n"
+    finally:
+        replies.close()
+        connection.close()
+        daemon.shutdown()
+        thread.join()
+
+    assert _read_log(tmp_path / "logs.csv")[1:] == [["2024-05-02 08:00:00", "Alice", "Recognized"]]
+
+
+def test_a_failed_write_fails_only_its_batch(tmp_path, monkeypatch):
+    failures = [OSError("disk full")]
+
+    def append_or_fail(log_file, rows):
+        if failures:
+            raise failures.pop()
+        append_log_rows(log_file, rows)
+
+    monkeypatch.setattr(face_logger_logd, "append_log_rows", append_or_fail)
+    daemon, thread, address = _start_daemon(tmp_path)
+    client = LogClient(address, str(tmp_path / "fallback.csv"))
+    try:
+        # Refused by the daemon, resent and written by the daemon the second time
+        client.write("Alice", "Recognized", datetime(2024, 5, 2, 8, 0, 0))
+        client.write("Bob", "Recognized", datetime(2024, 5, 2, 8, 0, 1))
+    finally:
+        client.close()
+        daemon.shutdown()
+        thread.join()
+
+    assert [row[1] for row in _read_log(tmp_path / "logs.csv")[1:]] == ["Alice", "Bob"]
+    assert daemon.events_written == 2
+
+
+def test_header_is_written_once_and_first(tmp_path):
+    log_file = str(tmp_path / "logs.csv")
+    init_log_file(log_file)
+    append_log_rows(log_file, [["2024-05-02 08:00:00", "Alice", "Recognized"]])
+    init_log_file(log_file)
+
+    assert _read_log(log_file) == [["Timestamp", "Name", "Status"], ["2024-05-02 08:00:00", "Alice", "Recognized"]]
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import face_recognition
+from face_recognition.matcher import FaceMatcher
+
+
+@pytest.fixture
+def gallery():
+    rng = np.random.RandomState(0)
+    encodings = rng.normal(0, 0.1, (50, 128)).astype(np.float32)
+    names = ["person_{}".format(i // 2) for i in range(50)]
+    return encodings, names
+
+
+def test_distances_match_face_distance(gallery):
+    encodings, names = gallery
+    probe = encodings[7] + 0.01
+
+    matcher = FaceMatcher(encodings, names)
+
+    np.testing.assert_allclose(matcher.face_distance(probe), face_recognition.face_distance(encodings, probe),
+                               atol=1e-5)
+    assert matcher.face_distance(np.stack([probe, probe])).shape == (2, 50)
+
+
+def test_top_k_and_best_match(gallery):
+    encodings, names = gallery
+    probes = np.stack([encodings[7] + 0.001, encodings[20] + 0.001])
+
+    matcher = FaceMatcher(encodings, names)
+    top = matcher.top_k(probes, k=3)
+
+    assert [candidates[0][:2] for candidates in top] == [(7, "person_3"), (20, "person_10")]
+    assert all(len(candidates) == 3 for candidates in top)
+    assert [d for _, _, d in top[0]] == sorted(d for _, _, d in top[0])
+    assert matcher.best_match(probes[0])[0] == "person_3"
+    assert matcher.best_match(probes[0] + 1.0)[0] is None
+
+
+def test_cosine_ranks_by_angle(gallery):
+    encodings, names = gallery
+    matcher = FaceMatcher(encodings, names, metric="cosine")
+
+    # Scaling a probe changes its euclidean distance but not its angle
+    assert matcher.top_k(encodings[11] * 3, k=1)[0][0] == 11
+    assert matcher.best_match(encodings[11] * 1.0001)[0] == "person_5"
+    assert 0 < matcher.tolerance_to_similarity(0.6) < 1
+
+
+def test_per_person_thresholds(gallery):
+    encodings, names = gallery
+    probe = encodings[0] + 0.02
+    distance = float(np.linalg.norm(encodings[0] - probe))
+
+    matcher = FaceMatcher(encodings, names, thresholds={"person_0": {"threshold": distance / 2}})
+
+    assert matcher.best_match(probe, tolerance=0.6)[0] is None
+    assert not matcher.compare_faces(probe, tolerance=0.6)[0]
+    assert FaceMatcher(encodings, names).best_match(probe, tolerance=0.6)[0] == "person_0"
+
+
+def test_empty_gallery():
+    matcher = FaceMatcher([], [])
+
+    assert len(matcher) == 0
+    assert matcher.best_match(np.zeros(128)) == (None, None)
+    assert matcher.top_k(np.zeros(128), 3) == []
@@ -0,0 +1,133 @@
+import collections
+
+import numpy as np
+import pytest
+
+from face_recognition import api, pipeline
+from face_recognition.pipeline import FacePipeline
+
+Point = collections.namedtuple("Point", ["x", "y"])
+
+
+class FakeLandmarks(object):
+    def __init__(self, points):
+        self._points = [Point(x, y) for x, y in points]
+
+    def parts(self):
+        return self._points
+
+
+class FakeRect(object):
+    def __init__(self, left, top, right, bottom):
+        self._box = (left, top, right, bottom)
+
+    def left(self):
+        return self._box[0]
+
+    def top(self):
+        return self._box[1]
+
+    def right(self):
+        return self._box[2]
+
+    def bottom(self):
+        return self._box[3]
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Replaces the dlib models used by the pipeline with fakes and counts how often each one runs."""
+    calls = collections.Counter()
+
+    def detect(image, number_of_times_to_upsample, model):
+        calls["detect"] += 1
+        calls["detect_" + ("gray" if image.ndim == 2 else "color")] += 1
+        return [FakeRect(10, 20, 50, 60), FakeRect(100, 20, 140, 60)]
+
+    def predict_5(image, rect):
+        calls["landmarks_5"] += 1
+        return FakeLandmarks([(rect.left() + i, rect.top() + i) for i in range(5)])
+
+    def predict_68(image, rect):
+        calls["landmarks_68"] += 1
+        return FakeLandmarks([(rect.left() + i, rect.top() + 2 * i) for i in range(68)])
+
+    def face_chips(image, landmarks, size=150, padding=0.25):
+        calls["chips"] += 1
+        chip = np.zeros((size, size, 3), dtype=np.uint8)
+        chip[:, :, 0] = 1
+        chip[:, :, 2] = 3
+        return [chip.copy() for _ in landmarks]
+
+    class Encoder(object):
+        def compute_face_descriptor(self, chips, num_jitters=1):
+            calls["encode"] += 1
+            return [np.full(128, chip[0, 0, 0], dtype=np.float64) for chip in chips]
+
+    monkeypatch.setattr(api, "_raw_face_locations", detect)
+    monkeypatch.setattr(api, "pose_predictor_5_point", predict_5)
+    monkeypatch.setattr(api, "pose_predictor_68_point", predict_68)
+    monkeypatch.setattr(api, "face_encoder", Encoder())
+    monkeypatch.setattr(pipeline.dlib, "get_face_chips", face_chips)
+    return calls
+
+
+def test_every_stage_runs_once(calls):
+    face_pipeline = FacePipeline(np.zeros((100, 200, 3), dtype=np.uint8))
+
+    assert face_pipeline.face_locations == [(20, 50, 60, 10), (20, 140, 60, 100)]
+    encodings = face_pipeline.face_encodings()
+    face_pipeline.face_encodings()
+    face_pipeline.face_chips()
+    assert face_pipeline.face_locations == [(20, 50, 60, 10), (20, 140, 60, 100)]
+
+    assert len(encodings) == 2
+    assert all(encoding.dtype == np.float32 for encoding in encodings)
+    assert calls["detect"] == 1
+    assert calls["landmarks_5"] == 2
+    assert calls["chips"] == 1
+    assert calls["encode"] == 1
+    # Encoding never needs the 68 point model
+    assert calls["landmarks_68"] == 0
+
+
+def test_known_face_locations_skip_detection(calls):
+    face_pipeline = FacePipeline(np.zeros((100, 200, 3), dtype=np.uint8), known_face_locations=[(20, 50, 60, 10)])
+
+    assert len(face_pipeline.face_encodings()) == 1
+    assert calls["detect"] == 0
+
+
+def test_bgr_frames_only_reorder_the_chips(calls):
+    frame = np.zeros((100, 200, 3), dtype=np.uint8)
+    gray = np.zeros((100, 200), dtype=np.uint8)
+    face_pipeline = FacePipeline(frame, detection_image=gray, channel_order="BGR")
+
+    chips = face_pipeline.face_chips()
+    encodings = face_pipeline.face_encodings()
+
+    assert calls["detect_gray"] == 1
+    assert chips[0][0, 0].tolist() == [3, 0, 1]
+    assert encodings[0][0] == 3
+
+
+def test_invalid_channel_order():
+    with pytest.raises(ValueError):
+        FacePipeline(np.zeros((10, 10, 3), dtype=np.uint8), channel_order="BGRA")
+
+
+def test_landmarks_array_matches_dicts(calls):
+    face_pipeline = FacePipeline(np.zeros((100, 200, 3), dtype=np.uint8))
+
+    points = face_pipeline.face_landmarks_array()
+    dicts = face_pipeline.face_landmarks()
+
+    assert points.shape == (2, 68, 2)
+    assert points.dtype == np.int32
+    assert calls["landmarks_68"] == 2
+    assert dicts[1]["chin"] == [tuple(point) for point in points[1, :17].tolist()]
+    assert face_pipeline.face_landmarks_array("small").shape == (2, 5, 2)
+
+
+def test_raw_landmarks_to_array_empty():
+    assert api._raw_landmarks_to_array([], 68).shape == (0, 68, 2)
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from face_recognition.matcher import FaceMatcher
+from face_recognition.quantize import QuantizedGallery, match_agreement
+
+
+def synthetic_gallery(people=200, samples=3, seed=0):
+    """Random identities with a few noisy samples each, scaled like dlib encodings."""
+    rng = np.random.RandomState(seed)
+    centres = rng.normal(0, 0.09, (people, 128)).astype(np.float32)
+    encodings = np.repeat(centres, samples, axis=0) + rng.normal(0, 0.02, (people * samples, 128)).astype(np.float32)
+    names = ["person_{}".format(i) for i in range(people) for _ in range(samples)]
+    return centres, encodings.astype(np.float32), names
+
+
+def probes_around_threshold(centres, count=2000, seed=1):
+    """Probes whose distance to their nearest identity is spread over 0.3 - 0.9, so many sit near 0.6."""
+    rng = np.random.RandomState(seed)
+    noise = rng.normal(0, 1, (count, 128)).astype(np.float32)
+    noise *= (rng.uniform(0.3, 0.9, count) / np.linalg.norm(noise, axis=1))[:, np.newaxis]
+    return centres[rng.randint(len(centres), size=count)] + noise
+
+
+def test_quantized_matcher_keeps_match_decisions():
+    centres, encodings, names = synthetic_gallery()
+    probes = probes_around_threshold(centres)
+
+    exact = FaceMatcher(encodings, names)
+    quantized = FaceMatcher(encodings, names, quantize=True)
+
+    exact_decisions = [exact.best_match(probe, 0.6)[0] for probe in probes]
+    quantized_decisions = [quantized.best_match(probe, 0.6)[0] for probe in probes]
+    changed = sum(a != b for a, b in zip(exact_decisions, quantized_decisions))
+
+    assert quantized.quantized is not None and quantized.encodings is None
+    assert changed <= len(probes) * 0.005
+    assert len(set(exact_decisions)) > 2 # Probes fall both inside and outside the tolerance
+
+
+def test_calibrated_gallery_agrees_with_exact_distances():
+    centres, encodings, names = synthetic_gallery()
+    gallery = QuantizedGallery.from_encodings(encodings)
+    gallery.calibrate(encodings, tolerance=0.6)
+
+    assert abs(gallery.threshold(0.6) - 0.6) < 0.01
+    assert match_agreement(encodings, gallery, probes_around_threshold(centres), 0.6, names) >= 0.995
+    np.testing.assert_allclose(gallery.face_distance(encodings[0]),
+                               np.linalg.norm(encodings - encodings[0], axis=1), atol=0.01)
+
+
+def test_calibration_memory_is_bounded():
+    centres, encodings, names = synthetic_gallery()
+    gallery = QuantizedGallery.from_encodings(encodings)
+
+    # Even with a handful of samples the threshold stays within the window around the tolerance
+    threshold = gallery.calibrate(encodings, tolerance=0.6, max_samples=64)
+    assert 0.55 <= threshold <= 0.65
+
+
+def test_quantized_matcher_uses_the_calibrated_threshold():
+    centres, encodings, names = synthetic_gallery(people=10)
+    gallery = QuantizedGallery.from_encodings(encodings)
+    gallery.thresholds[0.6] = 0.61
+
+    matcher = FaceMatcher(gallery, names)
+
+    assert len(matcher) == len(names)
+    assert matcher.tolerance_for("person_0", 0.6) == 0.61
+    # Moved by as much as the calibrated tolerance
+    assert matcher.tolerance_for("person_0", 0.5) == pytest.approx(0.51)
+    assert QuantizedGallery.from_encodings(encodings).threshold(0.5) == 0.5
+    with pytest.raises(ValueError):
+        FaceMatcher(gallery, names, metric="cosine")
+
+
+def test_save_and_load(tmp_path):
+    centres, encodings, names = synthetic_gallery(people=10)
+    gallery = QuantizedGallery.from_encodings(encodings)
+    gallery.calibrate(encodings, tolerance=0.6)
+    gallery.save(str(tmp_path / "gallery.npz"))
+
+    loaded = QuantizedGallery.load(str(tmp_path / "gallery.npz"))
+
+    np.testing.assert_array_equal(loaded.codes, gallery.codes)
+    assert loaded.threshold(0.6) == gallery.threshold(0.6)
+
+
+def test_extend_keeps_scale_and_thresholds():
+    centres, encodings, names = synthetic_gallery(people=10)
+    gallery = QuantizedGallery.from_encodings(encodings[:-3])
+    gallery.calibrate(encodings[:-3], tolerance=0.6)
+
+    extended = gallery.extend(encodings[-3:])
+
+    assert len(extended) == len(encodings) and len(gallery) == len(encodings) - 3
+    np.testing.assert_array_equal(extended.scale, gallery.scale)
+    np.testing.assert_array_equal(extended.codes[:-3], gallery.codes)
+    assert extended.threshold(0.6) == gallery.threshold(0.6)
+    matcher = FaceMatcher(extended, names)
+    assert matcher.best_match(encodings[-1], 0.6)[0] == names[-1]
@@ -0,0 +1,81 @@
+import csv
+
+from face_logger_report import AttendanceAggregator, build_report
+
+
+def write_log(path, rows, mode='w'):
+    with open(path, mode, newline='') as f:
+        writer = csv.writer(f)
+        if mode == 'w':
+            writer.writerow(["Timestamp", "Name", "Status"])
+        writer.writerows(rows)
+
+
+def read_summary(path):
+    with open(path, newline='', encoding="utf-8") as f:
+        return list(csv.reader(f))[1:]
+
+
+def test_visits_and_presence():
+    aggregator = AttendanceAggregator(gap_seconds=1800)
+    for timestamp in ["2024-05-02 08:00:00", "2024-05-02 08:10:00", "2024-05-02 12:00:00",
+                      "2024-05-02 12:30:00", "2024-05-02 07:59:00"]:
+        aggregator.add(timestamp, "Alice")
+
+    assert aggregator.open_rows() == [["2024-05-02", "Alice", "07:59:00", "12:30:00", 2, 40.0]]
+
+
+def test_earlier_days_are_closed_by_a_later_row():
+    aggregator = AttendanceAggregator()
+    aggregator.add("2024-05-02 08:00:00", "Alice")
+    aggregator.add("2024-05-03 08:00:00", "Bob")
+
+    assert [row[:2] for row in aggregator.pop_closed_days()] == [["2024-05-02", "Alice"]]
+    aggregator.add("2024-05-02 09:00:00", "Alice")
+    assert aggregator.late_rows == 1
+    assert list(aggregator.open_days) == ["2024-05-03"]
+
+
+def test_malformed_timestamps_are_skipped(tmp_path, capsys):
+    log_path = str(tmp_path / "logs.csv")
+    write_log(log_path, [["2024-05-02 08:00:00", "Alice", "Recognized"],
+                         ["2024-05-02 08:0", "Alice", "Recognized"],
+                         ["garbage", "Bob", "Recognized"],
+                         ["2024-05-02 09:00:00", "Bob", "Recognized"]])
+
+    build_report(log_path, str(tmp_path / "attendance.csv"))
+
+    assert [row[1] for row in read_summary(str(tmp_path / "attendance.csv"))] == ["Alice", "Bob"]
+    assert "Skipped 2 rows with a malformed timestamp" in capsys.readouterr().out
+
+
+def test_cursor_only_reads_new_rows(tmp_path):
+    log_path = str(tmp_path / "logs.csv")
+    summary_path = str(tmp_path / "attendance.csv")
+    cursor_path = str(tmp_path / "cursor.json")
+    write_log(log_path, [["2024-05-02 08:00:00", "Alice", "Recognized"],
+                         ["2024-05-02 08:05:00", "Unknown", "Detected"]])
+    assert build_report(log_path, summary_path, cursor_path) == 2
+
+    write_log(log_path, [["2024-05-02 17:00:00", "Alice", "Recognized"],
+                         ["2024-05-03 08:00:00", "Bob", "Recognized"]], mode='a')
+    assert build_report(log_path, summary_path, cursor_path) == 2
+
+    assert read_summary(summary_path) == [
+        ["2024-05-02", "Alice", "08:00:00", "17:00:00", "2", "0.0"],
+        ["2024-05-03", "Bob", "08:00:00", "08:00:00", "1", "0.0"]]
+    assert build_report(log_path, summary_path, cursor_path) == 0
+
+
+def test_changed_gap_rebuilds_the_report(tmp_path, capsys):
+    log_path = str(tmp_path / "logs.csv")
+    summary_path = str(tmp_path / "attendance.csv")
+    cursor_path = str(tmp_path / "cursor.json")
+    write_log(log_path, [["2024-05-02 08:00:00", "Alice", "Recognized"],
+                         ["2024-05-02 09:00:00", "Alice", "Recognized"]])
+    build_report(log_path, summary_path, cursor_path, gap_minutes=30)
+    assert read_summary(summary_path)[0][4] == "2"
+
+    assert build_report(log_path, summary_path, cursor_path, gap_minutes=90) == 2
+    assert read_summary(summary_path) == [["2024-05-02", "Alice", "08:00:00", "09:00:00", "1", "60.0"]]
+    assert "gap changed from 30 to 90 minutes" in capsys.readouterr().out
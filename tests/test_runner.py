@@ -0,0 +1,68 @@
+import os
+import time
+
+from face_recognition.runner import TaskRunner
+
+
+def slow_square(value, delay):
+    time.sleep(delay)
+    return value * value
+
+
+def square_or_crash(value):
+    if value == 3:
+        os._exit(1) # as a crash inside dlib would
+    return value * value
+
+
+_attempts = {}
+
+
+def flaky(value):
+    _attempts[value] = _attempts.get(value, 0) + 1
+    if value == 1 and _attempts[value] == 1:
+        raise TimeoutError("share briefly unavailable")
+    if value == 2:
+        raise ValueError("corrupt image")
+    return value
+
+
+def test_results_are_reordered_into_task_order():
+    # Earlier tasks take longest, so they finish last
+    tasks = [(value, 0.05 * (6 - value)) for value in range(6)]
+    runner = TaskRunner(slow_square, processes=3, show_progress=False)
+
+    results = list(runner.run(tasks))
+    assert [result.index for result in results] == list(range(6))
+    assert [result.value for result in results] == [value * value for value in range(6)]
+    assert runner.failed == []
+
+
+def test_unordered_results_arrive_as_they_finish():
+    tasks = [(value, 0.05 * (6 - value)) for value in range(6)]
+    runner = TaskRunner(slow_square, processes=3, ordered=False, show_progress=False)
+
+    results = list(runner.run(tasks))
+    assert sorted(result.index for result in results) == list(range(6))
+    assert [result.index for result in results] != list(range(6))
+
+
+def test_a_crashing_task_fails_alone():
+    runner = TaskRunner(square_or_crash, processes=2, show_progress=False)
+
+    results = list(runner.run([(value,) for value in range(6)]))
+    assert [result.value for result in results] == [0, 1, 4, None, 16, 25]
+    assert [(result.index, result.error) for result in runner.failed] == [(3, "worker process crashed")]
+    # In the pool, then on its own, then once more for crash_retries=1
+    assert runner.worker_crashes == 3
+    assert "FAILED 3: worker process crashed" in runner.summary()
+
+
+def test_transient_errors_are_retried():
+    _attempts.clear()
+    runner = TaskRunner(flaky, processes=1, show_progress=False)
+
+    results = list(runner.run([(value,) for value in range(3)]))
+    assert [(result.value, result.attempts) for result in results] == [(0, 1), (1, 2), (None, 1)]
+    assert runner.failed[0].error == "ValueError: corrupt image"
+    assert runner.retried == 1
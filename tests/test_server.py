@@ -0,0 +1,146 @@
+import asyncio
+import io
+import json
+import threading
+
+import numpy as np
+import PIL.Image
+import pytest
+
+import face_logger_server
+import face_recognition
+from face_logger_server import RecognitionServer, RecognitionService
+
+
+class FakeService:
+    def recent_events(self, limit=50):
+        return [{"name": "Alice"}][-limit:] if limit > 0 else []
+
+
+async def _request(raw):
+    server = RecognitionServer(FakeService())
+    listener = await asyncio.start_server(server.handle_connection, "127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(raw)
+        await writer.drain()
+        status_line = await reader.readline()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers["content-length"]))
+        writer.close()
+        return int(status_line.split()[1]), json.loads(body)
+    finally:
+        listener.close()
+        await listener.wait_closed()
+
+
+@pytest.mark.parametrize("content_length", ["abc", "-5"])
+def test_bad_content_length_is_a_bad_request(content_length):
+    raw = "POST /identify HTTP/1.1\r\nContent-Length: {}\r\n\r\n".format(content_length).encode("latin-1")
+    status, payload = asyncio.run(_request(raw))
+    assert status == 400
+    assert "Content-Length" in payload["error"]
+
+
+def test_bad_limit_is_a_bad_request():
+    status, payload = asyncio.run(_request(b"GET /events?limit=ten HTTP/1.1\r\nConnection: close\r\n\r\n"))
+    assert status == 400
+    assert "limit" in payload["error"]
+
+
+def test_events_limit():
+    status, payload = asyncio.run(_request(b"GET /events?limit=1 HTTP/1.1\r\nConnection: close\r\n\r\n"))
+    assert (status, payload) == (200, {"events": [{"name": "Alice"}]})
+
+
+def test_body_over_the_limit_is_rejected():
+    raw = "POST /identify HTTP/1.1\r\nContent-Length: {}\r\n\r\n".format(11 * 1024 * 1024).encode("latin-1")
+    status, _ = asyncio.run(_request(raw))
+    assert status == 413
+
+
+class FakePipeline:
+    """'Detects' as many faces as the value of the image's first pixel."""
+
+    def __init__(self, image, number_of_times_to_upsample=1, model="hog"):
+        self.face_locations = [(0, 10, 10, 0)] * int(image[0, 0, 0])
+
+    def face_chips(self):
+        return [None] * len(self.face_locations)
+
+
+def _image(faces):
+    f = io.BytesIO()
+    PIL.Image.new("RGB", (10, 10), (faces, 0, 0)).save(f, "PNG")
+    return f.getvalue()
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """A service over a two person gallery whose encoder returns the queued encodings in turn."""
+    gallery = np.zeros((2, 128), dtype=np.float32)
+    gallery[1, 0] = 1.0
+    loads, threads, encodings = [], {}, []
+
+    class Encoder(object):
+        def compute_face_descriptor(self, chips, num_jitters=1):
+            threads["encode"] = threading.current_thread()
+            return [encodings.pop(0) for _ in chips]
+
+    def save_encoding(name, face_encoding):
+        threads["save"] = threading.current_thread()
+        return f"faces/{name}/face_1.npy"
+
+    monkeypatch.setattr(face_logger_server, "load_gallery",
+                        lambda **kwargs: loads.append(kwargs) or (gallery, ["alice", "bob"]))
+    monkeypatch.setattr(face_logger_server, "load_thresholds", lambda: {})
+    monkeypatch.setattr(face_logger_server, "save_encoding", save_encoding)
+    monkeypatch.setattr(face_logger_server, "calibrate_gallery", lambda changed_names, gallery: {})
+    monkeypatch.setattr(face_logger_server, "VAULT_PATH", None)
+    monkeypatch.setattr(face_recognition, "FacePipeline", FakePipeline)
+    monkeypatch.setattr(face_recognition.api, "face_encoder", Encoder())
+    service = RecognitionService(tolerance=0.5)
+    service.loads, service.threads, service.encodings = loads, threads, encodings
+    yield service
+    asyncio.run(service.stop())
+
+
+def test_a_batch_is_matched_with_one_lookup(service):
+    lookups = []
+    top_k = service.matcher.top_k
+    service.matcher.top_k = lambda encodings, k: lookups.append(len(encodings)) or top_k(encodings, k)
+    far = np.full(128, 0.5, dtype=np.float32)
+    service.encodings.extend([np.zeros(128), np.eye(128)[0] * 0.9, far])
+
+    results = service._process_batch([_image(2), b"not an image", _image(1)])
+
+    assert lookups == [3]
+    assert [name for name, distance in results[0][2]] == ["alice", "bob"]
+    assert results[1].status == 400
+    assert results[2][2] == [(None, pytest.approx(np.linalg.norm(far)))]
+
+
+def test_enrolment_updates_the_gallery_in_memory_off_the_worker_thread(service):
+    new_face = np.full(128, 0.3, dtype=np.float32)
+
+    async def enrol_and_identify():
+        await service.start()
+        service.encodings.extend([new_face, new_face])
+        enrolled = await service.enrol("carol", _image(1))
+        identified = await service.identify(_image(1))
+        return enrolled, identified
+
+    enrolled, identified = asyncio.run(enrol_and_identify())
+
+    assert enrolled == {"name": "carol", "file": "faces/carol/face_1.npy", "known_faces": 3}
+    assert identified["faces"][0]["name"] == "carol"
+    # Loaded once at start up, not again for the enrolment
+    assert len(service.loads) == 1
+    assert service.threads["save"] is not service.threads["encode"]
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+from click.testing import CliRunner
+
+from face_recognition import shard
+from face_recognition.matcher import FaceMatcher
+from face_recognition.shard import ShardedMatcher, serve_shard
+
+
+@pytest.fixture
+def gallery():
+    rng = np.random.RandomState(0)
+    encodings = rng.normal(0, 0.1, (300, 128)).astype(np.float32)
+    names = ["person_{}".format(i // 3) for i in range(300)]
+    probes = encodings[::7] + rng.normal(0, 0.02, (43, 128)).astype(np.float32)
+    return encodings, names, probes
+
+
+def _assert_same_results(sharded, single, probes):
+    for got, expected in zip(sharded.top_k(probes, 5), single.top_k(probes, 5)):
+        assert [(index, name) for index, name, distance in got] == [(index, name) for index, name, distance in expected]
+        np.testing.assert_allclose([c[2] for c in got], [c[2] for c in expected], atol=1e-5)
+    for probe in probes:
+        assert sharded.best_match(probe, 0.6)[0] == single.best_match(probe, 0.6)[0]
+
+
+def _assert_balanced(matcher):
+    average = len(matcher) / float(len(matcher.shard_sizes))
+    assert max(matcher.shard_sizes) <= average * (1 + matcher.rebalance_slack) + 1
+
+
+def test_matches_a_single_face_matcher(gallery):
+    encodings, names, probes = gallery
+    thresholds = {"person_0": 0.2}
+
+    with ShardedMatcher(encodings, names, shards=3, thresholds=thresholds) as matcher:
+        assert sum(matcher.shard_sizes) == 300
+        _assert_same_results(matcher, FaceMatcher(encodings, names, thresholds=thresholds), probes)
+
+
+def test_uneven_adds_are_rebalanced_within_the_slack(gallery):
+    encodings, names, probes = gallery
+
+    with ShardedMatcher(encodings[:200], names[:200], shards=2) as matcher:
+        for start in range(200, 260, 20):
+            matcher.add(encodings[start:start + 20], names[start:start + 20])
+        matcher.add_shard()
+        assert matcher.shard_sizes[-1] > 0
+        _assert_balanced(matcher)
+        # Every row moves to the smallest shards until they catch up
+        matcher.add(encodings[260:], names[260:])
+        _assert_balanced(matcher)
+        _assert_same_results(matcher, FaceMatcher(encodings, names), probes)
+
+
+def test_thresholds_survive_a_rebalance(gallery):
+    encodings, names, probes = gallery
+    probe = encodings[0] + 0.01
+
+    with ShardedMatcher(encodings, names, shards=2, thresholds={"person_0": {"threshold": 0.05}}) as matcher:
+        distance = matcher.best_match(probe)[1]
+        assert 0.05 < distance < 0.6
+        matcher.add_shard()
+        matcher.add_shard()
+
+        assert matcher.best_match(probe) == (None, pytest.approx(distance))
+        assert matcher.tolerance_for("person_0") == 0.05
+
+
+def test_needs_a_shard():
+    with pytest.raises(ValueError, match="at least 1"):
+        ShardedMatcher(shards=0)
+
+
+def test_shard_servers_need_an_authkey():
+    with pytest.raises(ValueError, match="authkey"):
+        ShardedMatcher(addresses=[("127.0.0.1", 9)])
+    with pytest.raises(ValueError, match="authkey"):
+        serve_shard(("127.0.0.1", 0), None)
+
+
+def test_main_generates_an_authkey(monkeypatch):
+    served = []
+    monkeypatch.setattr(shard, "serve_shard", lambda address, authkey: served.append((address, authkey)))
+
+    result = CliRunner().invoke(shard.main, ["--address", "0.0.0.0:9100"], env={"FACE_RECOGNITION_SHARD_KEY": None})
+
+    assert result.exit_code == 0
+    (address, authkey), = served
+    assert address == ("0.0.0.0", 9100)
+    assert len(authkey) == 32 and authkey.decode("utf-8") in result.output
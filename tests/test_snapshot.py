@@ -0,0 +1,51 @@
+import os
+
+import numpy as np
+import pytest
+
+from face_recognition import face_recognition_cli
+from face_recognition.snapshot import GallerySnapshot, snapshot_paths
+
+
+def _snapshot(names):
+    encodings = np.random.RandomState(0).normal(0, 0.1, (len(names), 128)).astype(np.float32)
+    return GallerySnapshot(names, encodings, ["{}.jpg".format(name) for name in names],
+                           np.zeros((len(names), 2), dtype=np.int64), np.arange(len(names)))
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / "known")
+    snapshot = _snapshot(["alice", "bob"])
+    snapshot.save(path)
+
+    loaded = GallerySnapshot.load(path, mmap_mode="r")
+    assert loaded.names == ["alice", "bob"]
+    assert isinstance(loaded.encodings, np.memmap)
+    np.testing.assert_array_equal(loaded.encodings, snapshot.encodings)
+
+
+def test_index_from_another_save_is_not_used(tmp_path):
+    path = str(tmp_path / "known")
+    _snapshot(["alice", "bob"]).save(path)
+    index_path, encodings_path = snapshot_paths(path)
+    # As if another run had replaced the encodings but not yet the index
+    np.save(encodings_path, np.zeros((3, 128), dtype=np.float32))
+
+    assert GallerySnapshot.load(path) is None
+
+
+def test_worker_without_snapshot_fails_each_image_clearly(tmp_path):
+    path = str(tmp_path / "missing")
+    face_recognition_cli._load_snapshot_in_worker(path)
+
+    with pytest.raises(RuntimeError, match="missing"):
+        face_recognition_cli._recognise_image_in_worker("image.jpg", 0.6)
+
+
+def test_worker_loads_snapshot(tmp_path):
+    path = str(tmp_path / "known")
+    _snapshot(["alice"]).save(path)
+    face_recognition_cli._load_snapshot_in_worker(path)
+
+    assert face_recognition_cli._worker_known_names == ["alice"]
+    assert os.path.samefile(face_recognition_cli._worker_known_encodings.filename, snapshot_paths(path)[1])
@@ -0,0 +1,103 @@
+import os
+import threading
+from datetime import datetime, timedelta
+
+import cv2
+import numpy as np
+import pytest
+
+import face_logger_sources
+from face_logger_sources import (ImageSequenceSource, LatestFrameReader, VideoFileSource, is_image_sequence,
+                                open_source)
+
+
+@pytest.fixture
+def frames_dir(tmp_path):
+    for index in range(5):
+        cv2.imwrite(str(tmp_path / f"frame_{index:03d}.png"), np.full((8, 8, 3), index * 10, dtype=np.uint8))
+    return tmp_path
+
+
+def test_fps_and_start_time_stamp_frames(frames_dir):
+    start = datetime(2024, 5, 2, 7, 0, 0)
+    source = ImageSequenceSource(str(frames_dir), stride=2, fps=4.0, start_time=start)
+
+    frames = list(source)
+
+    assert [timestamp for _, timestamp in frames] == [start, start + timedelta(seconds=0.5),
+                                                      start + timedelta(seconds=1.0)]
+    assert [int(frame[0, 0, 0]) for frame, _ in frames] == [0, 20, 40]
+    assert source.frames_read == 3
+
+
+def test_without_fps_file_times_are_used(frames_dir):
+    path = frames_dir / "frame_000.png"
+    os.utime(path, (1714633200, 1714633200))
+    source = ImageSequenceSource(str(frames_dir / "frame_000.*"))
+
+    (frame, timestamp), = list(source)
+
+    assert timestamp == datetime.fromtimestamp(1714633200)
+
+
+def test_start_time_without_fps_is_rejected(frames_dir):
+    with pytest.raises(ValueError):
+        ImageSequenceSource(str(frames_dir), start_time=datetime(2024, 5, 2, 7, 0, 0))
+
+
+def test_open_source_picks_the_source_type(frames_dir, tmp_path):
+    assert is_image_sequence(str(frames_dir))
+    assert is_image_sequence(os.path.join("recordings", "cam[12]", "*.jpg"))
+    assert not is_image_sequence(os.path.join("recordings", "door.mp4"))
+
+    assert isinstance(open_source(str(frames_dir / "*.png")), ImageSequenceSource)
+    video = tmp_path / "door.mp4"
+    video.write_bytes(b"")
+    assert isinstance(open_source(str(video)), VideoFileSource)
+
+
+class BlockingCapture:
+    """Camera whose read() blocks until allowed, recording the calls made to it."""
+
+    def __init__(self, source):
+        self.calls = []
+        self.allow_read = threading.Event()
+
+    def isOpened(self):
+        return True
+
+    def set(self, prop, value):
+        self.calls.append(("set", prop))
+        return True
+
+    def read(self):
+        self.calls.append(("read",))
+        self.allow_read.wait(5.0)
+        return True, np.zeros((4, 4, 3), dtype=np.uint8)
+
+    def release(self):
+        self.calls.append(("release",))
+
+
+def test_reader_configures_the_camera_before_reading(monkeypatch):
+    monkeypatch.setattr(face_logger_sources.cv2, "VideoCapture", BlockingCapture)
+    reader = LatestFrameReader(0, buffer_size=1, fps=24)
+    capture = reader.capture
+    capture.allow_read.set()
+    assert reader.read()[0]
+    reader.release()
+
+    assert capture.calls[:2] == [("set", cv2.CAP_PROP_BUFFERSIZE), ("set", cv2.CAP_PROP_FPS)]
+
+
+def test_capture_is_released_only_after_the_last_read(monkeypatch):
+    monkeypatch.setattr(face_logger_sources.cv2, "VideoCapture", BlockingCapture)
+    reader = LatestFrameReader(0)
+    capture = reader.capture
+    reader._thread.join(0.2) # let the reader block in read()
+
+    reader.release() # times out waiting for the blocked read
+    assert ("release",) not in capture.calls
+    capture.allow_read.set()
+    reader._thread.join(5.0)
+    assert capture.calls[-2:] == [("read",), ("release",)]
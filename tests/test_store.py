@@ -0,0 +1,53 @@
+import sqlite3
+import time
+from datetime import datetime
+
+from face_logger_store import EventStore
+
+
+def test_camera_is_recorded(tmp_path):
+    with EventStore(str(tmp_path / "events.db")) as store:
+        store.add_event("Alice", "Recognized", datetime(2024, 5, 2, 8, 0, 0), camera=1)
+        store.add_event("Alice", "Recognized", datetime(2024, 5, 2, 9, 0, 0), camera="rtsp://door")
+        store.add_event("Bob", "Recognized", datetime(2024, 5, 2, 8, 30, 0))
+
+        assert store.first_in_last_out(camera="1") == [("2024-05-02", "Alice", "2024-05-02 08:00:00",
+                                                        "2024-05-02 08:00:00", 1)]
+        assert [row[1:] for row in store.first_in_last_out()] == [
+            ("Alice", "2024-05-02 08:00:00", "2024-05-02 09:00:00", 2),
+            ("Bob", "2024-05-02 08:30:00", "2024-05-02 08:30:00", 1)]
+
+
+def test_quiet_period_is_flushed_without_another_event(tmp_path):
+    path = str(tmp_path / "events.db")
+    store = EventStore(path, batch_size=64, flush_interval=0.05)
+    try:
+        store.add_event("Alice", "Recognized", camera=0)
+        time.sleep(0.5)
+        # Another connection only sees committed rows
+        with sqlite3.connect(path) as reader:
+            assert reader.execute("SELECT name, camera FROM events").fetchall() == [("Alice", "0")]
+    finally:
+        store.close()
+
+
+def test_cooldown_survives_a_restart(tmp_path):
+    path = str(tmp_path / "events.db")
+    with EventStore(path) as store:
+        store.add_event("Alice", "Recognized", datetime(2024, 5, 2, 8, 0, 0))
+        store.add_event("Alice", "Recognized", datetime(2024, 5, 2, 7, 0, 0))
+        store.add_event("Unknown", "Detected", datetime(2024, 5, 2, 9, 0, 0))
+
+    with EventStore(path) as store:
+        assert store.last_log_times() == {"Alice": datetime(2024, 5, 2, 8, 0, 0)}
+
+
+def test_export_and_import_round_trip(tmp_path):
+    with EventStore(str(tmp_path / "a.db")) as store:
+        store.add_event("Alice", "Recognized", datetime(2024, 5, 2, 8, 0, 0))
+        store.add_event("Unknown", "Detected", datetime(2024, 5, 3, 8, 0, 0))
+        assert store.export_csv(str(tmp_path / "logs.csv"), since="2024-05-02", until="2024-05-02") == 1
+
+    with EventStore(str(tmp_path / "b.db")) as store:
+        assert store.import_csv(str(tmp_path / "logs.csv"), camera="door") == 1
+        assert store.first_in_last_out(camera="door")[0][1] == "Alice"
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from face_logger_vault import GalleryVault, VaultError
+
+
+@pytest.fixture
+def gallery():
+    encodings = np.random.RandomState(0).normal(0, 0.1, (5, 128)).astype(np.float32)
+    return encodings, ["alice", "alice", "bob", "carol", "carol"]
+
+
+def test_round_trip(tmp_path, gallery):
+    encodings, names = gallery
+    path = str(tmp_path / "gallery.vault")
+    GalleryVault.create(path, "secret", encodings, names, {"alice": {"threshold": 0.5}}, 0.6).close()
+
+    vault = GalleryVault.unlock(path, "secret")
+    try:
+        assert vault.names == names
+        np.testing.assert_array_equal(vault.encodings, encodings)
+        assert (vault.thresholds, vault.tolerance) == ({"alice": {"threshold": 0.5}}, 0.6)
+    finally:
+        vault.close()
+
+
+def test_wrong_passphrase(tmp_path, gallery):
+    path = str(tmp_path / "gallery.vault")
+    GalleryVault.create(path, "secret", *gallery).close()
+
+    with pytest.raises(VaultError, match="Wrong passphrase"):
+        GalleryVault.unlock(path, "guess")
+
+
+def test_tampering_is_detected(tmp_path, gallery):
+    path = str(tmp_path / "gallery.vault")
+    GalleryVault.create(path, "secret", *gallery).close()
+    with open(path, 'r+b') as f:
+        f.seek(-100, 2)
+        byte = f.read(1)
+        f.seek(-100, 2)
+        f.write(bytes([byte[0] ^ 1]))
+
+    with pytest.raises(VaultError):
+        GalleryVault.unlock(path, "secret")
+
+
+def test_appends_are_seen_by_other_processes_and_survive_compaction(tmp_path, gallery):
+    encodings, names = gallery
+    path = str(tmp_path / "gallery.vault")
+    reader = GalleryVault.create(path, "secret", encodings, names)
+    writer = GalleryVault.unlock(path, "secret")
+    try:
+        new_encoding = np.full(128, 0.25, dtype=np.float32)
+        assert writer.add("bob", new_encoding) == 2
+        writer.set_thresholds({"bob": {"threshold": 0.4}}, 0.6)
+
+        reader.refresh()
+        assert reader.names == names + ["bob"]
+        np.testing.assert_array_equal(reader.encodings[-1], new_encoding)
+        assert reader.thresholds == {"bob": {"threshold": 0.4}}
+
+        writer.compact()
+        reader.refresh()
+        assert len(reader) == 6
+    finally:
+        reader.close()
+        writer.close()
+
+    vault = GalleryVault.unlock(path, "secret")
+    try:
+        assert vault.names == names + ["bob"]
+        np.testing.assert_array_equal(vault.encodings[:5], encodings)
+    finally:
+        vault.close()